@@ -0,0 +1,288 @@
+import os
+import re
+import time
+import asyncio
+import numpy as np
+from cache_utils import TTLCache
+from llm_gateway import metered
+from log_utils import get_logger
+from metrics import registry
+
+logger = get_logger("answer_cache")
+
+# 주제별 직접 질문 답변 캐시 - 같은 주제에서 거의 같은 질문이 오면 LLM 호출 없이 저장된 답변을 씀
+# 캐시할 답변은 방 대화와 학생 이름 없이 주제와 질문만으로 만들어 다른 조에 보내도 그 방의 내용이 새지 않음
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.85"))  # 질문 유사도(코사인) 하한
+# 유사도가 높아도 서로 다른 낱말이 이보다 많으면 다른 질문 (긴 질문의 "긍정적"↔"부정적" 한 낱말 차이)
+ANSWER_CACHE_MAX_TOKEN_DIFF = int(os.getenv("ANSWER_CACHE_MAX_TOKEN_DIFF", "0"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "1800"))  # 답변 유효 시간(초)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "128"))  # 주제별 답변 수 (넘으면 가장 오래 쓰이지 않은 답변부터 제거)
+ANSWER_CACHE_TOPICS = int(os.getenv("ANSWER_CACHE_TOPICS", "32"))  # 캐시를 유지하는 주제 수 (LRU)
+ANSWER_CACHE_MIN_CHARS = int(os.getenv("ANSWER_CACHE_MIN_CHARS", "3"))  # 정규화한 질문이 이보다 짧으면 캐시하지 않음
+
+VECTOR_BITS = 10  # 해시 벡터 차원 2^10 (항목당 4KB)
+_DIM = 1 << VECTOR_BITS
+_BASE = np.uint64(0x110000)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_NON_WORD = re.compile(r"[^0-9a-z가-힣]+")
+
+# 질문 정규화 - 같은 질문의 흔한 변형(띄어쓰기, 조사, 묻는 어미)을 같은 형태로 맞춤
+_QUESTION_ENDINGS = ("설명해주세요", "설명해줘요", "설명해줘", "알려주세요", "알려줘요", "알려줘", "무엇인가요",
+                     "무엇인지", "궁금해요", "궁금해", "뭔가요", "뭐예요", "뭐에요", "뭐야", "뭘까", "뭐지", "뭔지",
+                     "인가요", "이에요", "예요", "이야", "인지", "이란", "란", "요", "야")
+_PARTICLES = ("에서", "으로", "에게", "이란", "은", "는", "이", "가", "을", "를", "의", "에", "도", "로", "와", "과", "란", "랑")
+# 대화 맥락을 가리키는 말이 들어간 질문("이게 뭐야?", "아까 말한 거")은 캐시하지 않음
+_DEICTIC = {"이거", "이게", "이건", "그거", "그게", "그건", "저거", "저게", "저건", "아까", "방금", "위에", "얘", "쟤", "걔"}
+
+
+def question_tokens(text):
+    """질문 → 묻는 어미와 조사를 뗀 낱말 목록 ("재생 에너지의 단점이 뭐야?" → ["재생", "에너지", "단점"])"""
+    tokens = []
+    for token in _NON_WORD.sub(" ", str(text or "").lower()).split():
+        if token in _QUESTION_ENDINGS:
+            continue
+        for suffixes in (_QUESTION_ENDINGS, _PARTICLES):
+            for suffix in suffixes:
+                if token.endswith(suffix) and len(token) > len(suffix) + 1:
+                    token = token[:-len(suffix)]
+                    break
+        tokens.append(token)
+    return tokens
+
+
+def normalize_question(text):
+    """캐시 비교용 질문 형태 - 낱말을 띄어쓰기 없이 이어 붙임 ("재생 에너지" = "재생에너지")"""
+    return "".join(question_tokens(text))
+
+
+def token_difference(tokens, other_tokens):
+    """
+    두 질문의 낱말 중 상대 질문에 없는 낱말 목록 (띄어쓰기는 무시)
+    ("재생 에너지 단점" ↔ "재생에너지 단점" → [], "긍정적 영향" ↔ "부정적 영향" → ["긍정적", "부정적"])
+    """
+    joined, other_joined = "".join(tokens), "".join(other_tokens)
+    return [t for t in tokens if t not in other_joined] + [t for t in other_tokens if t not in joined]
+
+
+def text_vector(text):
+    """정규화한 텍스트의 글자 2·3-gram을 해시한 L2 정규화 벡터 (빈 텍스트는 0 벡터)"""
+    points = np.frombuffer(normalize_question(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(points) < 2:
+        return np.zeros(_DIM, dtype=np.float32)
+    bigrams = points[:-1] * _BASE + points[1:]
+    trigrams = bigrams[:-1] * _BASE + points[2:]
+    buckets = (np.concatenate([bigrams, trigrams]) * _GOLDEN) >> np.uint64(64 - VECTOR_BITS)
+    vector = np.bincount(buckets.astype(np.int64), minlength=_DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class TopicAnswers:
+    """한 주제의 답변 색인 - 질문 벡터 행렬과 항목별 만료·마지막 사용 시각 (NumPy로 한 번에 비교)"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.questions = np.zeros((0, _DIM), dtype=np.float32)
+        self.expires = np.zeros(0)  # 0이면 빈 칸
+        self.used = np.zeros(0)
+        self.entries = []  # 칸 → {question, words, answer, hits, tokens, created}
+        self.pending = []  # 생성 중인 답변 (질문 벡터, 질문 낱말, future)
+        self.lookups = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.saved_tokens = 0
+
+    def __len__(self):
+        return int((self.expires > time.monotonic()).sum())
+
+    def search(self, question, words, now, threshold, max_token_diff):
+        """
+        → 칸 번호 또는 None
+        - 코사인 유사도가 threshold 이상인 후보 중 서로 다른 낱말이 max_token_diff개 이하인 질문만 같은 질문
+        """
+        if not len(self.entries):
+            return None
+        scores = self.questions @ question
+        similar = (scores >= threshold) & (self.expires > now)
+        for slot in np.flatnonzero(similar):
+            if len(token_difference(words, self.entries[slot]["words"])) > max_token_diff:
+                similar[slot] = False
+        if not similar.any():
+            return None
+        return int(np.argmax(np.where(similar, scores, -1.0)))
+
+    def store(self, question, entry, now, ttl):
+        free = np.flatnonzero(self.expires <= now)
+        if len(free):
+            slot = int(free[0])
+        elif len(self.entries) < self.maxsize:
+            slot = len(self.entries)
+            self.questions = np.vstack([self.questions, question])
+            self.expires = np.append(self.expires, 0.0)
+            self.used = np.append(self.used, 0.0)
+            self.entries.append(None)
+        else:
+            slot = int(np.argmin(self.used))  # LRU
+        self.questions[slot] = question
+        self.expires[slot] = now + ttl
+        self.used[slot] = now
+        self.entries[slot] = entry
+
+
+# ✅ 주제별 직접 질문 답변 캐시
+class AnswerCache:
+    """
+    같은 주제의 여러 조가 거의 같은 질문을 GPT에게 할 때 답변을 재사용
+    - 질문을 글자 2·3-gram 해시 벡터로 만들어 주제별 색인과 코사인 유사도로 비교 (외부 서비스 없음)
+    - threshold 이상 비슷하고 서로 다른 낱말이 max_token_diff개 이하인 질문의 답변이 있으면 LLM 호출 없이 그 답변을 사용
+    - 비슷한 질문의 답변이 생성 중이면 기다렸다가 같은 답변을 사용 (수업 중 여러 조가 동시에 묻는 경우)
+    - 답변은 ttl초 후 만료, 주제별 size개를 넘으면 가장 오래 쓰이지 않은 답변부터 제거
+    - 캐시할 답변은 generate(on_delta, shared=True)로 만듦 - 질문한 방의 대화와 학생 이름 없이
+      주제와 질문만으로 생성해야 함 (다른 조에 그대로 보내므로)
+    """
+
+    def __init__(self, enabled=ANSWER_CACHE_ENABLED, threshold=ANSWER_CACHE_THRESHOLD,
+                 max_token_diff=ANSWER_CACHE_MAX_TOKEN_DIFF, ttl=ANSWER_CACHE_TTL,
+                 size=ANSWER_CACHE_SIZE, topics=ANSWER_CACHE_TOPICS, min_chars=ANSWER_CACHE_MIN_CHARS):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_token_diff = max_token_diff
+        self.ttl = ttl
+        self.size = size
+        self.min_chars = min_chars
+        self._topics = TTLCache(maxsize=topics, ttl=None)  # topic_id → TopicAnswers
+        self.skipped_contextual = 0
+        self.totals = {"lookups": 0, "hits": 0, "coalesced": 0, "saved_tokens": 0}  # 누적 (/metrics)
+
+    def _topic(self, topic_id):
+        topic = self._topics.get(topic_id)
+        if topic is None:
+            topic = TopicAnswers(self.size)
+            self._topics.set(topic_id, topic)
+        return topic
+
+    def _count(self, topic, key, amount=1):
+        setattr(topic, key, getattr(topic, key) + amount)
+        self.totals[key] += amount
+
+    async def answer(self, topic_id, question, generate, on_delta=None):
+        """
+        캐시된 답변 또는 generate(on_delta, shared)로 새로 만든 답변
+        - shared=False: 캐시하지 않는 답변 (꺼져 있거나, 짧거나, 대화 맥락을 가리키는 질문) - 방 대화를 써도 됨
+        - shared=True: 캐시해서 다른 조에도 보낼 답변 - 방 대화와 학생 이름 없이 생성
+        - generate가 예외를 내면 저장하지 않고 그대로 전달
+        - 캐시한 답변은 on_delta로 한 번에 보냄
+        """
+        if not self.enabled or topic_id is None:
+            return await generate(on_delta, shared=False)
+        words = question_tokens(question)
+        if len("".join(words)) < self.min_chars or _DEICTIC.intersection(words):
+            self.skipped_contextual += 1
+            return await generate(on_delta, shared=False)
+
+        topic = self._topic(topic_id)
+        question_vector = text_vector(question)
+        now = time.monotonic()
+        self._count(topic, "lookups")
+        slot = topic.search(question_vector, words, now, self.threshold, self.max_token_diff)
+        if slot is not None:
+            entry = topic.entries[slot]
+            entry["hits"] += 1
+            topic.used[slot] = now
+            self._count(topic, "hits")
+            self._count(topic, "saved_tokens", entry["tokens"])
+            logger.debug("💾 캐시된 답변 사용 (%s): %s → %s", topic_id, question, entry["question"])
+            return await self._deliver(entry["answer"], on_delta)
+
+        for pending_question, pending_words, future in topic.pending:
+            if pending_question @ question_vector < self.threshold \
+                    or len(token_difference(words, pending_words)) > self.max_token_diff:
+                continue
+            entry = await asyncio.shield(future)
+            if entry is not None:
+                self._count(topic, "coalesced")
+                self._count(topic, "saved_tokens", entry["tokens"])
+                return await self._deliver(entry["answer"], on_delta)
+            break  # 먼저 생성하던 요청이 실패하면 직접 생성
+
+        future = asyncio.get_running_loop().create_future()
+        pending = (question_vector, words, future)
+        topic.pending.append(pending)
+        try:
+            with metered() as meter:
+                text = await generate(on_delta, shared=True)
+            entry = {"question": question, "words": words, "answer": text, "hits": 0, "created": now,
+                     "tokens": meter.prompt_tokens + meter.completion_tokens}
+            topic.store(question_vector, entry, time.monotonic(), self.ttl)
+            future.set_result(entry)
+            return text
+        finally:
+            topic.pending = [p for p in topic.pending if p is not pending]  # 벡터가 든 튜플은 == 비교 불가
+            if not future.done():
+                future.set_result(None)
+
+    @staticmethod
+    async def _deliver(text, on_delta):
+        if on_delta is not None:
+            await on_delta(text)
+        return text
+
+    def invalidate(self, topic_id):
+        """교사가 주제를 수정했을 때 그 주제의 답변을 모두 버림 → 버린 답변 수"""
+        topic = self._topics.pop(topic_id)
+        return len(topic) if topic is not None else 0
+
+    def topic_stats(self, topic_id):
+        """교사용 주제별 통계 (적중률, 절약한 토큰, 많이 쓰인 답변 순 질문 목록)"""
+        topic = self._topics.get(topic_id)
+        if topic is None:
+            return {"enabled": self.enabled, "entries": 0, "lookups": 0, "hits": 0, "coalesced": 0,
+                    "hit_rate": None, "saved_tokens": 0, "questions": []}
+        now = time.monotonic()
+        questions = [
+            {"question": entry["question"], "hits": entry["hits"], "age_seconds": round(now - entry["created"]),
+             "expires_in_seconds": round(topic.expires[slot] - now)}
+            for slot, entry in enumerate(topic.entries) if entry is not None and topic.expires[slot] > now
+        ]
+        questions.sort(key=lambda q: q["hits"], reverse=True)
+        return {
+            "enabled": self.enabled,
+            "entries": len(questions),
+            "lookups": topic.lookups,
+            "hits": topic.hits,
+            "coalesced": topic.coalesced,
+            "hit_rate": round((topic.hits + topic.coalesced) / topic.lookups, 3) if topic.lookups else None,
+            "saved_tokens": topic.saved_tokens,
+            "questions": questions,
+        }
+
+    def stats(self):
+        totals = self.totals
+        return {
+            "enabled": self.enabled,
+            "topics": len(self._topics),
+            "entries": sum(len(topic) for topic in self._topics.values()),
+            **totals,
+            "skipped_contextual": self.skipped_contextual,
+            "hit_rate": round((totals["hits"] + totals["coalesced"]) / totals["lookups"], 3)
+            if totals["lookups"] else None,
+        }
+
+    def collect(self):
+        """/metrics 수집 함수"""
+        totals = self.totals
+        misses = totals["lookups"] - totals["hits"] - totals["coalesced"]
+        samples = [("chat_answer_cache_entries", "gauge", "캐시된 직접 질문 답변 수", {},
+                    sum(len(topic) for topic in self._topics.values())),
+                   ("chat_answer_cache_saved_tokens_total", "counter", "캐시된 답변으로 아낀 토큰 수 (추정)", {},
+                    totals["saved_tokens"])]
+        for result, count in (("hit", totals["hits"]), ("coalesced", totals["coalesced"]), ("miss", misses),
+                              ("contextual", self.skipped_contextual)):
+            samples.append(("chat_answer_cache_lookups_total", "counter",
+                            "직접 질문 답변 캐시 조회 결과 (coalesced: 생성 중인 답변 공유, contextual: 짧거나 대화 맥락을 가리켜 캐시 안 함)",
+                            {"result": result}, count))
+        return samples
+
+
+answer_cache = AnswerCache()
+registry.add_collector(answer_cache.collect)
@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+from gpt_handler import evaluate_conversation, EVALUATION_ERROR_TEXT
+from evaluation_cache import evaluation_cache, evaluation_key, lookup_evaluations
+from supabase_repo import repo
+from log_utils import get_logger
+
+logger = get_logger("evaluation")
+
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "40"))  # 동시에 진행할 평가 수
+
+
+async def load_topic_jobs(topic_id, per_student=True):
+    """
+    주제의 모든 방 대화를 불러와 평가 작업 목록을 만듭니다.
+    - 방마다 전체(group) 평가 1개 + per_student면 발화한 학생별(individual) 평가
+    - 긴 방도 처음 max-rows개에서 잘리지 않도록 대화는 키셋 페이지로 끝까지 읽음
+    - 반환값: (topic, jobs) - topic이 없으면 (None, [])
+    """
+    topic = await repo.get_topic(topic_id)
+    if not topic:
+        return None, []
+
+    rooms = await repo.list_rooms(topic_id)
+    transcripts = await asyncio.gather(*(
+        repo.list_all_messages(room["room_id"], select="sender_id,message") for room in rooms
+    ))
+
+    jobs = []
+    for room, messages in zip(rooms, transcripts):
+        if not messages:
+            continue
+        jobs.append({"room_id": room["room_id"], "room_title": room.get("title"),
+                     "student_id": None, "messages": messages})
+        if per_student:
+            students = dict.fromkeys(m["sender_id"] for m in messages if m["sender_id"] != "gpt")
+            for student_id in students:
+                jobs.append({
+                    "room_id": room["room_id"],
+                    "room_title": room.get("title"),
+                    "student_id": student_id,
+                    "messages": [m for m in messages if m["sender_id"] == student_id],
+                })
+    return topic, jobs
+
+
+async def evaluate_topic(topic, jobs, rubric_prompt=None, concurrency=EVAL_CONCURRENCY, force_refresh=False):
+    """
+    평가 작업을 동시에 실행하고 끝나는 순서대로 결과를 내보내는 비동기 제너레이터
+    - 루브릭과 대화가 그대로인 작업은 저장된 평가를 재사용 (새 메시지가 생긴 방/학생만 다시 평가)
+    - 동시 실행 수는 concurrency로 제한, 요청 속도(rpm/tpm)는 LLM 게이트웨이가 배치 우선순위로 관리
+    - 모든 결과가 나오면 새로 만든 평가를 gpt_chat_evaluations에 한 번에 저장하고
+      마지막으로 {"type": "done", ...}을 내보냄
+    """
+    rubric_prompt = rubric_prompt or topic.get("rubric_prompt") or ""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    started = time.perf_counter()
+
+    keys = [evaluation_key(rubric_prompt, job["messages"], job["student_id"]) for job in jobs]
+    cached = {} if force_refresh else await lookup_evaluations(keys)
+
+    async def run(job, cache_key):
+        if cache_key in cached:
+            return job, cache_key, cached[cache_key], True, 0.0
+        async with semaphore:
+            job_started = time.perf_counter()
+            feedback = await evaluate_conversation(rubric_prompt, job["messages"], job["student_id"])
+            if feedback != EVALUATION_ERROR_TEXT:
+                evaluation_cache.set(cache_key, feedback)
+            return job, cache_key, feedback, False, time.perf_counter() - job_started
+
+    rows = []
+    failed = 0
+    hits = 0
+    for next_result in asyncio.as_completed([run(job, key) for job, key in zip(jobs, keys)]):
+        job, cache_key, feedback, from_cache, duration = await next_result
+        ok = feedback != EVALUATION_ERROR_TEXT
+        if from_cache:
+            hits += 1
+        elif ok:
+            rows.append({
+                "topic_id": topic["topic_id"],
+                "room_id": job["room_id"],
+                "class_id": topic.get("class_id"),
+                "student_id": job["student_id"],
+                "conversation_id": None,
+                "summary": feedback,
+                "evaluation_type": "individual" if job["student_id"] else "group",
+                "cache_key": cache_key,
+            })
+        else:
+            failed += 1
+        yield {
+            "type": "result",
+            "room_id": job["room_id"],
+            "room_title": job["room_title"],
+            "student_id": job["student_id"],
+            "feedback": feedback,
+            "ok": ok,
+            "cached": from_cache,
+            "duration_ms": round(duration * 1000, 1),
+        }
+
+    saved = 0
+    if rows:
+        try:
+            saved = len(await repo.insert_evaluations(rows))
+        except Exception as e:
+            logger.error("❌ 평가 결과 일괄 저장 실패 (%d개): %s", len(rows), e)
+
+    yield {
+        "type": "done",
+        "total": len(jobs),
+        "cached": hits,
+        "failed": failed,
+        "saved": saved,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
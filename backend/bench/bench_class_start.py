@@ -0,0 +1,104 @@
+"""
+수업 시작 입장 폭주(thundering herd) 벤치마크
+
+수업이 시작되면 방마다 학생 30명이 수백 ms 안에 한꺼번에 들어오고, 입장 경로에서 각자
+- get_student_name(학생 ID)
+- get_system_prompt(room_id)
+- get_room_history(room_id, 500)
+을 호출합니다. 로컬 PostgREST 스텁(응답 지연 --latency)을 띄워 같은 입장 폭주를
+- before: 같은 GET 요청 합치기/최근 응답 재사용 끔 (SUPABASE_COALESCE_READS=false)
+- after : 합치기 + SUPABASE_READ_CACHE_TTL초 재사용
+로 실행하고, 스텁이 받은 요청 수와 학생별 입장 지연(p50/p95/p99)을 비교합니다.
+
+실행: python bench/bench_class_start.py --rooms 10 --students 30 --spread 0.3 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stub_postgrest import start_stub, demo_seed  # noqa: E402
+from bench.loadtest_scaleout import percentile  # noqa: E402
+from supabase_repo import repo  # noqa: E402
+from supabase_client import (  # noqa: E402
+    get_room_history,
+    get_student_name,
+    get_system_prompt,
+    room_prompt_cache,
+    student_name_cache,
+)
+
+
+async def join(room_id, student_id, delay, history_limit):
+    await asyncio.sleep(delay)
+    started = time.perf_counter()
+    await asyncio.gather(
+        get_student_name(student_id),
+        get_system_prompt(room_id),
+        get_room_history(room_id, history_limit),
+    )
+    return time.perf_counter() - started
+
+
+async def class_start(label, stub, args):
+    # 앱 수준 캐시(학생 이름, 방 프롬프트)도 비워 매번 수업 첫 입장과 같은 상태에서 시작
+    student_name_cache.clear()
+    room_prompt_cache.clear()
+    repo.read_stats = {key: 0 for key in repo.read_stats}
+    requests_before = stub.request_count
+
+    rng = random.Random(args.seed)
+    joins = [
+        join(f"room-{r}", f"2s{r:02d}{s:02d}", rng.uniform(0, args.spread), args.history)
+        for r in range(args.rooms) for s in range(args.students)
+    ]
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*joins)
+    elapsed = time.perf_counter() - started
+
+    requests = stub.request_count - requests_before
+    print(f"{label:<34} {requests:>5} Supabase req  "
+          f"p50={percentile(latencies, 0.5) * 1000:7.1f}ms  p95={percentile(latencies, 0.95) * 1000:7.1f}ms  "
+          f"p99={percentile(latencies, 0.99) * 1000:7.1f}ms  total {elapsed:5.2f}s  {repo.read_stats}")
+    return requests, percentile(latencies, 0.95)
+
+
+async def main(args):
+    seed = demo_seed(rooms=args.rooms, students_per_room=args.students, messages_per_room=args.messages)
+    stub, runner, base_url = await start_stub(latency=args.latency, seed=seed)
+    repo.base_url = base_url
+    repo.api_key = repo.service_key = "bench"
+    await repo.start()
+    try:
+        print(f"{args.rooms} rooms x {args.students} students, spread {args.spread}s, "
+              f"Supabase latency {args.latency * 1000:.0f}ms, history limit {args.history}")
+        repo.coalesce_reads = False
+        before_requests, before_p95 = await class_start("before (every join queries)", stub, args)
+
+        repo.coalesce_reads = True
+        repo.read_cache_ttl = args.cache_ttl
+        after_requests, after_p95 = await class_start(f"after (single-flight + {args.cache_ttl:g}s reuse)",
+                                                      stub, args)
+
+        print(f"Supabase requests: x{before_requests / max(1, after_requests):.1f} fewer  "
+              f"join p95: x{before_p95 / max(after_p95, 1e-9):.2f} faster")
+    finally:
+        await repo.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--students", type=int, default=30, help="방별 학생 수")
+    parser.add_argument("--messages", type=int, default=500, help="방별 기존 메시지 수")
+    parser.add_argument("--history", type=int, default=500, help="입장 시 불러오는 기록 수")
+    parser.add_argument("--spread", type=float, default=0.3, help="입장 시각이 퍼지는 구간(초)")
+    parser.add_argument("--latency", type=float, default=0.05, help="스텁 서버의 인위적 응답 지연(초)")
+    parser.add_argument("--cache-ttl", type=float, default=0.5, help="after 실행의 최근 응답 재사용 시간(초)")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""
+긴 대화 평가 벤치마크 (한 번의 호출 vs map-reduce)
+
+메시지 수천 개짜리 합성 방을 만들고, 로컬 OpenAI 스텁(bench/stub_openai.py)을 상대로
+- single   : evaluate_conversation(mode="single") - 앞부분을 차례로 요약에 합친 뒤 한 번에 평가 (직렬)
+- mapreduce: evaluate_conversation(mode="mapreduce") - 구간별 동시 평가 후 한 번에 종합
+의 방당 소요 시간(wall-clock)과 호출 수를 비교합니다.
+
+스텁의 응답 시간은 입력/출력 토큰 수에 비례하며 --time-scale로 전체를 줄여 빠르게 돌릴 수 있습니다.
+(보고되는 시간도 time-scale이 적용된 값입니다.)
+
+실행: python bench/bench_mapreduce_eval.py --rooms 3 --messages 5000 --time-scale 0.1
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+from openai import AsyncOpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stub_openai import start_stub  # noqa: E402
+import gpt_handler  # noqa: E402
+from llm_gateway import gateway, PriorityLimiter  # noqa: E402
+from llm_backends import OpenAIBackend  # noqa: E402
+
+PHRASES = [
+    "저는 이 의견에 동의하지 않아요", "근거가 조금 부족한 것 같아요", "자료를 보면 반대 결과가 나와요",
+    "그럼 다른 예시를 들어볼게요", "좋은 질문이에요", "우리 조는 찬성 쪽으로 정리하면 어떨까요",
+    "에너지 사용량이 줄어든다는 통계가 있어요", "하지만 비용 문제도 생각해야 해요",
+    "앞에서 말한 내용이랑 연결되는데요", "결론부터 말하면 둘 다 장단점이 있어요",
+]
+
+
+def synthetic_room(room_index, message_count, students=5, seed=0):
+    rng = random.Random(seed + room_index)
+    student_ids = [f"2s{room_index:02d}{s:02d}" for s in range(students)]
+    messages = []
+    for _ in range(message_count):
+        words = rng.sample(PHRASES, rng.randint(1, 3))
+        messages.append({"sender_id": rng.choice(student_ids), "message": ", ".join(words) + "."})
+    return messages
+
+
+async def run_mode(mode, stub, rooms, rubric, target_student):
+    stub.reset()
+    durations = []
+    for messages in rooms:
+        target = target_student and messages[0]["sender_id"]
+        started = time.perf_counter()
+        feedback = await gpt_handler.evaluate_conversation(rubric, messages, target, mode=mode)
+        durations.append(time.perf_counter() - started)
+        if feedback == gpt_handler.EVALUATION_ERROR_TEXT:
+            raise RuntimeError(f"{mode} 평가 실패")
+    average = sum(durations) / len(durations)
+    print(f"{mode:<10} {len(rooms)} rooms  avg {average:7.2f}s  max {max(durations):7.2f}s  "
+          f"calls {stub.calls:>4}  peak in-flight {stub.peak_in_flight:>3}  "
+          f"tokens in={stub.prompt_tokens} out={stub.completion_tokens}")
+    return average
+
+
+async def main(args):
+    stub, runner, base_url = await start_stub(time_scale=args.time_scale)
+    gateway.backend = OpenAIBackend(AsyncOpenAI(base_url=base_url, api_key="bench", max_retries=0))
+    # 계정 한도는 스텁 시간 배율과 무관하므로 기본은 제한 없이 측정 (--rpm/--tpm으로 지정 가능)
+    gateway.limiter = PriorityLimiter(concurrency=0, rpm=args.rpm, tpm=args.tpm)
+    try:
+        rooms = [synthetic_room(r, args.messages, args.students) for r in range(args.rooms)]
+        rubric = "1) 주장의 근거 2) 다른 의견에 대한 반응 3) 참여도"
+        print(f"window={gpt_handler.EVAL_WINDOW_TOKENS} tokens  concurrency={gpt_handler.EVAL_MAP_CONCURRENCY}  "
+              f"budget={gpt_handler.EVAL_CONTEXT_TOKENS} tokens  target={'first student' if args.target else 'group'}")
+        single = await run_mode("single", stub, rooms, rubric, args.target)
+        mapreduce = await run_mode("mapreduce", stub, rooms, rubric, args.target)
+        print(f"speedup: x{single / mapreduce:.2f}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=5000, help="방당 메시지 수")
+    parser.add_argument("--students", type=int, default=5, help="방당 학생 수")
+    parser.add_argument("--target", action="store_true", help="방 전체 대신 첫 학생 개인 평가로 측정")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="스텁 응답 시간 배율")
+    parser.add_argument("--rpm", type=float, default=0, help="게이트웨이 분당 요청 한도 (0이면 제한 없음)")
+    parser.add_argument("--tpm", type=float, default=0, help="게이트웨이 분당 토큰 한도 (0이면 제한 없음)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,98 @@
+"""
+Supabase 접근 계층 벤치마크 (요청마다 새 세션 vs 공유 커넥션 풀)
+
+로컬 PostgREST 스텁 서버를 띄운 뒤 같은 워크로드(학생 조회, 메시지 조회, 메시지 저장)를
+- before: 기존 make_supabase_request 방식 (요청마다 aiohttp.ClientSession 생성)
+- after : supabase_repo.SupabaseRepository (앱 전체가 하나의 풀을 공유)
+로 실행하여 초당 요청 수를 비교합니다.
+
+실행: python bench/bench_supabase_pool.py --requests 3000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stub_postgrest import start_stub, demo_seed  # noqa: E402
+from supabase_repo import SupabaseRepository  # noqa: E402
+
+HEADERS = {"apikey": "bench", "Authorization": "Bearer bench", "Content-Type": "application/json"}
+
+
+def workload(i):
+    room = f"room-{i % 10}"
+    student = f"2s{i % 10:02d}{i % 30:02d}"
+    return i % 3, room, student
+
+
+async def before_call(base_url, i):
+    kind, room, student = workload(i)
+    async with aiohttp.ClientSession() as session:
+        if kind == 0:
+            url = f"{base_url}/rest/v1/students?student_id=eq.{student}&select=name"
+            async with session.get(url, headers=HEADERS) as response:
+                return await response.json()
+        if kind == 1:
+            url = f"{base_url}/rest/v1/messages?room_id=eq.{room}&select=message_id,message&order=timestamp.desc&limit=20"
+            async with session.get(url, headers=HEADERS) as response:
+                return await response.json()
+        url = f"{base_url}/rest/v1/messages"
+        data = {"room_id": room, "sender_id": student, "message": "bench", "role": "user"}
+        async with session.post(url, headers={**HEADERS, "Prefer": "return=representation"}, json=data) as response:
+            return await response.json()
+
+
+async def after_call(repo, i):
+    kind, room, student = workload(i)
+    if kind == 0:
+        return await repo.get_student(student)
+    if kind == 1:
+        return await repo.list_messages(room, select="message_id,message", order="timestamp.desc", limit=20)
+    return await repo.insert_message({"room_id": room, "sender_id": student, "message": "bench", "role": "user"})
+
+
+async def run(label, call, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await call(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {total:>6} req  {elapsed:6.2f}s  {total / elapsed:9.1f} req/s")
+    return total / elapsed
+
+
+async def main(args):
+    stub, runner, base_url = await start_stub(latency=args.latency, seed=demo_seed())
+    try:
+        before = await run("before (session per call)", lambda i: before_call(base_url, i),
+                           args.requests, args.concurrency)
+
+        repo = SupabaseRepository(base_url=base_url, api_key="bench", service_key="bench",
+                                  pool_size=args.concurrency)
+        await repo.start()
+        try:
+            after = await run("after (pooled repository)", lambda i: after_call(repo, i),
+                              args.requests, args.concurrency)
+        finally:
+            await repo.close()
+
+        print(f"speedup: x{after / before:.2f}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="스텁 서버의 인위적 응답 지연(초)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,191 @@
+"""
+자동 개입 사전 선별(prefilter) 오프라인 평가
+
+저장된 대화(messages)를 MESSAGE_LIMIT개 학생 메시지 단위의 판단 창으로 다시 나누고,
+gpt_interventions에 기록된 자동 개입과 비교해
+- 건너뛴 창 비율 (LLM 판단 호출 절감)
+- 건너뛴 창의 정밀도 (건너뛴 창 중 실제로 개입이 없었던 비율)
+- 건너뛰는 바람에 놓친 개입 (유형별)
+을 보고합니다.
+
+- 창 다음(다음 창이 닫히기 전)에 자동 개입(positive/guidance/individual) 메시지가 있으면 그 유형,
+  없으면 "none"으로 봅니다. 개입하지 않은 판단은 기록되지 않으므로 "none"은 추정값입니다.
+- 직접 질문(direct_response로 답한 학생 메시지)은 자동 개입 버퍼에 들어가지 않으므로 창에서 뺍니다.
+- 창은 count 조건 기준으로 나눕니다. INTERVENTION_TRIGGER로 다른 조건을 쓰는 방에서는 근사치입니다.
+- --sweep으로 임계값 후보를 바꿔 가며 비교할 수 있습니다 (창 특징은 한 번만 계산).
+
+SUPABASE_URL/SUPABASE_KEY가 가리키는 DB를 읽습니다. --demo는 합성 대화를 로컬 PostgREST 스텁에 넣어 실행합니다.
+
+실행: python bench/eval_prefilter.py --demo --sweep max_share=0.4,0.5,0.6 --sweep min_topic_overlap=0.2,0.3,0.4
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stub_postgrest import start_stub  # noqa: E402
+from prefilter import WindowPrefilter, window_features  # noqa: E402
+from supabase_repo import repo  # noqa: E402
+
+AUTO_TYPES = ("positive", "guidance", "individual")
+WINDOW = int(os.getenv("MESSAGE_LIMIT", "6"))
+
+
+async def load_windows(room_ids, window):
+    """방별 대화 → [(특징, 라벨)]"""
+    samples = []
+    for room_id in room_ids:
+        room = await repo.get_room_prompt(room_id)
+        topic_prompt = ((room or {}).get("topics") or {}).get("system_prompt") or ""
+        messages = await repo.list_messages(room_id)
+        logged = await repo.select("gpt_interventions", room_id=f"eq.{room_id}",
+                                   select="message_id,intervention_type,target_student")
+        kinds = {str(row["message_id"]): row for row in logged}
+
+        # 직접 질문: direct_response 직전에 그 학생이 보낸 메시지
+        questions = set()
+        for index, message in enumerate(messages):
+            row = kinds.get(str(message.get("message_id")))
+            if row and row["intervention_type"] == "direct_response":
+                for previous in reversed(messages[:index]):
+                    if previous.get("sender_id") == row.get("target_student"):
+                        questions.add(previous.get("message_id"))
+                        break
+
+        buffer, pending = [], None  # pending: 라벨을 기다리는 닫힌 창의 특징
+        for message in messages:
+            row = kinds.get(str(message.get("message_id")))
+            if row is not None:
+                if pending is not None and row["intervention_type"] in AUTO_TYPES:
+                    samples.append((pending, row["intervention_type"]))
+                    pending = None
+                continue
+            if not str(message.get("sender_id", "")).startswith("2s") or message.get("message_id") in questions:
+                continue
+            buffer.append(message)
+            if len(buffer) == window:
+                if pending is not None:
+                    samples.append((pending, "none"))
+                pending, buffer = window_features(buffer, topic_prompt), []
+        if pending is not None:
+            samples.append((pending, "none"))
+    return samples
+
+
+def report(samples, prefilter, label):
+    skipped = [kind for features, kind in samples if prefilter.check(features)[0]]
+    interventions = sum(kind != "none" for _, kind in samples)
+    missed = Counter(kind for kind in skipped if kind != "none")
+    precision = skipped.count("none") / len(skipped) if skipped else None
+    missed_text = ", ".join(f"{kind}={missed[kind]}" for kind in AUTO_TYPES if missed[kind]) or "-"
+    print(f"{label:<32}{len(skipped) / len(samples):>8.1%}"
+          f"{'-' if precision is None else f'{precision:.1%}':>11}"
+          f"{sum(missed.values()) / max(1, interventions):>9.1%}  {missed_text}")
+
+
+def parse_sweep(values):
+    sweeps = []
+    for value in values or []:
+        name, _, candidates = value.partition("=")
+        if not hasattr(WindowPrefilter(), name) or name == "enabled":
+            raise SystemExit(f"알 수 없는 임계값: {name}")
+        sweeps.append((name, [float(c) for c in candidates.split(",")]))
+    return sweeps
+
+
+def demo_seed(rooms, windows_per_room, window, seed):
+    """유형별 대화 창과 개입 기록을 가진 합성 데이터 (on-topic 균형 창의 일부는 positive로 기록)"""
+    rng = random.Random(seed)
+    prompt = "기후 변화에 대응하기 위한 에너지 정책을 토론합니다. 재생 에너지, 탄소 배출, 비용과 일자리 문제를 근거와 함께 이야기하세요."
+    on_topic = ["재생 에너지 비용이 계속 내려가고 있어요", "탄소 배출을 줄이려면 정책이 필요해요",
+                "일자리 문제도 같이 생각해야 해요", "기후 변화 대응은 근거가 중요해요",
+                "에너지 정책은 비용과 효과를 함께 봐야 해요", "탄소 배출 통계를 근거로 들 수 있어요"]
+    off_topic = ["어제 축구 봤어?", "점심 뭐 먹지", "게임 새로 나온 거 해봤어?", "주말에 영화 보러 갈래"]
+    short = ["ㅋㅋ", "ㅇㅇ", "응", "몰라", "ㄱㄱ"]
+    topics, room_rows, messages, interventions = [], [], [], []
+    message_id = 1
+    for r in range(rooms):
+        room_id, topic_id = f"room-{r}", f"topic-{r}"
+        topics.append({"topic_id": topic_id, "system_prompt": prompt})
+        room_rows.append({"room_id": room_id, "title": f"조 {r}", "topic_id": topic_id})
+        students = [f"2s{r:02d}{s:02d}" for s in range(4)]
+        clock = datetime(2025, 3, 1, 9) + timedelta(hours=r)
+        for _ in range(windows_per_room):
+            scenario = rng.choices(["balanced", "off_topic", "dominated", "short", "silent"], [6, 1, 1, 1, 1])[0]
+            for m in range(window):
+                if scenario == "balanced":
+                    sender, text = students[m % len(students)], rng.choice(on_topic)
+                elif scenario == "off_topic":
+                    sender, text = rng.choice(students), rng.choice(off_topic + on_topic[:1])
+                elif scenario == "dominated":
+                    sender, text = (students[0] if m else students[1]), rng.choice(on_topic)
+                elif scenario == "short":
+                    sender, text = rng.choice(students), rng.choice(short + on_topic)
+                else:
+                    sender, text = students[m % len(students)], rng.choice(on_topic)
+                clock += timedelta(seconds=rng.uniform(5, 20) if scenario != "silent" or m != window - 1 else 150)
+                messages.append({"message_id": message_id, "room_id": room_id, "sender_id": sender, "message": text,
+                                 "role": "user", "timestamp": clock.isoformat()})
+                message_id += 1
+            kind = {"balanced": "positive" if rng.random() < 0.2 else None, "off_topic": "guidance",
+                    "dominated": "individual", "short": "guidance", "silent": "guidance"}[scenario]
+            if kind:
+                clock += timedelta(seconds=3)
+                messages.append({"message_id": message_id, "room_id": room_id, "sender_id": "GPT",
+                                 "message": "피드백", "role": "assistant", "timestamp": clock.isoformat()})
+                interventions.append({"room_id": room_id, "message_id": message_id, "intervention_type": kind,
+                                      "target_student": students[1] if kind == "individual" else None})
+                message_id += 1
+    return {"topics": topics, "rooms": room_rows, "messages": messages, "gpt_interventions": interventions}
+
+
+async def main(args):
+    runner = None
+    if args.demo:
+        _, runner, repo.base_url = await start_stub(seed=demo_seed(args.rooms, args.windows, args.window, args.seed))
+        repo.api_key = repo.service_key = "bench"
+    await repo.start()
+    try:
+        room_ids = args.room or [room["room_id"] for room in await repo.list_rooms()]
+        samples = await load_windows(room_ids, args.window)
+    finally:
+        await repo.close()
+        if runner is not None:
+            await runner.cleanup()
+    if not samples:
+        raise SystemExit("평가할 판단 창이 없습니다")
+
+    labels = Counter(kind for _, kind in samples)
+    print(f"{len(room_ids)} rooms, {len(samples)} windows of {args.window} messages  "
+          + "  ".join(f"{kind}={labels[kind]}" for kind in ("none",) + AUTO_TYPES))
+    print(f"{'thresholds':<32}{'skipped':>8}{'precision':>11}{'missed':>9}  missed by type")
+    base = WindowPrefilter(enabled=True)
+    report(samples, base, "current (env)")
+    for name, candidates in parse_sweep(args.sweep):
+        for candidate in candidates:
+            prefilter = WindowPrefilter(enabled=True)
+            setattr(prefilter, name, type(getattr(base, name))(candidate))
+            report(samples, prefilter, f"{name}={candidate:g}")
+    if args.reasons:
+        reasons = Counter((base.check(features)[1], kind) for features, kind in samples)
+        print()
+        for (reason, kind), count in sorted(reasons.items()):
+            print(f"{reason:<20}{kind:<12}{count:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--room", action="append", help="평가할 방 (여러 번 지정 가능, 기본: 전체)")
+    parser.add_argument("--window", type=int, default=WINDOW, help="판단 창 크기 (학생 메시지 수)")
+    parser.add_argument("--sweep", action="append", help="임계값 후보 (예: max_share=0.4,0.5,0.6)")
+    parser.add_argument("--reasons", action="store_true", help="선별 이유별 실제 개입 유형 분포도 출력")
+    parser.add_argument("--demo", action="store_true", help="합성 대화를 로컬 스텁에 넣어 실행")
+    parser.add_argument("--rooms", type=int, default=20, help="--demo 방 수")
+    parser.add_argument("--windows", type=int, default=30, help="--demo 방당 판단 창 수")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,392 @@
+"""
+Socket.IO 채팅 서버 종단 간 부하 테스트
+
+`uvicorn main:app`을 별도 프로세스로 띄우고
+- Supabase는 로컬 PostgREST 스텁(bench/stub_postgrest.py)
+- LLM은 가짜 백엔드(LLM_BACKEND=fake, 지연/출력 속도 조절 가능)
+로 대체한 뒤, N개 방 × M명 학생(python-socketio 클라이언트)이
+join_room → get_messages → send_message(가끔 연속 전송, 가끔 GPT 직접 질문)을 실제 수업처럼 반복합니다.
+
+측정 항목
+- 브로드캐스트 지연: 보낸 순간부터 같은 방 학생들이 receive_message를 받기까지 (p50/p95/p99)
+- 처리량: 초당 보낸 메시지 수, 초당 전달(수신) 수, 전달률
+- join / get_messages 응답 시간, GPT 직접 질문의 첫 조각/전체 응답 시간
+- 서버 CPU 사용률, RSS (psutil이 있으면 사용, 없으면 /proc), 서버 이벤트 루프 지연 (/metrics/loop)
+
+같은 --seed면 같은 전송 순서/간격으로 재현되므로, 배포 전 용량 산정과
+socket_events.py 변경 전후 비교(--output으로 JSON 저장)에 사용합니다.
+클라이언트도 한 프로세스에서 돌기 때문에 접속 수가 아주 많으면 측정하는 쪽이 먼저 느려질 수 있습니다.
+
+실행: python bench/loadtest_chat.py --rooms 20 --students 6 --duration 30
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+import aiohttp
+import socketio
+
+try:
+    import psutil
+except ImportError:  # 선택 의존성: 없으면 /proc에서 읽음 (리눅스)
+    psutil = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.stub_postgrest import start_stub, demo_seed  # noqa: E402
+from bench.loadtest_scaleout import percentile, wait_until_up  # noqa: E402
+
+TAG = re.compile(r"#lt(\d+)$")
+
+
+class Recorder:
+    """클라이언트 쪽 측정값 모음"""
+
+    def __init__(self):
+        self.sent_at = {}  # 메시지 번호 → 보낸 시각
+        self.sent = 0
+        self.delivered = 0
+        self.expected = 0
+        self.broadcast_ms = []
+        self.join_ms = []
+        self.history_ms = []
+        self.gpt_first_delta_ms = []
+        self.gpt_answer_ms = []
+        self.gpt_interventions = 0
+        self.errors = 0
+        self.questions = {}  # room_id → [질문 보낸 시각, ...] (방 안에서는 먼저 보낸 질문이 먼저 답을 받는다고 봄)
+
+
+class SimStudent:
+    def __init__(self, student_id, room_id, room_size, observer, recorder, rng):
+        self.student_id = student_id
+        self.room_id = room_id
+        self.room_size = room_size
+        self.observer = observer  # 방마다 한 명만 GPT 응답 시간을 기록
+        self.recorder = recorder
+        self.rng = rng
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.joined = asyncio.Event()
+        self.history = asyncio.Event()
+        self.streams = set()
+        self.client.on("current_users", self._on_current_users)
+        self.client.on("message_history", self._on_history)
+        self.client.on("receive_message", self._on_message)
+        self.client.on("receive_message_delta", self._on_delta)
+
+    async def _on_current_users(self, _):
+        self.joined.set()
+
+    async def _on_history(self, _):
+        self.history.set()
+
+    async def _on_message(self, data):
+        now = time.perf_counter()
+        if data.get("sender_id") == "gpt":
+            if not self.observer:
+                return
+            if data.get("feedback_type") == "direct_response":
+                pending = self.recorder.questions.get(self.room_id)
+                if pending:
+                    self.recorder.gpt_answer_ms.append((now - pending.pop(0)) * 1000)
+            else:
+                self.recorder.gpt_interventions += 1
+            return
+        found = TAG.search(data.get("message") or "")
+        if found and int(found.group(1)) in self.recorder.sent_at:
+            self.recorder.delivered += 1
+            self.recorder.broadcast_ms.append((now - self.recorder.sent_at[int(found.group(1))]) * 1000)
+
+    async def _on_delta(self, data):
+        if not self.observer or data.get("feedback_type") != "direct_response":
+            return
+        if data["stream_id"] in self.streams:
+            return
+        self.streams.add(data["stream_id"])
+        pending = self.recorder.questions.get(self.room_id)
+        if pending:
+            self.recorder.gpt_first_delta_ms.append((time.perf_counter() - pending[0]) * 1000)
+
+    async def join(self, url):
+        started = time.perf_counter()
+        await self.client.connect(url, socketio_path="ws/socket.io", transports=["websocket"])
+        await self.client.emit("join_room", {"room_id": self.room_id, "sender_id": self.student_id})
+        await asyncio.wait_for(self.joined.wait(), 10)
+        self.recorder.join_ms.append((time.perf_counter() - started) * 1000)
+
+    async def load_history(self):
+        started = time.perf_counter()
+        await self.client.emit("get_messages", {"room_id": self.room_id, "sender_id": self.student_id})
+        await asyncio.wait_for(self.history.wait(), 10)
+        self.recorder.history_ms.append((time.perf_counter() - started) * 1000)
+
+    async def send(self, text, is_gpt_question=False):
+        recorder = self.recorder
+        number = recorder.sent
+        recorder.sent += 1
+        recorder.expected += self.room_size
+        recorder.sent_at[number] = time.perf_counter()
+        if is_gpt_question:
+            recorder.questions.setdefault(self.room_id, []).append(time.perf_counter())
+        await self.client.emit("send_message", {
+            "room_id": self.room_id,
+            "sender_id": self.student_id,
+            "message": f"{text} #lt{number}",
+            "is_gpt_question": is_gpt_question,
+        })
+
+    async def chat(self, until, args):
+        """분당 rate개 정도(지수 분포 간격)로 전송, 가끔 burst개 연속 전송 또는 GPT 직접 질문"""
+        rng = self.rng
+        while True:
+            await asyncio.sleep(rng.expovariate(args.rate / 60.0))
+            if time.perf_counter() >= until:
+                return
+            try:
+                if rng.random() < args.question_prob:
+                    await self.send("GPT 선생님, 이 주장에 대한 반론은 뭐가 있을까요?", is_gpt_question=True)
+                elif rng.random() < args.burst_prob:
+                    for i in range(args.burst_size):
+                        await self.send(f"연속 메시지 {i}")
+                        await asyncio.sleep(0.05)
+                else:
+                    await self.send(rng.choice(["저는 찬성이에요", "근거가 뭔가요?", "자료를 찾아봤어요", "좋은 생각이에요"]))
+            except Exception:
+                self.recorder.errors += 1
+
+
+class ProcessSampler:
+    """서버 프로세스(워커 포함)의 CPU 사용률과 RSS를 주기적으로 기록"""
+
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent = []
+        self.rss_mb = []
+
+    def _tree(self):
+        pids = [self.pid]
+        index = 0
+        while index < len(pids):
+            try:
+                with open(f"/proc/{pids[index]}/task/{pids[index]}/children") as f:
+                    pids += [int(p) for p in f.read().split()]
+            except OSError:
+                pass
+            index += 1
+        return pids
+
+    def read(self):
+        """(누적 CPU 초, RSS 바이트) 또는 측정할 수 없으면 None"""
+        if psutil is not None:
+            try:
+                root = psutil.Process(self.pid)
+                processes = [root] + root.children(recursive=True)
+                cpu = sum(sum(p.cpu_times()[:2]) for p in processes)
+                rss = sum(p.memory_info().rss for p in processes)
+                return cpu, rss
+            except psutil.Error:
+                return None
+        if not os.path.exists(f"/proc/{self.pid}"):
+            return None
+        ticks = os.sysconf("SC_CLK_TCK")
+        page = os.sysconf("SC_PAGE_SIZE")
+        cpu, rss = 0.0, 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / ticks
+                rss += int(fields[21]) * page
+            except (OSError, IndexError, ValueError):
+                pass
+        return cpu, rss
+
+    async def run(self):
+        previous = self.read()
+        previous_at = time.perf_counter()
+        while previous is not None:
+            await asyncio.sleep(self.interval)
+            current = self.read()
+            now = time.perf_counter()
+            if current is None:
+                return
+            self.cpu_percent.append((current[0] - previous[0]) / (now - previous_at) * 100)
+            self.rss_mb.append(current[1] / 1024 / 1024)
+            previous, previous_at = current, now
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.50), 1),
+        "p95": round(percentile(values, 0.95), 1),
+        "p99": round(percentile(values, 0.99), 1),
+        "max": round(max(values, default=0.0), 1),
+    }
+
+
+async def fetch_metrics(url):
+    metrics = {}
+    async with aiohttp.ClientSession() as session:
+        for name in ("loop", "llm", "message-queue", "interventions"):
+            try:
+                async with session.get(f"{url}/metrics/{name}") as response:
+                    metrics[name] = await response.json()
+            except aiohttp.ClientError:
+                metrics[name] = None
+    return metrics
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    _, runner, stub_url = await start_stub(latency=args.db_latency, seed=demo_seed(
+        rooms=args.rooms, students_per_room=args.students, messages_per_room=args.history))
+    env = {
+        **os.environ,
+        "SUPABASE_URL": stub_url,
+        "SUPABASE_API_KEY": "loadtest",
+        "SUPABASE_SERVICE_ROLE_KEY": "loadtest",
+        "OPENAI_API_KEY": "loadtest",
+        "LLM_BACKEND": "fake",
+        "LLM_FAKE_LATENCY": args.llm_latency,
+        "LLM_FAKE_TOKENS_PER_SEC": str(args.llm_tokens_per_sec),
+        "LLM_FAKE_SEED": str(args.seed),
+        "MESSAGE_LIMIT": str(args.message_limit),
+    }
+    if args.redis_url:
+        env["REDIS_URL"] = args.redis_url
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL if args.quiet_server else None,
+    )
+    recorder = Recorder()
+    students = []
+    sampler_task = None
+    try:
+        await wait_until_up(args.port)
+        url = f"http://127.0.0.1:{args.port}"
+        sampler = ProcessSampler(server.pid)
+        sampler_task = asyncio.create_task(sampler.run())
+
+        for r in range(args.rooms):
+            for s in range(args.students):
+                students.append(SimStudent(f"2s{r:02d}{s:02d}", f"room-{r}", args.students, s == 0, recorder,
+                                           random.Random(rng.random())))
+
+        # 1) 입장 (동시에 connect_concurrency명씩)
+        semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+        async def limited(call):
+            async with semaphore:
+                return await call()
+
+        results = await asyncio.gather(*(limited(functools.partial(s.join, url)) for s in students),
+                                       return_exceptions=True)
+        connected = [s for s, result in zip(students, results) if not isinstance(result, BaseException)]
+        recorder.errors += len(students) - len(connected)
+        print(f"joined {len(connected)}/{len(students)} students in {args.rooms} rooms")
+
+        # 2) 이전 대화 불러오기
+        await asyncio.gather(*(limited(s.load_history) for s in connected), return_exceptions=True)
+
+        # 3) 대화
+        started = time.perf_counter()
+        until = started + args.duration
+        await asyncio.gather(*(s.chat(until, args) for s in connected))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(args.drain)  # 늦게 도착하는 메시지와 GPT 응답 대기
+
+        metrics = await fetch_metrics(url)
+    finally:
+        await asyncio.gather(*(s.client.disconnect() for s in students), return_exceptions=True)
+        if sampler_task:
+            sampler_task.cancel()
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        await runner.cleanup()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "clients": len(connected),
+        "sent": recorder.sent,
+        "sent_per_sec": round(recorder.sent / elapsed, 1),
+        "delivered_per_sec": round(recorder.delivered / elapsed, 1),
+        "delivery_ratio": round(recorder.delivered / recorder.expected, 4) if recorder.expected else 1.0,
+        "errors": recorder.errors,
+        "broadcast_ms": summarize(recorder.broadcast_ms),
+        "join_ms": summarize(recorder.join_ms),
+        "history_ms": summarize(recorder.history_ms),
+        "gpt_first_delta_ms": summarize(recorder.gpt_first_delta_ms),
+        "gpt_answer_ms": summarize(recorder.gpt_answer_ms),
+        "gpt_interventions": recorder.gpt_interventions,
+        "server_cpu_percent": {"avg": round(sum(sampler.cpu_percent) / len(sampler.cpu_percent), 1)
+                               if sampler.cpu_percent else None,
+                               "max": round(max(sampler.cpu_percent), 1) if sampler.cpu_percent else None},
+        "server_rss_mb": {"max": round(max(sampler.rss_mb), 1) if sampler.rss_mb else None},
+        "server_loop_lag_ms": metrics.get("loop"),
+        "server_metrics": metrics,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"saved: {args.output}")
+    return report
+
+
+def print_report(report):
+    def line(label, stats):
+        print(f"{label:<22} n={stats['count']:>6}  p50={stats['p50']:8.1f}ms  p95={stats['p95']:8.1f}ms  "
+              f"p99={stats['p99']:8.1f}ms  max={stats['max']:8.1f}ms")
+
+    print()
+    print(f"clients {report['clients']}  sent {report['sent']} ({report['sent_per_sec']}/s)  "
+          f"delivered {report['delivered_per_sec']}/s  delivery ratio {report['delivery_ratio']:.2%}  "
+          f"errors {report['errors']}")
+    line("broadcast", report["broadcast_ms"])
+    line("join_room", report["join_ms"])
+    line("get_messages", report["history_ms"])
+    line("gpt first delta", report["gpt_first_delta_ms"])
+    line("gpt answer", report["gpt_answer_ms"])
+    print(f"gpt auto interventions {report['gpt_interventions']}")
+    cpu, rss, lag = report["server_cpu_percent"], report["server_rss_mb"], report["server_loop_lag_ms"] or {}
+    print(f"server cpu avg={cpu['avg']}% max={cpu['max']}%  rss max={rss['max']}MB  "
+          f"loop lag p50={lag.get('p50_ms')}ms p99={lag.get('p99_ms')}ms max={lag.get('max_ms')}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--students", type=int, default=6, help="방당 학생 수")
+    parser.add_argument("--duration", type=float, default=30, help="대화 시간 (초)")
+    parser.add_argument("--drain", type=float, default=3, help="대화가 끝난 뒤 늦은 응답을 기다리는 시간 (초)")
+    parser.add_argument("--rate", type=float, default=6, help="학생 한 명이 분당 보내는 메시지 수")
+    parser.add_argument("--burst-prob", type=float, default=0.1, help="연속 전송 확률")
+    parser.add_argument("--burst-size", type=int, default=5)
+    parser.add_argument("--question-prob", type=float, default=0.05, help="GPT 직접 질문 확률")
+    parser.add_argument("--history", type=int, default=100, help="방마다 미리 넣어 둘 이전 메시지 수")
+    parser.add_argument("--message-limit", type=int, default=6, help="서버 MESSAGE_LIMIT (자동 개입 판단 주기)")
+    parser.add_argument("--llm-latency", default="lognormal:0.6,0.4", help="가짜 LLM 첫 토큰 지연 분포")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=60)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="PostgREST 스텁 응답 지연 (초)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn 워커 수 (2 이상이면 --redis-url 필요)")
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--connect-concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--quiet-server", action="store_true", help="서버 로그 숨기기")
+    parser.add_argument("--output", help="결과를 JSON으로 저장할 경로 (변경 전후 비교용)")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,151 @@
+"""
+멀티 워커 확장성 부하 테스트
+
+워커 수(1, 2, 4, ...)를 바꿔 가며 `uvicorn main:app --workers N`을 REDIS_URL과 함께 띄우고,
+학생 클라이언트를 단계적으로 늘려 join 응답(p95)이 SLO를 넘기 직전까지의 동시 접속 수를 잽니다.
+워커 수에 비례해 수용 가능한 접속 수가 늘어나는지(near-linear) 확인하는 용도입니다.
+
+- Supabase는 로컬 PostgREST 스텁(bench/stub_postgrest.py)으로 대체합니다.
+- 자동 개입은 MESSAGE_LIMIT을 크게 잡아 꺼 두고, 연결/참여/브로드캐스트 비용만 측정합니다.
+- 다른 워커에 연결된 학생에게 방 메시지가 전달되는지도 함께 확인합니다. (귓속말도 같은 매니저 경로 사용)
+
+- 워커 수만큼 CPU 코어가 있어야 하고, 부하 생성기(이 스크립트)·Redis·스텁도 코어를 나눠 쓰므로
+  코어가 부족하면 워커를 늘려도 용량이 늘지 않습니다. (1코어에서 1워커 ≈1400, 2워커 ≈1450 접속)
+
+필요: 실행 중인 Redis (기본 redis://127.0.0.1:6379/0)
+실행: python bench/loadtest_scaleout.py --workers 1 2 4 --step 200 --max-clients 4000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import socketio
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.stub_postgrest import start_stub, demo_seed  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("서버가 시작되지 않았습니다.")
+
+
+class Student:
+    def __init__(self, student_id, room_id):
+        self.student_id = student_id
+        self.room_id = room_id
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.joined = asyncio.Event()
+        self.inbox = []
+        self.client.on("current_users", self._on_current_users)
+        self.client.on("receive_message", self._on_message)
+
+    async def _on_current_users(self, _):
+        self.joined.set()
+
+    async def _on_message(self, data):
+        self.inbox.append(data)
+
+    async def join(self, url):
+        started = time.perf_counter()
+        await self.client.connect(url, socketio_path="ws/socket.io", transports=["websocket"])
+        await self.client.emit("join_room", {"room_id": self.room_id, "sender_id": self.student_id})
+        await asyncio.wait_for(self.joined.wait(), 10)
+        return (time.perf_counter() - started) * 1000
+
+
+async def measure(workers, args, stub_url):
+    port = args.port
+    env = {
+        **os.environ,
+        "SUPABASE_URL": stub_url,
+        "SUPABASE_API_KEY": "loadtest",
+        "REDIS_URL": args.redis_url,
+        "STATE_KEY_PREFIX": f"loadtest{workers}",
+        "MESSAGE_LIMIT": "1000000",
+        "OPENAI_API_KEY": "loadtest",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    students = []
+    capacity = 0
+    try:
+        await wait_until_up(port)
+        url = f"http://127.0.0.1:{port}"
+        while len(students) < args.max_clients:
+            batch = []
+            for _ in range(args.step):
+                index = len(students) + len(batch)
+                room = f"room-{index // args.room_size % 10}"
+                batch.append(Student(f"2s{index:05d}", room))
+            results = await asyncio.gather(*(s.join(url) for s in batch), return_exceptions=True)
+            latencies = [r for r in results if isinstance(r, float)]
+            errors = len(results) - len(latencies)
+            students += [s for s, r in zip(batch, results) if isinstance(r, float)]
+            p95 = percentile(latencies, 0.95)
+            print(f"  workers={workers} clients={len(students):>6} join p95={p95:7.1f}ms errors={errors}")
+            if errors or p95 > args.slo_ms:
+                break
+            capacity = len(students)
+
+        # 워커 간 전달 확인: 첫 학생이 보낸 메시지가 마지막 학생에게 도착하는지
+        if len(students) >= 2:
+            sender, target = students[0], students[-1]
+            await sender.client.emit("send_message", {"room_id": target.room_id, "sender_id": sender.student_id,
+                                                      "message": "cross-node broadcast"})
+            await asyncio.sleep(1)
+            delivered = any(m.get("message") == "cross-node broadcast" for m in target.inbox)
+            print(f"  cross-node broadcast delivered: {delivered}")
+    finally:
+        await asyncio.gather(*(s.client.disconnect() for s in students), return_exceptions=True)
+        server.terminate()
+        server.wait(10)
+    return capacity
+
+
+async def main(args):
+    _, runner, stub_url = await start_stub(seed=demo_seed(rooms=10, students_per_room=0, messages_per_room=0))
+    try:
+        results = {}
+        for workers in args.workers:
+            results[workers] = await measure(workers, args, stub_url)
+        base = results[args.workers[0]] or 1
+        print("\nworkers  capacity  scaling")
+        for workers, capacity in results.items():
+            print(f"{workers:>7}  {capacity:>8}  x{capacity / base:.2f}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--step", type=int, default=200, help="단계마다 추가할 접속 수")
+    parser.add_argument("--max-clients", type=int, default=4000)
+    parser.add_argument("--room-size", type=int, default=30)
+    parser.add_argument("--slo-ms", type=float, default=500.0, help="join p95 허용 한계")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"))
+    asyncio.run(main(parser.parse_args()))
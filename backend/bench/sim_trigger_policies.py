@@ -0,0 +1,163 @@
+"""
+자동 개입 판단 조건(INTERVENTION_TRIGGER) 시뮬레이션
+
+방 유형별 메시지 도착 패턴을 가상 시간으로 만들어, 조건(정책)마다
+- 방·시간당 LLM 판단 호출 수 (유형별)
+- 판단 한 번에 들어가는 평균 메시지 수
+- 막힌 방(stuck)에서 대화가 끊긴 뒤 판단이 시작되기까지 걸린 시간 (p50, 판단 없이 끝난 비율)
+을 비교합니다. 실제 서버와 같은 trigger_policy 객체를 쓰고, 판단 중에 온 메시지는 다음 판단으로 넘어가며
+판단은 --judge-seconds초 걸린다고 가정합니다. (네트워크/LLM 호출 없음)
+
+방 유형
+- busy  : 분당 약 20개 (활발한 토론)
+- normal: 분당 약 4개
+- quiet : 분당 약 0.5개
+- stuck : 10분마다 90초 동안 분당 약 6개, 이후 침묵 (막혀서 대화가 끊기는 방)
+
+실행: python bench/sim_trigger_policies.py --hours 2 --rooms 50 \\
+        --policy "count:6" --policy "cooldown:60 & (count:8 | window:180 | silence:60)"
+"""
+import argparse
+import os
+import random
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.loadtest_scaleout import percentile  # noqa: E402
+from trigger_policy import RoomActivity, parse_policy  # noqa: E402
+
+DEFAULT_POLICIES = [
+    "count:6",
+    "cooldown:60 & count:6",
+    "count:6 | silence:60",
+    "cooldown:60 & (count:8 | window:180 | silence:60)",
+]
+
+PROFILES = ("busy", "normal", "quiet", "stuck")
+STUCK_SILENCE = 60  # 이 시간 이상 메시지가 없으면 '대화가 끊김'으로 봄
+
+
+def arrivals(profile, seconds, rng):
+    """방 유형별 메시지 도착 시각 (포아송 과정)"""
+    def poisson(rate_per_min, start, end):
+        times, t = [], start
+        while True:
+            t += rng.expovariate(rate_per_min / 60)
+            if t >= end:
+                return times
+            times.append(t)
+
+    if profile == "busy":
+        return poisson(20, 0, seconds)
+    if profile == "normal":
+        return poisson(4, 0, seconds)
+    if profile == "quiet":
+        return poisson(0.5, 0, seconds)
+    times = []
+    for start in range(0, int(seconds), 600):
+        times += poisson(6, start, min(start + 90, seconds))
+    return times
+
+
+def simulate(policy, times, seconds, judge_seconds):
+    """한 방을 가상 시간으로 실행 → (판단 시작 시각 목록, 판단별 메시지 수, 이유별 횟수)"""
+    room = RoomActivity()
+    judgments, sizes, reasons = [], [], Counter()
+    busy_until = None  # 진행 중인 판단이 끝나는 시각
+    timer = None  # 다음 시간 조건 확인 시각
+    index, now = 0, 0.0
+
+    def evaluate():
+        nonlocal busy_until, timer
+        if room.buffered == 0:
+            timer = None
+            return
+        reason, next_check = policy.evaluate(room, now)
+        if reason is None:
+            timer = next_check
+            return
+        judgments.append(now)
+        sizes.append(room.buffered)
+        reasons[reason] += 1
+        room.triggered(now)
+        busy_until, timer = now + judge_seconds, None
+
+    while True:
+        candidates = [t for t in (times[index] if index < len(times) else None, timer, busy_until) if t is not None]
+        if not candidates or min(candidates) > seconds:
+            break
+        now = min(candidates)
+        if busy_until is not None and now == busy_until:
+            busy_until = None
+            evaluate()
+        elif index < len(times) and now == times[index]:
+            index += 1
+            room.add_message(now, room.buffered + 1)
+            if busy_until is None:
+                evaluate()
+        else:
+            timer = None
+            if busy_until is None:
+                evaluate()
+    return judgments, sizes, reasons
+
+
+def help_delays(times, judgments, seconds):
+    """대화가 STUCK_SILENCE초 이상 끊긴 구간마다 마지막 메시지 후 판단이 시작되기까지의 시간 (없으면 None)"""
+    delays = []
+    for current, following in zip(times, times[1:] + [seconds]):
+        if following - current < STUCK_SILENCE:
+            continue
+        started = [j for j in judgments if current <= j < following]
+        delays.append(started[0] - current if started else None)
+    return delays
+
+
+def main(args):
+    seconds = args.hours * 3600
+    room_hours = args.rooms * args.hours
+    rng = random.Random(args.seed)
+    rooms = {profile: [arrivals(profile, seconds, rng) for _ in range(args.rooms)] for profile in PROFILES}
+    messages = {profile: sum(map(len, rooms[profile])) / room_hours for profile in PROFILES}
+
+    print(f"{args.rooms} rooms per profile x {args.hours}h, judgment {args.judge_seconds:g}s")
+    print("messages per room-hour: " + "  ".join(f"{p}={messages[p]:.0f}" for p in PROFILES))
+    print()
+    header = f"{'policy':<52}" + "".join(f"{p:>8}" for p in PROFILES) + f"{'all':>8}{'msg/call':>10}" \
+             f"{'stuck p50':>11}{'no help':>9}"
+    print("LLM judgment calls per room-hour")
+    print(header)
+    for spec in args.policy or DEFAULT_POLICIES:
+        policy = parse_policy(spec)
+        calls, sizes, reasons, delays = {}, [], Counter(), []
+        for profile in PROFILES:
+            total = 0
+            for times in rooms[profile]:
+                judgments, room_sizes, room_reasons = simulate(policy, times, seconds, args.judge_seconds)
+                total += len(judgments)
+                sizes += room_sizes
+                reasons += room_reasons
+                if profile == "stuck":
+                    delays += help_delays(times, judgments, seconds)
+            calls[profile] = total / room_hours
+        answered = [d for d in delays if d is not None]
+        unanswered = (len(delays) - len(answered)) / len(delays) if delays else 0.0
+        stuck_p50 = f"{percentile(answered, 0.5):.0f}s" if answered else "-"
+        print(f"{spec:<52}" + "".join(f"{calls[p]:>8.1f}" for p in PROFILES)
+              + f"{sum(calls.values()) / len(PROFILES):>8.1f}{sum(sizes) / max(1, len(sizes)):>10.1f}"
+              + f"{stuck_p50:>11}{unanswered:>9.0%}")
+        if args.reasons:
+            print(f"{'':<52}" + ", ".join(f"{reason}={count}" for reason, count in reasons.most_common()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policy", action="append", help="비교할 조건 (여러 번 지정 가능, 기본: 대표 조건 4개)")
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--rooms", type=int, default=50, help="방 유형별 방 수")
+    parser.add_argument("--judge-seconds", type=float, default=3.0, help="판단 한 번에 걸리는 시간(초)")
+    parser.add_argument("--reasons", action="store_true", help="조건별 판단 시작 이유 분포도 출력")
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,95 @@
+"""
+로컬 벤치마크용 OpenAI Chat Completions 스텁 서버
+
+- POST /v1/chat/completions (stream 미지원)
+- 응답 시간은 토큰 수에 비례하도록 흉내 냅니다.
+  지연 = base + 입력 토큰 / prefill_rate + 출력 토큰 / decode_rate (전체에 time_scale을 곱함)
+- 출력 토큰 수는 min(max_tokens, output_tokens)
+- 호출 수, 최대 동시 처리 수, 누적 입력/출력 토큰을 기록합니다.
+
+단독 실행: python bench/stub_openai.py --port 9911
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_builder import count_tokens  # noqa: E402
+
+
+class StubOpenAI:
+    def __init__(self, base=0.3, prefill_rate=5000.0, decode_rate=60.0, output_tokens=300, time_scale=1.0):
+        self.base = base
+        self.prefill_rate = prefill_rate
+        self.decode_rate = decode_rate
+        self.output_tokens = output_tokens
+        self.time_scale = time_scale
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    async def handle_chat(self, request):
+        body = await request.json()
+        prompt_tokens = sum(count_tokens(m.get("content") or "") for m in body["messages"])
+        completion_tokens = min(body.get("max_tokens") or self.output_tokens, self.output_tokens)
+
+        self.calls += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            delay = self.base + prompt_tokens / self.prefill_rate + completion_tokens / self.decode_rate
+            await asyncio.sleep(delay * self.time_scale)
+        finally:
+            self.in_flight -= 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+        last = body["messages"][-1]["content"] or ""
+        return web.json_response({
+            "id": f"chatcmpl-stub-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"[stub] {last[:80]}"},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle_chat)
+        return app
+
+
+async def start_stub(port=0, **options):
+    """스텁 서버를 띄우고 (stub, runner, base_url)을 반환 - base_url은 OPENAI_BASE_URL로 사용"""
+    stub = StubOpenAI(**options)
+    runner = web.AppRunner(stub.make_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    actual_port = site._server.sockets[0].getsockname()[1]
+    return stub, runner, f"http://127.0.0.1:{actual_port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI chat completions stub server")
+    parser.add_argument("--port", type=int, default=9911)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    web.run_app(StubOpenAI(time_scale=args.time_scale).make_app(), host="127.0.0.1", port=args.port,
+                access_log=None)
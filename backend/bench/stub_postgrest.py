@@ -0,0 +1,221 @@
+"""
+로컬 벤치마크용 PostgREST 스텁 서버
+
+Supabase(PostgREST)의 일부 문법만 흉내 내는 인메모리 서버입니다.
+- GET  /rest/v1/<table>?col=eq.x&col=in.("a","b")&select=a,b&order=col.desc&limit=n
+- POST /rest/v1/<table>  (단일 객체 또는 배열, Prefer: return=representation 지원,
+  on_conflict=<col> + Prefer: resolution=ignore-duplicates면 같은 값이 있는 행은 건너뜀)
+- latency 옵션으로 네트워크 지연을 흉내 낼 수 있습니다.
+- max_rows 옵션으로 PostgREST의 응답 행 수 상한(db-max-rows, Supabase 기본 1000)을 흉내 낼 수 있습니다.
+
+단독 실행: python bench/stub_postgrest.py --port 54321
+"""
+import argparse
+import asyncio
+import itertools
+from datetime import datetime
+from aiohttp import web
+
+
+def _parse_value(raw: str):
+    raw = raw.strip()
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        return raw[1:-1]
+    return raw
+
+
+def _split_top_level(expr: str):
+    """쉼표로 구분하되 괄호 안의 쉼표는 무시"""
+    parts, depth, current = [], 0, ""
+    for ch in expr:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _matches(row, column, op_expr):
+    op, _, value = op_expr.partition(".")
+    cell = row.get(column)
+    if op == "eq":
+        return str(cell) == _parse_value(value)
+    if op == "neq":
+        return str(cell) != _parse_value(value)
+    if op == "is":
+        return cell is None if value == "null" else str(cell).lower() == value
+    if op in ("gt", "gte", "lt", "lte"):
+        if cell is None:
+            return False
+        target = _parse_value(value)
+        left, right = (cell, type(cell)(target)) if isinstance(cell, (int, float)) else (str(cell), target)
+        return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[op]
+    if op == "in":
+        values = {_parse_value(v) for v in _split_top_level(value.strip("()"))}
+        return str(cell) in values
+    raise ValueError(f"unsupported operator: {op}")
+
+
+def _eval_logic(row, kind, expr):
+    """or=(a.eq.1,and(b.lt.2,c.eq.3)) 형태의 논리 필터 평가"""
+    results = []
+    for term in _split_top_level(expr.strip()[1:-1]):
+        if term.startswith(("and(", "or(")):
+            inner_kind, _, rest = term.partition("(")
+            results.append(_eval_logic(row, inner_kind, "(" + rest))
+        else:
+            column, _, op_expr = term.partition(".")
+            results.append(_matches(row, column, op_expr))
+    return all(results) if kind == "and" else any(results)
+
+
+class StubPostgrest:
+    def __init__(self, latency=0.0, max_rows=None):
+        self.latency = latency
+        self.max_rows = max_rows
+        self.tables: dict[str, list[dict]] = {}
+        self.request_count = 0
+        self._ids = itertools.count(1)
+
+    def seed(self, table, rows):
+        self.tables.setdefault(table, []).extend(rows)
+        if table == "messages" and rows:
+            # 시드 데이터 이후 번호부터 message_id 발급
+            self._ids = itertools.count(max(r["message_id"] for r in self.tables[table]) + 1)
+
+    def _embed(self, table, row, select_part):
+        # rooms?select=topic_id,topics(system_prompt) 같은 임베드(1:1) 지원
+        name, _, cols = select_part.partition("(")
+        cols = cols.rstrip(")").split(",")
+        fk = f"{name[:-1]}_id" if name.endswith("s") else f"{name}_id"
+        for other in self.tables.get(name, []):
+            if other.get(fk) == row.get(fk):
+                return name, {c: other.get(c) for c in cols}
+        return name, None
+
+    def _project(self, table, row, select):
+        if not select or select == "*":
+            return dict(row)
+        out = {}
+        for part in _split_top_level(select):
+            if "(" in part:
+                key, value = self._embed(table, row, part)
+                out[key] = value
+            else:
+                out[part] = row.get(part)
+        return out
+
+    async def handle_get(self, request):
+        self.request_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        table = request.match_info["table"]
+        rows = self.tables.get(table, [])
+        select, order, limit, offset = "*", None, None, 0
+        for key, value in request.query.items():
+            if key == "select":
+                select = value
+            elif key == "order":
+                order = value
+            elif key == "limit":
+                limit = int(value)
+            elif key == "offset":
+                offset = int(value)
+            elif key in ("or", "and"):
+                rows = [r for r in rows if _eval_logic(r, key, value)]
+            else:
+                rows = [r for r in rows if _matches(r, key, value)]
+        if order:
+            for clause in reversed(order.split(",")):
+                column, _, direction = clause.partition(".")
+                rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)),
+                              reverse=direction.startswith("desc"))
+        rows = rows[offset:]
+        if limit is not None:
+            rows = rows[:limit]
+        if self.max_rows is not None:
+            rows = rows[:self.max_rows]
+        return web.json_response([self._project(table, r, select) for r in rows])
+
+    async def handle_post(self, request):
+        self.request_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        table = request.match_info["table"]
+        body = await request.json()
+        rows = body if isinstance(body, list) else [body]
+        prefer = request.headers.get("Prefer", "")
+        conflict = request.query.get("on_conflict") if "resolution=ignore-duplicates" in prefer else None
+        existing = {r.get(conflict) for r in self.tables.get(table, [])} if conflict else set()
+        stored = []
+        for row in rows:
+            row = dict(row)
+            if conflict and row.get(conflict) in existing:
+                continue
+            existing.add(row.get(conflict))
+            if table == "messages":
+                row.setdefault("message_id", next(self._ids))
+                row.setdefault("timestamp", datetime.utcnow().isoformat())
+            stored.append(row)
+        self.tables.setdefault(table, []).extend(stored)
+        if "return=representation" in prefer:
+            return web.json_response(stored, status=201)
+        return web.Response(status=201)
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get("/rest/v1/{table}", self.handle_get)
+        app.router.add_post("/rest/v1/{table}", self.handle_post)
+        return app
+
+
+async def start_stub(port=0, latency=0.0, seed=None, max_rows=None):
+    """스텁 서버를 띄우고 (stub, runner, base_url)을 반환"""
+    stub = StubPostgrest(latency=latency, max_rows=max_rows)
+    for table, rows in (seed or {}).items():
+        stub.seed(table, rows)
+    runner = web.AppRunner(stub.make_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    actual_port = site._server.sockets[0].getsockname()[1]
+    return stub, runner, f"http://127.0.0.1:{actual_port}"
+
+
+def demo_seed(rooms=10, students_per_room=30, messages_per_room=200):
+    """벤치마크용 샘플 데이터"""
+    students, topics, room_rows, messages = [], [], [], []
+    message_id = itertools.count(1)
+    for r in range(rooms):
+        topic_id, room_id = f"topic-{r}", f"room-{r}"
+        topics.append({"topic_id": topic_id, "title": f"주제 {r}", "system_prompt": f"토론 주제 {r}",
+                       "rubric_prompt": "참여도와 논리성", "class_id": "class-1"})
+        room_rows.append({"room_id": room_id, "title": f"주제 {r} - 조 1", "topic_id": topic_id})
+        ids = [f"2s{r:02d}{s:02d}" for s in range(students_per_room)]
+        students += [{"student_id": sid, "name": f"학생{sid}", "class_id": "class-1", "password": "pw"} for sid in ids]
+        for m in range(messages_per_room):
+            messages.append({
+                "message_id": next(message_id), "room_id": room_id, "sender_id": ids[m % len(ids)],
+                "message": f"메시지 {m}", "role": "user", "whisper_to": None, "reasoning": None,
+                "timestamp": f"2025-03-01T09:{m // 60:02d}:{m % 60:02d}.{m:06d}",
+            })
+    return {"students": students, "topics": topics, "rooms": room_rows, "messages": messages}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PostgREST stub server")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = StubPostgrest(latency=args.latency)
+    for table, rows in demo_seed().items():
+        stub.seed(table, rows)
+    web.run_app(stub.make_app(), host="127.0.0.1", port=args.port, access_log=None)
@@ -0,0 +1,90 @@
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+# ✅ TTL + LRU 인메모리 캐시
+class TTLCache:
+    """
+    크기 제한(LRU)과 만료 시간(TTL)을 함께 가지는 간단한 인메모리 캐시
+    - maxsize: 최대 항목 수 (초과 시 가장 오래 사용되지 않은 항목부터 제거)
+    - ttl: 항목 유효 시간(초), None이면 만료 없음
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key → (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def set(self, key, value, ttl=_MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def pop_where(self, predicate):
+        """predicate(key, value)가 참인 항목을 모두 제거하고 제거된 개수를 반환"""
+        with self._lock:
+            keys = [k for k, (v, _) in self._data.items() if predicate(k, v)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def missing(self, keys):
+        """주어진 키 중 캐시에 없는(또는 만료된) 키 목록을 반환 (적중/미스 통계와 LRU 순서는 건드리지 않음)"""
+        now = time.monotonic()
+        with self._lock:
+            return [k for k in keys
+                    if (entry := self._data.get(k)) is None or (entry[1] is not None and entry[1] <= now)]
+
+    def values(self):
+        """만료되지 않은 값 목록 (LRU 순서는 바꾸지 않음)"""
+        now = time.monotonic()
+        with self._lock:
+            return [v for v, expires_at in self._data.values() if expires_at is None or expires_at > now]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,243 @@
+import os
+import asyncio
+from state_store import state_store
+from log_utils import get_logger
+
+try:
+    import tiktoken
+except ImportError:  # 선택 의존성: 없으면 글자 수 기반 추정
+    tiktoken = None
+
+logger = get_logger("context")
+
+# 호출 종류별 대화 맥락 토큰 예산
+JUDGE_CONTEXT_TOKENS = int(os.getenv("JUDGE_CONTEXT_TOKENS", "1500"))
+FEEDBACK_CONTEXT_TOKENS = int(os.getenv("FEEDBACK_CONTEXT_TOKENS", "2000"))
+DIRECT_CONTEXT_TOKENS = int(os.getenv("DIRECT_CONTEXT_TOKENS", "2000"))
+EVAL_CONTEXT_TOKENS = int(os.getenv("EVAL_CONTEXT_TOKENS", "12000"))
+
+# 긴 대화 평가 (map-reduce)
+EVAL_MODE = os.getenv("EVAL_MODE", "auto")  # auto: 예산을 넘는 대화만 map-reduce / single / mapreduce
+EVAL_WINDOW_TOKENS = int(os.getenv("EVAL_WINDOW_TOKENS", "6000"))  # 구간 하나의 토큰 수
+EVAL_MAP_CONCURRENCY = int(os.getenv("EVAL_MAP_CONCURRENCY", "8"))  # 동시에 평가할 구간 수
+
+# 방별 누적 요약
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))  # 요약 길이 상한
+SUMMARY_FOLD_TOKENS = int(os.getenv("SUMMARY_FOLD_TOKENS", "800"))  # 이만큼 쌓이면 요약에 합침
+SUMMARY_TTL = float(os.getenv("SUMMARY_TTL", str(6 * 3600)))
+
+_encoders = {}  # model → tiktoken 인코딩 (불러오지 못했으면 None)
+
+
+def _encoder(model):
+    """
+    모델의 tiktoken 인코딩 또는 None (tiktoken이 없거나 인코딩 파일을 받지 못한 경우 - 글자 수로 추정)
+    - tiktoken은 처음 쓸 때 BPE 파일을 내려받으므로, 네트워크가 없는 환경에서도 호출마다 실패하지 않도록 결과를 기억
+    """
+    if tiktoken is None:
+        return None
+    if model not in _encoders:
+        try:
+            try:
+                _encoders[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoders[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning("⚠️ tiktoken 인코딩을 불러오지 못해 글자 수로 토큰을 추정합니다 (%s): %s", model, e)
+            _encoders[model] = None
+    return _encoders[model]
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """토큰 수 (tiktoken을 쓸 수 없으면 영문 4자/한글 1자당 1토큰으로 넉넉하게 추정)"""
+    if not text:
+        return 0
+    encoder = _encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def format_turn(message):
+    return f"{message.get('name') or message['sender_id']}: {message['message']}"
+
+
+def fit_recent(lines, budget, model="gpt-4o-mini"):
+    """
+    최신 줄부터 예산 안에 들어가는 만큼 그대로 유지
+    - 반환값: (유지한 줄, 예산 밖으로 밀려난 앞쪽 줄, 사용한 토큰)
+    """
+    kept, used = [], 0
+    for index in range(len(lines) - 1, -1, -1):
+        cost = count_tokens(lines[index], model) + 1
+        if used + cost > budget:
+            return lines[index + 1:], lines[:index + 1], used
+        kept.append(lines[index])
+        used += cost
+    return lines, [], used
+
+
+def truncate_to_tokens(text, budget, model="gpt-4o-mini"):
+    """예산을 넘는 텍스트는 앞부분만 남김"""
+    if count_tokens(text, model) <= budget:
+        return text
+    encoder = _encoder(model)
+    if encoder is not None:
+        return encoder.decode(encoder.encode(text)[:budget])
+    while text and count_tokens(text, model) > budget:
+        text = text[:int(len(text) * 0.9)]
+    return text
+
+
+def split_windows(lines, window_tokens, model="gpt-4o-mini"):
+    """
+    순서를 유지하며 window_tokens 이하의 구간으로 나눔
+    - 한 줄이 구간보다 길면 잘라서 단독 구간으로
+    """
+    windows, window, used = [], [], 0
+    for line in lines:
+        line = truncate_to_tokens(line, window_tokens - 1, model)
+        cost = count_tokens(line, model) + 1
+        if window and used + cost > window_tokens:
+            windows.append(window)
+            window, used = [], 0
+        window.append(line)
+        used += cost
+    if window:
+        windows.append(window)
+    return windows
+
+
+def render_context(summary, lines):
+    """요약이 있으면 "이전 대화 요약"을 앞에 붙인 대화 텍스트"""
+    chat_text = "\n".join(lines)
+    if not summary:
+        return chat_text
+    return f"[이전 대화 요약]\n{summary}\n\n[최근 대화]\n{chat_text}"
+
+
+# ✅ 방별 누적 대화 요약
+class RoomSummaries:
+    """
+    맥락 예산 밖으로 밀려난 오래된 대화를 방마다 짧은 요약으로 유지
+    - 판단이 끝난 자동 개입 버퍼는 pending에 쌓이고,
+      SUMMARY_FOLD_TOKENS를 넘으면 백그라운드에서 기존 요약 + pending을 새 요약으로 합침 (증분 갱신)
+    - 상태는 state_store에 있으므로 REDIS_URL 설정 시 모든 워커가 같은 요약을 사용
+    - summarize(previous_summary, lines, max_tokens)는 gpt_handler에서 연결합니다.
+    """
+
+    def __init__(self, store=state_store, summarize=None, fold_tokens=SUMMARY_FOLD_TOKENS,
+                 max_tokens=SUMMARY_MAX_TOKENS, ttl=SUMMARY_TTL):
+        self.store = store
+        self.summarize = summarize
+        self.fold_tokens = fold_tokens
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self._folding: dict[str, asyncio.Task] = {}
+        self.folds = 0
+
+    async def get(self, room_id):
+        return await self.store.get_room_summary(room_id) or {"summary": "", "pending": [], "pending_tokens": 0}
+
+    async def build(self, room_id, recent_messages, budget):
+        """
+        최근 메시지는 그대로, 남는 예산에는 아직 요약되지 않은 줄과 누적 요약을 채워 맥락 텍스트 생성
+        - 최근 메시지만으로 예산을 넘으면 오래된 쪽은 빠짐 (처리가 끝난 뒤 add로 요약 대상에 추가)
+        """
+        record = await self.get(room_id)
+        summary = truncate_to_tokens(record["summary"], min(self.max_tokens, budget // 3))
+        remaining = budget - count_tokens(summary)
+
+        lines = [format_turn(m) for m in recent_messages]
+        kept, overflow, used = fit_recent(lines, remaining)
+        if not overflow:
+            # 남는 예산에 아직 요약되지 않은 이전 줄도 채움 (최근 메시지와 겹치는 줄 제외)
+            recent = set(kept)
+            earlier = [line for line in record["pending"] if line not in recent]
+            earlier, _, _ = fit_recent(earlier, remaining - used)
+            kept = earlier + kept
+        return render_context(summary, kept)
+
+    async def add(self, room_id, lines):
+        """이미 처리한 대화를 pending에 쌓고, 많이 쌓였으면 요약에 합치기 시작"""
+        if not lines:
+            return
+        record = await self.get(room_id)
+        # 요약이 계속 실패해도 무한히 쌓이지 않도록 오래된 줄부터 버림
+        record["pending"], _, record["pending_tokens"] = fit_recent(record["pending"] + list(lines),
+                                                                    self.fold_tokens * 4)
+        await self.store.set_room_summary(room_id, record, self.ttl)
+        if record["pending_tokens"] >= self.fold_tokens:
+            self._start_fold(room_id)
+
+    async def add_messages(self, room_id, messages):
+        await self.add(room_id, [format_turn(m) for m in messages])
+
+    def _start_fold(self, room_id):
+        if self.summarize is None or room_id in self._folding:
+            return
+        task = asyncio.create_task(self._fold(room_id))
+        self._folding[room_id] = task
+        task.add_done_callback(lambda _: self._folding.pop(room_id, None))
+
+    async def _fold(self, room_id):
+        record = await self.get(room_id)
+        pending = record["pending"]
+        if not pending:
+            return
+        try:
+            summary = await self.summarize(record["summary"], pending, self.max_tokens)
+        except Exception as e:
+            logger.error("❌ 대화 요약 갱신 실패 (%s): %s", room_id, e)
+            return
+        # 요약하는 동안 새로 쌓인 줄은 남겨 둠
+        latest = await self.get(room_id)
+        if latest["pending"][:len(pending)] == pending:
+            rest = latest["pending"][len(pending):]
+        else:  # 그 사이 오래된 줄이 잘려 나간 경우
+            folded = set(pending)
+            rest = [line for line in latest["pending"] if line not in folded]
+        await self.store.set_room_summary(room_id, {
+            "summary": summary,
+            "pending": rest,
+            "pending_tokens": sum(count_tokens(line) for line in rest),
+        }, self.ttl)
+        self.folds += 1
+
+    async def shutdown(self):
+        tasks = list(self._folding.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+room_summaries = RoomSummaries()
+
+
+async def build_transcript(messages, budget, summarize, model="gpt-4o-mini", max_summary_tokens=SUMMARY_MAX_TOKENS * 3):
+    """
+    방 상태 없이 긴 대화 전체를 예산에 맞추는 함수 (평가용)
+    - 예산 안에 들어가면 전체를 그대로
+    - 넘치면 최근 대화를 그대로 두고, 앞부분은 예산 크기 묶음으로 나눠 차례로 요약에 합침
+    """
+    lines = [format_turn(m) for m in messages]
+    kept, overflow, _ = fit_recent(lines, budget, model)
+    if not overflow:
+        return "\n".join(lines)
+
+    summary_budget = min(max_summary_tokens, budget // 3)
+    kept, overflow, _ = fit_recent(lines, budget - summary_budget, model)
+    summary = ""
+    chunk, chunk_tokens = [], 0
+    chunk_budget = max(budget - summary_budget, 1000)
+    for line in overflow:
+        cost = count_tokens(line, model) + 1
+        if chunk and chunk_tokens + cost > chunk_budget:
+            summary = await summarize(summary, chunk, summary_budget)
+            chunk, chunk_tokens = [], 0
+        chunk.append(truncate_to_tokens(line, chunk_budget, model))
+        chunk_tokens += cost
+    if chunk:
+        summary = await summarize(summary, chunk, summary_budget)
+    return render_context(truncate_to_tokens(summary, summary_budget, model), kept)
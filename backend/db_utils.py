@@ -1,16 +1,8 @@
 import datetime
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase_repo import repo
+from log_utils import get_logger
 
-# 환경변수 로드
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_API_KEY")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-
-# Supabase 클라이언트 초기화
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+logger = get_logger("db")
 
 async def save_message_to_db(room_id, sender_id, message_content, role="user", timestamp=None, whisper_to=None, reasoning=""):
     """메시지를 데이터베이스에 저장"""
@@ -18,7 +10,7 @@ async def save_message_to_db(room_id, sender_id, message_content, role="user", t
         timestamp = datetime.datetime.utcnow().isoformat()
     
     try:
-        result = supabase.table("messages").insert({
+        result = await repo.insert_message({
             "room_id": room_id,
             "sender_id": sender_id,
             "message": message_content,
@@ -26,34 +18,35 @@ async def save_message_to_db(room_id, sender_id, message_content, role="user", t
             "timestamp": timestamp,
             "whisper_to": whisper_to,
             "reasoning": reasoning
-        }).execute()
-        return result.data
+        })
+        return [result] if result else []
     except Exception as e:
-        print(f"메시지 저장 중 오류 발생: {e}")
+        logger.error("메시지 저장 중 오류 발생: %s", e)
         return None
 
 async def save_gpt_intervention(room_id, message_id, intervention_type, target_student=None, reasoning=""):
     """GPT 자동 개입 로그를 저장하는 함수 (교사 대시보드용)"""
     try:
-        print(f"저장 시도: room_id={room_id}, message_id={message_id}, type={intervention_type}, target={target_student}")
+        logger.debug("저장 시도: room_id=%s, message_id=%s, type=%s, target=%s",
+                     room_id, message_id, intervention_type, target_student)
         
         # message_id 유효성 검사
         if message_id is None or message_id == 0:
-            print(f"❌ 유효하지 않은 message_id: {message_id}")
+            logger.error("❌ 유효하지 않은 message_id: %s", message_id)
             return None
         
         # 메시지 ID가 실제로 존재하는지 확인
-        message_exists = supabase.table("messages").select("message_id").eq("message_id", message_id).execute()
+        message_exists = await repo.message_exists(message_id)
         
-        if not message_exists.data:
-            print(f"❌ message_id={message_id}가 messages 테이블에 존재하지 않습니다.")
+        if not message_exists:
+            logger.warning("❌ message_id=%s가 messages 테이블에 존재하지 않습니다.", message_id)
             # 가장 최근 메시지 ID 사용
-            recent_message = supabase.table("messages").select("message_id").order("timestamp", desc=True).limit(1).execute()
-            if recent_message.data:
-                message_id = recent_message.data[0]["message_id"]
-                print(f"✅ 최근 메시지 ID로 대체: {message_id}")
+            recent_message_id = await repo.latest_message_id()
+            if recent_message_id:
+                message_id = recent_message_id
+                logger.warning("✅ 최근 메시지 ID로 대체: %s", message_id)
             else:
-                print("❌ 메시지 테이블에 데이터가 없습니다.")
+                logger.error("❌ 메시지 테이블에 데이터가 없습니다.")
                 return None
         
         # 타입 변환 시도
@@ -61,7 +54,7 @@ async def save_gpt_intervention(room_id, message_id, intervention_type, target_s
             try:
                 message_id = int(message_id)
             except (ValueError, TypeError):
-                print(f"❌ message_id 변환 실패: {message_id}를 정수로 변환할 수 없음")
+                logger.error("❌ message_id 변환 실패: %s를 정수로 변환할 수 없음", message_id)
                 return None
         
         data = {
@@ -77,11 +70,9 @@ async def save_gpt_intervention(room_id, message_id, intervention_type, target_s
         if reasoning:
             data["reasoning"] = reasoning
             
-        result = supabase.table("gpt_interventions").insert(data).execute()
-        print("✅ GPT 개입 로그 저장 성공")
-        return result.data
+        result = await repo.insert_gpt_intervention(data)
+        logger.debug("✅ GPT 개입 로그 저장 성공")
+        return [result] if result else []
     except Exception as e:
-        print(f"GPT 개입 로그 저장 중 오류 발생: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("GPT 개입 로그 저장 중 오류 발생: %s", e)
         return None 
\ No newline at end of file
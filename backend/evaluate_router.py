@@ -1,15 +1,16 @@
 from fastapi import APIRouter
 from pydantic import BaseModel
-from openai import AsyncOpenAI
 from typing import List, Optional
 from dotenv import load_dotenv
-import os
-import traceback
+from supabase_repo import repo
+from llm_gateway import gateway
+from gpt_handler import EVALUATION_MODEL
+from log_utils import get_logger
 
 load_dotenv()
+logger = get_logger("evaluation")
 
 router = APIRouter()
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # 💬 메시지 모델
 class ChatMessage(BaseModel):
@@ -31,14 +32,8 @@ class EvaluationResponse(BaseModel):
     feedback: str
 
 # 🗃 Supabase 저장 함수
-def save_evaluation_result(summary, topic_id, room_id, student_id=None,
-                           class_id=None, conversation_id=None):
-    from supabase import create_client
-
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    supabase = create_client(url, key)
-
+async def save_evaluation_result(summary, topic_id, room_id, student_id=None,
+                                 class_id=None, conversation_id=None):
     data = {
         "summary": summary,
         "topic_id": topic_id,
@@ -49,20 +44,19 @@ def save_evaluation_result(summary, topic_id, room_id, student_id=None,
         "evaluation_type": "individual" if student_id else "group",
     }
 
-    print("📥 저장할 평가 결과:", data)
+    logger.debug("📥 저장할 평가 결과: %s", data)
 
     try:
-        res = supabase.table("gpt_chat_evaluations").insert(data).execute()
-        print("✅ 평가 결과 저장 완료:", res)
+        res = await repo.insert_evaluations([data])
+        logger.info("✅ 평가 결과 저장 완료: %s", res)
     except Exception as e:
-        print("❌ 평가 결과 저장 실패:", e)
-        traceback.print_exc()
+        logger.exception("❌ 평가 결과 저장 실패: %s", e)
 
 # 🎯 GPT 평가 API 라우터
 @router.post("/evaluate-chat", response_model=EvaluationResponse)
 async def evaluate_chat(data: EvaluationRequest):
-    print("📩 평가 요청 도착:", data.topic_id)
-    print("👤 평가 대상:", data.target_student or "전체")
+    logger.info("📩 평가 요청 도착: %s", data.topic_id)
+    logger.info("👤 평가 대상: %s", data.target_student or "전체")
 
     # 1. system_prompt 구성
     system_prompt = f"""
@@ -84,17 +78,12 @@ async def evaluate_chat(data: EvaluationRequest):
 
     try:
         # 3. GPT 응답 생성
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.7,
-        )
-        feedback = response.choices[0].message.content.strip()
-        print("📤 GPT 평가 결과 생성 완료")
-        print("📄 평가 요약:\n", feedback[:200], "...")
+        feedback = await gateway.chat(EVALUATION_MODEL, messages, purpose="evaluate", temperature=0.7)
+        logger.info("📤 GPT 평가 결과 생성 완료")
+        logger.debug("📄 평가 요약:\n%s ...", feedback[:200])
 
         # 4. 평가 결과 저장
-        save_evaluation_result(
+        await save_evaluation_result(
             summary=feedback,
             topic_id=data.topic_id,
             room_id=data.room_id,
@@ -106,6 +95,5 @@ async def evaluate_chat(data: EvaluationRequest):
         return EvaluationResponse(feedback=feedback)
 
     except Exception as e:
-        print("❌ GPT 평가 오류:", e)
-        traceback.print_exc()
+        logger.exception("❌ GPT 평가 오류: %s", e)
         return EvaluationResponse(feedback="GPT 평가 생성 중 오류가 발생했습니다.")
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+from cache_utils import TTLCache
+from gpt_handler import evaluate_conversation, EVALUATION_MODEL, EVALUATION_ERROR_TEXT, _evaluation_messages
+from supabase_repo import repo, SupabaseError
+from log_utils import get_logger
+
+logger = get_logger("evaluation")
+
+# ✅ 평가 결과 캐시 (내용 주소 기반: 같은 루브릭 + 같은 대화면 같은 평가)
+EVAL_CACHE_SIZE = int(os.getenv("EVAL_CACHE_SIZE", "2000"))
+evaluation_cache = TTLCache(maxsize=EVAL_CACHE_SIZE, ttl=None)
+
+
+def _normalize_messages(messages):
+    """발화자 + 공백을 정리한 메시지 내용만 남김 (표시용 필드/시간 차이는 키에 영향 없음)"""
+    normalized = []
+    for m in messages:
+        text = " ".join(str(m.get("message") or "").split())
+        if text:
+            normalized.append([m.get("sender_id"), text])
+    return normalized
+
+
+def evaluation_key(rubric_prompt, messages, target_student=None, model=EVALUATION_MODEL):
+    """
+    (모델, 루브릭, 정규화된 대화, 평가 대상)의 sha256 - gpt_chat_evaluations.cache_key
+    - 대화는 모델이 실제로 보는 부분만 (평가 대상이 있으면 그 학생의 발화만) → 다른 학생이 말해도 키가 그대로
+    """
+    payload = json.dumps({
+        "model": model,
+        "rubric": (rubric_prompt or "").strip(),
+        "messages": _normalize_messages(_evaluation_messages(messages, target_student)),
+        "target": target_student or None,
+    }, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def lookup_evaluations(cache_keys):
+    """
+    메모리 캐시 → gpt_chat_evaluations 순서로 저장된 평가 조회
+    - 메모리에 없는 키는 한 번의 in.(...) 쿼리로 가져옴
+    - 반환값: {cache_key: summary} (찾은 것만)
+    """
+    found = {}
+    for key in dict.fromkeys(cache_keys):
+        summary = evaluation_cache.get(key)
+        if summary is not None:
+            found[key] = summary
+    missing = [key for key in dict.fromkeys(cache_keys) if key not in found]
+    if not missing:
+        return found
+
+    try:
+        rows = await repo.get_evaluations_by_keys(missing)
+    except SupabaseError as e:
+        logger.error("❌ 평가 캐시 조회 실패: %s", e)
+        return found
+    for row in rows:  # 최신순이므로 키마다 첫 행이 최신 평가
+        if row.get("summary") and row["cache_key"] not in found:
+            found[row["cache_key"]] = row["summary"]
+            evaluation_cache.set(row["cache_key"], row["summary"])
+    return found
+
+
+async def evaluate_cached(rubric_prompt, messages, target_student=None, force_refresh=False):
+    """
+    평가 결과를 캐시에서 찾고, 없을 때만 GPT로 평가합니다.
+    - 대화에 새 메시지가 생기거나 루브릭이 바뀌면 키가 달라지므로 그때만 다시 평가
+    - force_refresh: 캐시를 무시하고 새로 평가 (결과는 같은 키로 덮어씀)
+    - 반환값: (feedback, cache_key, cached) - 새로 만든 평가는 호출한 쪽에서 cache_key와 함께 저장
+    """
+    cache_key = evaluation_key(rubric_prompt, messages, target_student)
+    if not force_refresh:
+        summary = (await lookup_evaluations([cache_key])).get(cache_key)
+        if summary is not None:
+            return summary, cache_key, True
+
+    feedback = await evaluate_conversation(rubric_prompt, messages, target_student)
+    if feedback != EVALUATION_ERROR_TEXT:
+        evaluation_cache.set(cache_key, feedback)
+    return feedback, cache_key, False
@@ -1,15 +1,213 @@
 import os
+import re
 import json
+import asyncio
 from datetime import datetime
-from openai import AsyncOpenAI
 from supabase_client import (
     get_room_history,
     get_system_prompt,
+    get_room_topic_id,
     get_student_name,
     save_message_to_db
 )
+from presence import user_room
+from llm_gateway import gateway
+from context_builder import (
+    room_summaries,
+    build_transcript,
+    count_tokens,
+    format_turn,
+    split_windows,
+    JUDGE_CONTEXT_TOKENS,
+    FEEDBACK_CONTEXT_TOKENS,
+    DIRECT_CONTEXT_TOKENS,
+    EVAL_CONTEXT_TOKENS,
+    EVAL_MODE,
+    EVAL_WINDOW_TOKENS,
+    EVAL_MAP_CONCURRENCY
+)
+from log_utils import HOT, get_logger
+from metrics import span
+from speculation import speculator
+from prefilter import prefilter
+from answer_cache import answer_cache
+
+logger = get_logger("gpt")
+
+# 호출 종류별 모델
+JUDGE_MODEL = os.getenv("JUDGE_MODEL", "gpt-5-mini")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")  # 자동 개입 피드백, 직접 질문 응답
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+INTERVENTION_MODEL = os.getenv("INTERVENTION_MODEL", CHAT_MODEL)  # 판단 + 피드백 한 번 호출 (structured output 지원 모델)
+
+INTERVENTION_TYPES = ("positive", "guidance", "individual", "none")
+
+# 판단 + 피드백 한 번 호출의 응답 형식 (strict json_schema)
+# feedback을 마지막 필드로 두어, 스트리밍 중 앞 필드(판단)가 먼저 완성되면 피드백 조각을 바로 전송
+INTERVENTION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "intervention",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "intervention_type": {"type": "string", "enum": list(INTERVENTION_TYPES)},
+                "target_student": {"type": ["string", "null"]},
+                "reasoning": {"type": "string"},
+                "feedback": {"type": "string"},
+            },
+            "required": ["intervention_type", "target_student", "reasoning", "feedback"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+def extract_json_object(text):
+    """
+    모델 응답에서 JSON 객체를 꺼내는 함수
+    - JSON만 온 경우, ```json 코드 블록으로 감싼 경우, 앞뒤에 설명이 붙은 경우 모두 처리
+    - 객체를 찾지 못하면 ValueError
+    """
+    text = (text or "").strip()
+    candidates = [text] + [block.strip() for block in _JSON_FENCE.findall(text)]
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    decoder = json.JSONDecoder()
+    for start in [i for i, ch in enumerate(text) if ch == "{"]:
+        try:
+            value, _ = decoder.raw_decode(text, start)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    raise ValueError(f"JSON 객체를 찾을 수 없습니다: {text[:80]!r}")
+
+def _participant_ids(recent_messages):
+    """대화에 참여한 학생 ID (sender_id가 2s로 시작)"""
+    return sorted({msg['sender_id'] for msg in recent_messages
+                   if msg.get('sender_id') and msg['sender_id'].startswith('2s')})
+
+def _to_judgment(result, participant_ids, warn=True):
+    """
+    판단 JSON → should_respond() 반환 형식
+    - ⚠️ 안전성 검증: 개인 피드백 대상이 참여자 목록에 없으면 전체 피드백으로 변경
+    """
+    # 이전 형식과의 호환성 유지
+    should_respond = result["intervention_type"] != "none"
+    target = result.get("target_student") if result["intervention_type"] == "individual" else None
+
+    if target and target not in participant_ids:
+        if warn:
+            logger.warning("⚠️ GPT가 잘못된 학생 ID(%s)를 지정했습니다. 참여자 목록: %s",
+                           target, ", ".join(participant_ids))
+            logger.warning("⚠️ 개인 피드백이 전체 피드백으로 변경되었습니다.")
+        # 개인 피드백을 전체 피드백으로 변경
+        result["intervention_type"] = "guidance"
+        result["target_student"] = None
+        result["reasoning"] = (result.get("reasoning") or "") + " (경고: 대상 학생 ID가 참여자 목록에 없어 전체 피드백으로 변경됨)"
+        target = None
+
+    return {
+        "should_respond": should_respond,
+        "target": target,
+        "target_student": target,
+        "intervention_type": result["intervention_type"],
+        "reasoning": result.get("reasoning", "")
+    }
+
+class _StreamedField:
+    """
+    스트리밍으로 받는 JSON 객체에서 마지막 문자열 필드(field)의 내용만 조각으로 풀어내는 파서
+    - feed(delta) → (head, piece)
+      head: 필드가 처음 시작된 순간 그 앞 필드들의 dict (그 외에는 None)
+      piece: 이번에 새로 풀린 문자열 조각 (이스케이프가 조각 경계에서 잘리면 다음 조각과 합쳐 풂)
+    """
+
+    def __init__(self, field):
+        self._marker = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.text = ""
+        self.done = False
+        self._pos = None  # 다음에 풀 위치 (필드 시작 전이면 None)
+
+    def feed(self, delta):
+        self.text += delta
+        head = None
+        if self._pos is None:
+            found = self._marker.search(self.text)
+            if not found:
+                return None, ""
+            self._pos = found.end()
+            try:
+                head = json.loads(self.text[:self._pos] + '"}')
+            except ValueError:
+                head = {}  # 필드 순서가 다르면 판단을 미리 알 수 없음
+        if self.done:
+            return head, ""
+        end, closed = self._safe_end()
+        piece = json.loads('"' + self.text[self._pos:end] + '"') if end > self._pos else ""
+        self._pos = end
+        self.done = closed
+        return head, piece
+
+    def _safe_end(self):
+        """지금 풀 수 있는 끝 위치와 문자열이 닫혔는지"""
+        text, i = self.text, self._pos
+        while i < len(text):
+            ch = text[i]
+            if ch == '"':
+                return i, True
+            if ch != "\\":
+                i += 1
+                continue
+            if i + 1 >= len(text):
+                break
+            if text[i + 1] != "u":
+                i += 2
+                continue
+            if i + 6 > len(text):
+                break
+            if 0xD800 <= int(text[i + 2:i + 6], 16) <= 0xDBFF:  # 서로게이트 쌍은 함께 풀어야 함
+                if i + 12 > len(text):
+                    break
+                i += 12
+            else:
+                i += 6
+        return i, False
+
+async def complete_chat(model, messages, on_delta=None, purpose="chat", **kwargs):
+    """
+    Chat Completions 호출 공통 함수 (공유 게이트웨이 경유: 속도 제한, 우선순위, 재시도, 지연 시간 기록)
+    - on_delta가 없으면 전체 응답을 기다려 텍스트를 반환
+    - on_delta(async 콜백)가 있으면 스트리밍 API로 받아 조각마다 on_delta(delta)를 호출하고,
+      마지막에 전체 텍스트를 반환
+    - purpose: 토큰 사용량을 기록할 호출 종류 (judge, feedback, direct, evaluate, summary ...)
+    """
+    return await gateway.chat(model, messages, on_delta=on_delta, purpose=purpose, **kwargs)
+
+async def summarize_turns(previous_summary, lines, max_tokens):
+    """
+    기존 요약에 새 대화 줄을 합쳐 갱신된 요약을 만드는 함수 (방별 누적 요약, 긴 평가 대화 압축에 사용)
+    """
+    prompt_messages = [
+        {"role": "system", "content": (
+            "당신은 수업 채팅 기록을 요약하는 보조자입니다. 기존 요약과 새 대화를 합쳐 하나의 요약으로 갱신하세요.\n"
+            "누가 어떤 주장/질문/기여를 했는지 학생 이름과 함께 남기고, 잡담은 생략하세요.\n"
+            f"요약만 출력하고 {max_tokens}토큰을 넘기지 마세요."
+        )},
+        {"role": "user", "content": f"기존 요약:\n{previous_summary or '(없음)'}\n\n새 대화:\n" + "\n".join(lines)}
+    ]
+    return await complete_chat(SUMMARY_MODEL, prompt_messages, purpose="summary",
+                               temperature=0.2, max_tokens=max_tokens)
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+room_summaries.summarize = summarize_turns
 
 class GPTInterventionService:
     """
@@ -21,16 +219,17 @@ class GPTInterventionService:
     def __init__(self, room_id):
         self.room_id = room_id
 
-    async def should_respond(self, recent_messages):
+    async def should_respond(self, recent_messages, purpose="judge"):
+        """
+        1단계: 개입 여부 판단
+        - purpose: judge (실제 판단) / judge_shadow (A/B 결정 비교용으로 함께 돌리는 판단)
+        """
         # 참여한 학생 ID 목록 생성
-        participant_ids = set()
-        for msg in recent_messages:
-            if msg.get('sender_id') and msg['sender_id'].startswith('2s'):
-                participant_ids.add(msg['sender_id'])
+        participant_ids = _participant_ids(recent_messages)
         
         participant_list = ", ".join(participant_ids)
         
-        chat_text = "\n".join([f"{m.get('name', m['sender_id'])}: {m['message']}" for m in recent_messages])
+        chat_text = await room_summaries.build(self.room_id, recent_messages, JUDGE_CONTEXT_TOKENS)
         system_prompt = await get_system_prompt(self.room_id)
 
         judgment_instruction = f"""
@@ -66,43 +265,45 @@ GPT는 교사의 보조교사로서, 다음 기준에 따라 개입 상황을 
         ]
 
         try:
-            response = await client.chat.completions.create(
-                model="gpt-5-mini",
-                messages=messages,
-                temperature=0
-            )
-            raw = response.choices[0].message.content.strip()
-            print("🧠 GPT 판단 응답:", raw)
-            result = json.loads(raw)
-            
-            # 이전 형식과의 호환성 유지
-            should_respond = result["intervention_type"] != "none"
-            target = result.get("target_student") if result["intervention_type"] == "individual" else None
-            
-            # ⚠️ 안전성 검증: target이 참여자 목록에 있는지 확인
-            if target and target not in participant_ids:
-                print(f"⚠️ GPT가 잘못된 학생 ID({target})를 지정했습니다. 참여자 목록: {participant_list}")
-                # 개인 피드백을 전체 피드백으로 변경
-                result["intervention_type"] = "guidance"
-                result["target_student"] = None
-                result["reasoning"] += " (경고: 대상 학생 ID가 참여자 목록에 없어 전체 피드백으로 변경됨)"
-                target = None
-                print("⚠️ 개인 피드백이 전체 피드백으로 변경되었습니다.")
-            
-            return {
-                "should_respond": should_respond,
-                "target": target,
-                "target_student": target,
-                "intervention_type": result["intervention_type"],
-                "reasoning": result.get("reasoning", "")
-            }
+            raw = await complete_chat(JUDGE_MODEL, messages, purpose=purpose, temperature=0)
+            logger.debug("🧠 GPT 판단 응답: %s", raw)
+            # 설명 문장이나 코드 블록으로 감싼 응답도 처리
+            judgment = _to_judgment(extract_json_object(raw), participant_ids, warn=purpose == "judge")
+            if purpose == "judge":
+                speculator.record_decision(judgment["intervention_type"])  # 다음 추측 생성 유형 예측
+            return judgment
         except Exception as e:
-            print("❌ 판단 오류:", e)
+            logger.error("❌ 판단 오류: %s", e)
             return {"should_respond": False, "intervention_type": "none", "target": None}
 
-    async def generate_feedback(self, recent_messages, intervention_type, target=None):
+    async def prescreen(self, recent_messages):
+        """
+        LLM 판단 전 로컬 사전 선별 (PREFILTER_ENABLED)
+        - 반환: prefilter.screen 결과 (skip=True면 주제에 맞고 고른 대화 → 판단 생략)
+        """
+        if not prefilter.enabled:
+            return {"skip": False, "reason": "disabled", "features": None}
         system_prompt = await get_system_prompt(self.room_id)
-        chat_text = "\n".join([f"{m.get('name', m['sender_id'])}: {m['message']}" for m in recent_messages])
+        return prefilter.screen(recent_messages, system_prompt)
+
+    async def speculate_feedback(self, recent_messages):
+        """
+        판단과 동시에 가장 가능성 높은 유형(positive/guidance)의 피드백을 미리 생성 (SPECULATIVE_FEEDBACK)
+        - 반환: Speculation (판단이 나오면 speculator.commit / cancel) 또는 None (꺼짐, 가능성 낮음, 낭비 한도 초과)
+        """
+        intervention_type = speculator.predict()
+        if intervention_type is None:
+            return None
+        system_prompt = await get_system_prompt(self.room_id)
+        prompt_tokens = count_tokens(system_prompt, CHAT_MODEL) + min(
+            FEEDBACK_CONTEXT_TOKENS, sum(count_tokens(format_turn(m), CHAT_MODEL) for m in recent_messages))
+        return speculator.start(intervention_type, prompt_tokens, lambda on_delta: self.generate_feedback(
+            recent_messages, intervention_type, on_delta=on_delta, purpose="feedback_speculative"))
+
+    async def generate_feedback(self, recent_messages, intervention_type, target=None, on_delta=None,
+                                purpose="feedback"):
+        system_prompt = await get_system_prompt(self.room_id)
+        chat_text = await room_summaries.build(self.room_id, recent_messages, FEEDBACK_CONTEXT_TOKENS)
         
         # 참여자 목록 생성 (유효한 타겟 확인용)
         participant_ids = set()
@@ -132,17 +333,17 @@ GPT는 교사의 보조교사로서, 다음 기준에 따라 개입 상황을 
         elif intervention_type == "individual":
             # 타겟 학생이 유효한지 재확인
             if not target or target not in participant_ids:
-                print(f"⚠️ 유효하지 않은 학생 ID로 개인 피드백 생성 시도: {target}")
+                logger.warning("⚠️ 유효하지 않은 학생 ID로 개인 피드백 생성 시도: %s", target)
                 # 대안으로 일반 안내 피드백 제공
                 return "현재 대화에 도움이 필요해 보입니다. 주제에 맞게 집중해서 대화를 이어가면 좋겠습니다."
                 
             try:
-                student_name = get_student_name(target)
+                student_name = await get_student_name(target)
                 if not student_name or student_name == target:
                     # 이름을 가져오지 못한 경우 ID로 대체
                     student_name = f"학생({target})"
             except Exception as e:
-                print(f"❌ 학생 이름 조회 오류: {e}")
+                logger.error("❌ 학생 이름 조회 오류: %s", e)
                 student_name = f"학생({target})"
                 
             feedback_instruction = f"""
@@ -163,18 +364,111 @@ GPT는 교사의 보조교사로서, 다음 기준에 따라 개입 상황을 
             {"role": "user", "content": f"최근 대화:\n{chat_text}"}
         ]
 
+        streamed = False
+
+        async def forward(delta):
+            nonlocal streamed
+            streamed = True
+            await on_delta(delta)
+
         try:
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=prompt_messages,
+            return await complete_chat(
+                CHAT_MODEL,
+                prompt_messages,
+                on_delta=forward if on_delta else None,
+                purpose=purpose,
                 temperature=temperature
             )
-            return response.choices[0].message.content.strip()
         except Exception as e:
-            print("❌ 응답 생성 오류:", e)
-            return "응답을 생성하는 데 실패했어요."
+            logger.error("❌ 응답 생성 오류: %s", e)
+            # 이미 조각을 보낸 말풍선만 안내 문구로 마무리하고, 아니면 이번 개입을 건너뜀 (None)
+            return "응답을 생성하는 데 실패했어요." if streamed else None
+
+    async def judge_and_respond(self, recent_messages, open_stream=None):
+        """
+        판단 + 피드백을 한 번의 structured output 호출로 생성 (INTERVENTION_SINGLE_CALL_RATE)
+        - open_stream(judgment): 스트리밍 중 피드백 필드가 시작될 때(판단 필드가 완성된 시점) 한 번 호출
+          → on_delta(async 콜백) 또는 None(스트리밍하지 않음)을 반환
+        - 반환: should_respond()와 같은 판단 dict + "feedback" (판단 필드가 바뀌었거나 비어 있으면 "")
+          호출/해석에 실패하면 None (호출한 쪽이 기존 2단계 방식으로 다시 처리)
+        """
+        participant_ids = _participant_ids(recent_messages)
+        names = await asyncio.gather(*(get_student_name(student_id) for student_id in participant_ids))
+        chat_text = await room_summaries.build(self.room_id, recent_messages, FEEDBACK_CONTEXT_TOKENS)
+        system_prompt = await get_system_prompt(self.room_id)
+
+        instruction = f"""
+이 채팅방은 위와 같은 목적을 가진 공간입니다.
 
-    async def process_auto_intervention(self, recent_messages, sid_to_user, sio):
+GPT는 교사의 보조교사로서, 먼저 다음 기준에 따라 개입 상황을 판단하고 필요하면 바로 피드백을 작성하세요:
+
+상황 1: 학생들이 주어진 주제에 맞게 잘 토론하고 있다면 → 긍정적인 피드백 (응답 유형: "positive")
+  좋은 점을 칭찬하고 계속 대화를 이어가도록 동기부여 하세요.
+상황 2: 학생들이 주어진 주제와 맞지 않게 대화하거나 방향성이 필요한 경우 → 방향 제시 피드백 (응답 유형: "guidance")
+  주제로 다시 집중하도록 친절하고 명확하게 안내하고, 구체적인 질문이나 활동을 제안하세요.
+상황 3: 특정 학생이 잘 참여하지 못하거나 방향이 다른 말을 하는 경우 → 개인 피드백 (응답 유형: "individual")
+  해당 학생에게만 귓속말로 전달됩니다. 학생을 존중하면서도 명확하게 도움을 주세요.
+상황 4: 개입이 불필요한 경우 → 개입하지 않음 (응답 유형: "none", feedback은 빈 문자열)
+
+현재 채팅에 참여 중인 학생 ID 목록: {", ".join(participant_ids)}
+학생 이름: {", ".join(f"{student_id}={name}" for student_id, name in zip(participant_ids, names))}
+
+응답 필드:
+- intervention_type: "positive" / "guidance" / "individual" / "none"
+- target_student: 개인 피드백인 경우만 위 목록의 학생 ID, 아니면 null
+- reasoning: 판단 이유를 간략히 설명
+- feedback: 학생들에게 보낼 피드백 (500자 내외)
+
+⚠️ "target_student"는 반드시 위 참여자 목록에 있는 정확한 학생 ID만 지정해야 합니다.
+"""
+
+        messages = [
+            {"role": "system", "content": f"{system_prompt.strip()}\n\n{instruction.strip()}"},
+            {"role": "user", "content": f"최근 대화:\n{chat_text}"}
+        ]
+
+        parser = _StreamedField("feedback")
+        on_delta = None
+        streamed = None  # 피드백 조각을 보내기 시작한 판단
+
+        async def forward(delta):
+            nonlocal on_delta, streamed
+            head, piece = parser.feed(delta)
+            if head and head.get("intervention_type") in INTERVENTION_TYPES:
+                judgment = _to_judgment(dict(head), participant_ids, warn=False)
+                # 대상 검증으로 판단이 바뀌면 이 피드백은 쓰지 않으므로 스트리밍하지 않음
+                if judgment["should_respond"] and judgment["intervention_type"] == head["intervention_type"]:
+                    on_delta = await open_stream(judgment)
+                    streamed = judgment if on_delta else None
+            if piece and on_delta is not None:
+                await on_delta(piece)
+
+        try:
+            raw = await complete_chat(
+                INTERVENTION_MODEL,
+                messages,
+                on_delta=forward if open_stream else None,
+                purpose="judge_respond",
+                temperature=0.5,
+                response_format=INTERVENTION_RESPONSE_FORMAT
+            )
+            logger.debug("🧠 GPT 판단 + 피드백 응답: %s", raw)
+            result = extract_json_object(raw)
+            intervention_type = result["intervention_type"]
+            judgment = _to_judgment(result, participant_ids)
+        except Exception as e:
+            logger.error("❌ 판단 + 피드백 오류: %s", e)
+            if streamed is None:
+                return None
+            # 이미 조각을 보낸 말풍선은 안내 문구로 마무리
+            return {**streamed, "feedback": "응답을 생성하는 데 실패했어요."}
+
+        feedback = result.get("feedback")
+        same = judgment["intervention_type"] == intervention_type and isinstance(feedback, str)
+        judgment["feedback"] = feedback.strip() if same and judgment["should_respond"] else ""
+        return judgment
+
+    async def process_auto_intervention(self, recent_messages, presence, sio):
         judgment = await self.should_respond(recent_messages)
         should_respond = judgment.get("should_respond", False)
         intervention_type = judgment.get("intervention_type", "none")
@@ -182,26 +476,28 @@ GPT는 교사의 보조교사로서, 다음 기준에 따라 개입 상황을 
         reasoning = judgment.get("reasoning", "")
         
         if not should_respond:
-            print("🤖 GPT 판단: 개입 불필요")
+            logger.debug("🤖 GPT 판단: 개입 불필요")
             return
         
         # 안전성 검증: 타겟 학생이 지정되었는데 실제 참여자 목록에 없는 경우 처리
         if intervention_type == "individual" and target:
-            # 실제 채팅방 참여자 ID 목록
-            participant_ids = list(sid_to_user.values())
-            
-            if target not in participant_ids:
-                print(f"⚠️ 경고: 타겟 학생 ID({target})가 참여자 목록에 없습니다!")
-                print(f"💡 참여자 목록: {participant_ids}")
+            # 실제 채팅방 참여 여부 (접속자 색인 조회)
+            if not await presence.is_in_room(target, self.room_id):
+                logger.warning("⚠️ 경고: 타겟 학생 ID(%s)가 참여자 목록에 없습니다!", target)
+                logger.warning("💡 참여자 목록: %s", await presence.participant_ids(self.room_id))
                 
                 # 에러 로깅 후 개인 피드백을 전체 피드백으로 변경
                 intervention_type = "guidance"
                 target = None
                 reasoning += " (주의: 개인 피드백이 전체 피드백으로 변경됨 - 대상 학생을 찾을 수 없음)"
         
-        print(f"🤖 GPT 판단: {intervention_type} 유형 피드백 제공" + (f" ({target}에게)" if target else ""))
+        logger.info("🤖 GPT 판단: %s 유형 피드백 제공%s", intervention_type, f" ({target}에게)" if target else "",
+                    extra=HOT)
         
         gpt_text = await self.generate_feedback(recent_messages, intervention_type, target)
+        if gpt_text is None:
+            logger.warning("⚠️ 피드백 생성 실패로 이번 개입을 건너뜁니다.")
+            return
         gpt_time = datetime.utcnow().isoformat()
 
         # 메시지 DB 저장
@@ -215,13 +511,12 @@ GPT는 교사의 보조교사로서, 다음 기준에 따라 개입 상황을 
             reasoning=reasoning
         )
         
-        print(f"✅ 메시지 응답: {saved_message}")
+        logger.debug("✅ 메시지 응답: %s", saved_message)
 
         if intervention_type == "individual" and target:
-            # 개인 피드백 (귓속말)
-            message_sent = False
-            for sid, uid in sid_to_user.items():
-                if uid == target:
+            # 개인 피드백 (귓속말) - 이 채팅방의 대상 학생 개인 방으로 전송 (이 방에 연 여러 탭 모두 수신)
+            if await presence.sids_of(target, self.room_id):
+                with span("emit", "receive_message"):
                     await sio.emit("receive_message", {
                         "sender_id": "gpt",
                         "message": gpt_text,
@@ -231,39 +526,42 @@ GPT는 교사의 보조교사로서, 다음 기준에 따라 개입 상황을 
                         "whisper": True,
                         "whisper_to": target,  # 일관성을 위해 두 필드 모두 설정
                         "reasoning": reasoning
-                    }, to=sid)
-                    print(f"✉️ 귓속말 전송: {target}에게")
-                    message_sent = True
-                    break
-            
-            # 메시지를 보내지 못했다면 로그에 기록
-            if not message_sent:
-                print(f"⚠️ 경고: {target}에게 귓속말을 보내지 못했습니다. 클라이언트가 연결되어 있지 않을 수 있습니다.")
+                    }, room=user_room(target, self.room_id))
+                logger.debug("✉️ 귓속말 전송: %s에게", target)
+            else:
+                # 메시지를 보내지 못했다면 로그에 기록
+                logger.warning("⚠️ 경고: %s에게 귓속말을 보내지 못했습니다. 클라이언트가 연결되어 있지 않을 수 있습니다.",
+                               target)
         else:
             # 전체 피드백
-            await sio.emit("receive_message", {
-                "sender_id": "gpt",
-                "message": gpt_text,
-                "role": "assistant",
-                "timestamp": gpt_time,
-                "feedback_type": intervention_type,
-                "reasoning": reasoning
-            }, room=self.room_id)
-            print(f"📢 전체 메시지 전송: {intervention_type} 유형")
-
-    async def generate_direct_response(self, recent_messages, student_question, student_id):
+            with span("emit", "receive_message"):
+                await sio.emit("receive_message", {
+                    "sender_id": "gpt",
+                    "message": gpt_text,
+                    "role": "assistant",
+                    "timestamp": gpt_time,
+                    "feedback_type": intervention_type,
+                    "reasoning": reasoning
+                }, room=self.room_id)
+            logger.debug("📢 전체 메시지 전송: %s 유형", intervention_type)
+
+    async def generate_direct_response(self, recent_messages, student_question, student_id, on_delta=None):
         """
         학생이 GPT에게 직접 질문한 경우 응답을 생성하는 함수
         - recent_messages: 최근 대화 기록
         - student_question: 학생의 질문
         - student_id: 질문한 학생의 ID
+        - on_delta: 스트리밍 시 응답 조각을 받을 async 콜백 (없으면 전체 응답을 한 번에 생성)
+        - ANSWER_CACHE_ENABLED: 같은 주제에서 거의 같은 질문에 답한 적이 있으면 그 답변을 재사용 (answer_cache)
+          캐시할 답변은 다른 조에도 보내므로 이 방의 대화와 학생 이름 없이 주제와 질문만으로 생성
         """
         system_prompt = await get_system_prompt(self.room_id)
-        chat_text = "\n".join([f"{m.get('name', m['sender_id'])}: {m['message']}" for m in recent_messages])
-        student_name = get_student_name(student_id) if student_id else "학생"
+        topic_id = await get_room_topic_id(self.room_id)
+        student_name = await get_student_name(student_id) if student_id else "학생"
         
-        direct_question_instruction = f"""
-{student_name}(ID: {student_id})가 당신에게 직접 질문했습니다.
+        def instruction(asker):
+            return f"""
+{asker}이(가) 당신에게 직접 질문했습니다.
 이 채팅방은 '{system_prompt}'라는 주제/목적을 가진 공간입니다.
 
 응답 가이드라인:
@@ -279,55 +577,171 @@ GPT는 교사의 보조교사로서, 다음 기준에 따라 개입 상황을 
 - ** 기호를 사용하지 마세요.
 """
 
-        prompt_messages = [
-            {"role": "system", "content": direct_question_instruction},
-            {"role": "user", "content": f"최근 대화:\n{chat_text}\n\n{student_name}의 질문: {student_question}"}
-        ]
-
-        try:
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=prompt_messages,
+        async def generate(on_delta, shared):
+            if shared:
+                prompt_messages = [
+                    {"role": "system", "content": instruction("학생")},
+                    {"role": "user", "content": f"학생의 질문: {student_question}"}
+                ]
+            else:
+                chat_text = await room_summaries.build(self.room_id, recent_messages, DIRECT_CONTEXT_TOKENS)
+                prompt_messages = [
+                    {"role": "system", "content": instruction(f"{student_name}(ID: {student_id})")},
+                    {"role": "user", "content": f"최근 대화:\n{chat_text}\n\n{student_name}의 질문: {student_question}"}
+                ]
+            return await complete_chat(
+                CHAT_MODEL,
+                prompt_messages,
+                on_delta=on_delta,
+                purpose="direct",
                 temperature=0.5,  # 더 일관된 응답을 위해 온도 낮춤
                 max_tokens=600   # 응답 길이 제한
             )
-            return response.choices[0].message.content.strip()
+
+        try:
+            return await answer_cache.answer(topic_id, student_question, generate, on_delta=on_delta)
         except Exception as e:
-            print("❌ 직접 질문 응답 생성 오류:", e)
+            logger.error("❌ 직접 질문 응답 생성 오류: %s", e)
             return "죄송합니다, 질문에 대한 답변을 생성하는 데 문제가 발생했습니다. 다시 질문해 주세요."
 
 # ─────────── 평가 전용 함수 (GPT 평가 생성) ───────────
-async def evaluate_conversation(rubric_prompt: str, messages: list[dict]) -> str:
+EVALUATION_MODEL = os.getenv("EVALUATION_MODEL", "gpt-4o-mini")
+EVALUATION_ERROR_TEXT = "GPT 평가 생성 중 오류가 발생했습니다."
+
+def _evaluation_system_prompt(rubric_prompt, target_student=None):
+    target = f"\n평가 대상 학생: {target_student} (이 학생의 발화만 평가하세요)\n" if target_student else ""
+    return f"""
+당신은 교사가 작성한 루브릭을 기반으로 학생들의 대화를 평가하는 AI 평가 보조자입니다.
+
+📋 루브릭:
+{rubric_prompt}
+{target}
+아래 대화를 분석해 교사에게 제공할 평가 피드백을 작성하세요.
+""".strip()
+
+def _evaluation_messages(messages, target_student=None):
+    """평가 대상 학생이 있으면 그 학생의 발화만 모음"""
+    if target_student:
+        return [m for m in messages if m.get("sender_id") == target_student]
+    return messages
+
+async def evaluate_conversation(rubric_prompt: str, messages: list[dict], target_student: str = None,
+                                mode: str = None) -> str:
     """
     ✅ GPT에게 루브릭과 채팅 대화를 전달하여 평가 결과를 생성하는 함수
     - rubric_prompt: 교사가 작성한 평가 기준
     - messages: [{sender_id, message}, ...]
+    - target_student: 있으면 그 학생의 발화만 평가
+    - mode: auto(기본, EVAL_MODE) - 예산 안이면 한 번에, 넘으면 map-reduce
+            single - 항상 한 번의 호출 (긴 대화는 앞부분을 차례로 요약해 압축)
+            mapreduce - 항상 구간별 평가 후 종합
     - return: 평가 요약 텍스트
     """
     try:
-        system_prompt = f"""
-당신은 교사가 작성한 루브릭을 기반으로 학생들의 대화를 평가하는 AI 평가 보조자입니다.
-
-📋 루브릭:
-{rubric_prompt}
+        messages = _evaluation_messages(messages, target_student)
+        mode = mode or EVAL_MODE
+        if mode == "mapreduce" or (
+            mode == "auto"
+            and sum(count_tokens(format_turn(m), EVALUATION_MODEL) for m in messages) > EVAL_CONTEXT_TOKENS
+        ):
+            return await evaluate_conversation_mapreduce(rubric_prompt, messages, target_student)
 
-아래 대화를 분석해 교사에게 제공할 평가 피드백을 작성하세요.
-"""
-        chat_log = "\n".join([f"{m['sender_id']}: {m['message']}" for m in messages])
+        # 긴 대화는 최근 발화를 그대로 두고 앞부분을 요약으로 압축해 예산 안에 맞춤
+        chat_log = await build_transcript(messages, EVAL_CONTEXT_TOKENS, summarize_turns, EVALUATION_MODEL)
 
         prompt_messages = [
-            {"role": "system", "content": system_prompt.strip()},
+            {"role": "system", "content": _evaluation_system_prompt(rubric_prompt, target_student)},
             {"role": "user", "content": f"대화:\n{chat_log}"}
         ]
 
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=prompt_messages,
-            temperature=0.7,
-        )
-
-        return response.choices[0].message.content.strip()
+        return await complete_chat(EVALUATION_MODEL, prompt_messages, purpose="evaluate", temperature=0.7)
 
     except Exception as e:
-        print("❌ GPT 평가 생성 오류:", e)
-        return "GPT 평가 생성 중 오류가 발생했습니다."
\ No newline at end of file
+        logger.error("❌ GPT 평가 생성 오류: %s", e)
+        return EVALUATION_ERROR_TEXT
+
+# ─────────── 긴 대화 map-reduce 평가 ───────────
+EVAL_PARTIAL_MAX_TOKENS = 400  # 구간별 부분 평가 길이
+
+async def _evaluate_window(rubric_prompt, target_student, window, index, total):
+    """map: 한 구간만 보고 루브릭 항목별 근거와 잠정 판단을 정리"""
+    prompt_messages = [
+        {"role": "system", "content": (
+            _evaluation_system_prompt(rubric_prompt, target_student) + "\n\n"
+            f"지금 보는 것은 전체 대화 중 {index}/{total}번째 구간입니다. 최종 평가는 다른 구간과 합쳐서 작성되므로,\n"
+            "루브릭 항목별로 이 구간에서 확인된 근거(누가 어떤 발언을 했는지)와 잠정 판단만 간결하게 정리하세요.\n"
+            "근거가 없는 항목은 '근거 없음'으로 적으세요."
+        )},
+        {"role": "user", "content": "대화 구간:\n" + "\n".join(window)}
+    ]
+    return await complete_chat(EVALUATION_MODEL, prompt_messages, purpose="evaluate_map",
+                               temperature=0.2, max_tokens=EVAL_PARTIAL_MAX_TOKENS)
+
+async def _combine_partials(rubric_prompt, target_student, partials, final):
+    """reduce: 구간별 부분 평가를 시간 순서대로 합침 (final이면 교사용 최종 피드백)"""
+    joined = "\n\n".join(f"[구간 {label}]\n{text}" for label, text in partials)
+    if final:
+        instruction = ("아래는 긴 대화를 구간별로 나눠 정리한 부분 평가입니다(시간 순서).\n"
+                       "구간 사이의 변화와 대화 전체의 흐름을 고려해 하나의 평가 피드백으로 종합하세요.")
+        kwargs = {"temperature": 0.7}
+    else:
+        instruction = ("아래 부분 평가들을 루브릭 항목별 근거와 잠정 판단으로 하나로 합치세요. "
+                       "중요한 근거는 빠뜨리지 말고 간결하게 정리하세요.")
+        kwargs = {"temperature": 0.2, "max_tokens": EVAL_PARTIAL_MAX_TOKENS}
+    prompt_messages = [
+        {"role": "system", "content": _evaluation_system_prompt(rubric_prompt, target_student) + "\n\n" + instruction},
+        {"role": "user", "content": joined}
+    ]
+    purpose = "evaluate_reduce" if final else "evaluate_map"
+    return await complete_chat(EVALUATION_MODEL, prompt_messages, purpose=purpose, **kwargs)
+
+async def evaluate_conversation_mapreduce(rubric_prompt, messages, target_student=None,
+                                          window_tokens=EVAL_WINDOW_TOKENS, concurrency=EVAL_MAP_CONCURRENCY):
+    """
+    긴 대화를 window_tokens 크기 구간으로 나눠 동시에 평가(map)한 뒤 한 번의 호출로 종합(reduce)
+    - 동시에 진행하는 호출 수는 concurrency로 제한
+    - 부분 평가가 합쳐서 EVAL_CONTEXT_TOKENS를 넘으면 묶음별로 먼저 합친 뒤 최종 종합
+    - 일부 구간이 실패해도 나머지로 종합하고, 모두 실패하면 예외
+    """
+    windows = split_windows([format_turn(m) for m in messages], window_tokens, EVALUATION_MODEL)
+    if not windows:
+        windows = [[]]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def limited(call, *args):
+        async with semaphore:
+            return await call(*args)
+
+    results = await asyncio.gather(*(
+        limited(_evaluate_window, rubric_prompt, target_student, window, index, len(windows))
+        for index, window in enumerate(windows, start=1)
+    ), return_exceptions=True)
+    partials = [(str(index), text) for index, text in enumerate(results, start=1)
+                if not isinstance(text, BaseException)]
+    failed = len(results) - len(partials)
+    if not partials:
+        raise results[0]
+    if failed:
+        logger.warning("⚠️ 구간 평가 %s/%s개 실패, 나머지로 종합합니다.", failed, len(results))
+
+    # 부분 평가가 최종 종합 예산을 넘으면 묶음별로 먼저 합침
+    while len(partials) > 1 and sum(count_tokens(text, EVALUATION_MODEL) for _, text in partials) > EVAL_CONTEXT_TOKENS:
+        groups, group, used = [], [], 0
+        for label, text in partials:
+            cost = count_tokens(text, EVALUATION_MODEL)
+            if group and used + cost > EVAL_CONTEXT_TOKENS // 2:
+                groups.append(group)
+                group, used = [], 0
+            group.append((label, text))
+            used += cost
+        groups.append(group)
+        if len(groups) == len(partials):  # 더 묶을 수 없으면 그대로 종합
+            break
+        merged = await asyncio.gather(*(
+            limited(_combine_partials, rubric_prompt, target_student, group, False) for group in groups
+        ))
+        partials = [(f"{group[0][0].split('-')[0]}-{group[-1][0].split('-')[-1]}", text)
+                    for group, text in zip(groups, merged)]
+
+    logger.info("🧩 map-reduce 평가: 구간 %s개 → 종합", len(windows))
+    return await _combine_partials(rubric_prompt, target_student, partials, True)
@@ -0,0 +1,140 @@
+import os
+import random
+from collections import deque
+from llm_gateway import CallStats
+from metrics import registry
+
+# 자동 개입 방식
+# - two_step: 판단(JUDGE_MODEL) → 개입할 때만 피드백 생성(CHAT_MODEL) (기존 방식)
+# - single  : 판단 + 피드백을 한 번의 structured output 호출로 생성 (INTERVENTION_MODEL)
+INTERVENTION_SINGLE_CALL_RATE = float(os.getenv("INTERVENTION_SINGLE_CALL_RATE", "0"))  # single로 처리할 비율 (0: 기존만, 1: single만, 사이: A/B)
+INTERVENTION_AGREEMENT_RATE = float(os.getenv("INTERVENTION_AGREEMENT_RATE", "0.2"))  # single 중 기존 판단도 돌려 결정을 비교할 비율
+
+MODES = ("two_step", "single")
+
+INTERVENTION_SECONDS = registry.histogram("chat_intervention_seconds",
+                                          "자동 개입 한 번(판단 + 피드백 완료)에 걸린 시간", ("mode",))
+
+
+# ✅ 자동 개입 방식 A/B 비교
+class InterventionABStats:
+    """
+    자동 개입을 방식(mode)별로 나눠 실행하고 지연 시간 / 토큰 사용량 / 결정 일치율을 모음
+    - choose(): 판단마다 single_call_rate 비율로 single, 나머지는 two_step
+    - record(): 한 번의 자동 개입 결과 (걸린 시간, llm_gateway.metered()로 잰 토큰, 최종 개입 유형)
+    - record_agreement(): 같은 대화 창에 대한 single 결정과 two_step 판단 비교 (agreement_rate 비율로 표본)
+    """
+
+    def __init__(self, single_call_rate=INTERVENTION_SINGLE_CALL_RATE, agreement_rate=INTERVENTION_AGREEMENT_RATE,
+                 window=500):
+        self.single_call_rate = single_call_rate
+        self.agreement_rate = agreement_rate
+        self.window = window
+        self.modes = {}
+        self.agreement = {"compared": 0, "same_decision": 0, "same_type": 0, "same_target": 0}
+        self.confusion = {}  # "single 유형 / two_step 유형" → 횟수
+
+    def choose(self):
+        return "single" if random.random() < self.single_call_rate else "two_step"
+
+    def should_compare(self):
+        return random.random() < self.agreement_rate
+
+    def _mode(self, mode):
+        stats = self.modes.get(mode)
+        if stats is None:
+            stats = self.modes[mode] = {
+                "windows": 0,
+                "interventions": 0,
+                "fallbacks": 0,
+                "llm_calls": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "tokens_by_model": {},
+                "latencies": deque(maxlen=self.window),
+            }
+        return stats
+
+    def record(self, mode, seconds, meter, intervention_type, fallback=False):
+        stats = self._mode(mode)
+        stats["windows"] += 1
+        if intervention_type not in (None, "none"):
+            stats["interventions"] += 1
+        if fallback:
+            stats["fallbacks"] += 1
+        stats["llm_calls"] += meter.calls
+        stats["prompt_tokens"] += meter.prompt_tokens
+        stats["completion_tokens"] += meter.completion_tokens
+        for model, usage in meter.by_model.items():
+            total = stats["tokens_by_model"].setdefault(model, {"prompt_tokens": 0, "completion_tokens": 0})
+            total["prompt_tokens"] += usage["prompt_tokens"]
+            total["completion_tokens"] += usage["completion_tokens"]
+        stats["latencies"].append(seconds)
+        INTERVENTION_SECONDS.observe(seconds, mode=mode)
+
+    def record_agreement(self, single, two_step):
+        """single, two_step: 같은 대화 창에 대한 판단 dict (should_respond 형식)"""
+        single_type = single.get("intervention_type", "none")
+        two_step_type = two_step.get("intervention_type", "none")
+        self.agreement["compared"] += 1
+        if bool(single.get("should_respond")) == bool(two_step.get("should_respond")):
+            self.agreement["same_decision"] += 1
+        if single_type == two_step_type:
+            self.agreement["same_type"] += 1
+            if single.get("target") == two_step.get("target"):
+                self.agreement["same_target"] += 1
+        key = f"{single_type} / {two_step_type}"
+        self.confusion[key] = self.confusion.get(key, 0) + 1
+
+    def snapshot(self):
+        modes = {}
+        for mode, stats in self.modes.items():
+            windows = stats["windows"] or 1
+            modes[mode] = {
+                "windows": stats["windows"],
+                "interventions": stats["interventions"],
+                "fallbacks": stats["fallbacks"],
+                "p50_ms": round(CallStats._percentile(stats["latencies"], 0.5) * 1000, 1),
+                "p95_ms": round(CallStats._percentile(stats["latencies"], 0.95) * 1000, 1),
+                "llm_calls_per_window": round(stats["llm_calls"] / windows, 2),
+                "prompt_tokens_per_window": round(stats["prompt_tokens"] / windows, 1),
+                "completion_tokens_per_window": round(stats["completion_tokens"] / windows, 1),
+                "tokens_by_model": stats["tokens_by_model"],
+            }
+        compared = self.agreement["compared"]
+        return {
+            "single_call_rate": self.single_call_rate,
+            "agreement_rate": self.agreement_rate,
+            "modes": modes,
+            "agreement": {
+                **self.agreement,
+                "decision_agreement": round(self.agreement["same_decision"] / compared, 3) if compared else None,
+                "type_agreement": round(self.agreement["same_type"] / compared, 3) if compared else None,
+                "confusion": self.confusion,
+            },
+        }
+
+    def collect(self):
+        """/metrics 수집 함수"""
+        samples = []
+        for mode, stats in self.modes.items():
+            labels = {"mode": mode}
+            samples += [
+                ("chat_intervention_windows_total", "counter", "방식별 자동 개입 판단 수", labels, stats["windows"]),
+                ("chat_intervention_responded_total", "counter", "방식별 실제로 개입한 수", labels,
+                 stats["interventions"]),
+                ("chat_intervention_fallbacks_total", "counter", "single 실패로 기존 방식으로 다시 처리한 수", labels,
+                 stats["fallbacks"]),
+            ]
+            for kind in ("prompt_tokens", "completion_tokens"):
+                samples.append(("chat_intervention_tokens_total", "counter", "방식별 자동 개입 토큰 수",
+                                {**labels, "kind": kind}, stats[kind]))
+        for key in ("compared", "same_decision", "same_type", "same_target"):
+            samples.append(("chat_intervention_agreement_total", "counter",
+                            "single 결정과 two_step 판단 비교 (compared: 비교 수, same_*: 일치 수)",
+                            {"result": key}, self.agreement[key]))
+        return samples
+
+
+intervention_ab = InterventionABStats()
+registry.add_collector(intervention_ab.collect)
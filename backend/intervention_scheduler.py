@@ -0,0 +1,196 @@
+import os
+import asyncio
+import time
+from state_store import InMemoryStateStore
+from log_utils import get_logger
+from metrics import root_span
+from timer_wheel import TimerWheel
+from trigger_policy import RoomActivity, parse_policy
+
+logger = get_logger("intervention")
+
+INTERVENTION_WINDOW = int(os.getenv("INTERVENTION_WINDOW", "6"))  # 판단을 시작할 메시지 수
+INTERVENTION_TIMEOUT = float(os.getenv("INTERVENTION_TIMEOUT", "60"))  # 판단+응답 전체 제한 시간(초)
+# 판단 시작 조건 (trigger_policy 참고), 없으면 "count:{window}" (메시지 수만 보는 기존 방식)
+# 예: "cooldown:30 & (count:6 | silence:45 | window:180)"
+INTERVENTION_TRIGGER = os.getenv("INTERVENTION_TRIGGER", "")
+INTERVENTION_TIMER_TICK = float(os.getenv("INTERVENTION_TIMER_TICK", "0.5"))  # 시간 조건 확인 간격(초)
+
+
+# ✅ 방별 자동 개입 백그라운드 스케줄러
+class InterventionScheduler:
+    """
+    send_message 핸들러 밖에서 자동 개입(판단 → 피드백 생성 → 저장/전송)을 실행하는 스케줄러
+    - 방마다 동시에 하나의 판단만 실행 (여러 워커에서도 방 잠금으로 1개만 in-flight)
+    - 판단 중에 들어온 메시지는 버퍼에 쌓였다가 다음 윈도우로 합쳐짐
+    - 방이 비거나 서버가 종료되면 진행 중인 판단을 취소
+    - 버퍼는 state_store에 있으므로 REDIS_URL 설정 시 모든 워커가 공유
+    - 판단 시작 조건은 policy(메시지 수, 시간 창, 침묵, 쿨다운 조합)로 정하고, 시간 조건은
+      방마다 태스크를 두지 않고 공유 타이머 휠 하나로 다시 확인
+      (시각 정보는 워커별로 관리: 여러 워커면 이 워커가 받은 메시지 기준)
+    - handler(room_id, buffer)는 register_socket_events에서 연결합니다.
+    """
+
+    def __init__(self, store=None, handler=None, window=INTERVENTION_WINDOW, timeout=INTERVENTION_TIMEOUT,
+                 policy=None, wheel=None):
+        self.store = store or InMemoryStateStore()
+        self.handler = handler
+        self.window = window
+        self.timeout = timeout
+        self.policy = policy or parse_policy(INTERVENTION_TRIGGER or f"count:{window}")
+        self.wheel = wheel if wheel is not None else TimerWheel(tick=INTERVENTION_TIMER_TICK)
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._rooms: dict[str, RoomActivity] = {}
+        self._checks = set()  # 타이머가 시작한 조건 확인 태스크
+        self._closing = False
+
+        # 지표
+        self.started = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.coalesced = 0
+        self.last_duration = 0.0
+        self.triggers = {}  # 판단을 시작한 이유별 횟수
+
+    def _room(self, room_id):
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = RoomActivity()
+        return room
+
+    async def add_message(self, room_id, message):
+        """메시지를 버퍼에 쌓고, 판단 조건을 만족하면 백그라운드 판단을 시작 (바로 반환)"""
+        length = await self.store.append_message(room_id, message)
+        self._room(room_id).add_message(self.wheel.now(), length)
+        if room_id in self._tasks:
+            self.coalesced += 1
+            return
+        await self._maybe_start(room_id, length)
+
+    async def _maybe_start(self, room_id, length=None):
+        if self._closing or self.handler is None or room_id in self._tasks:
+            return
+        if length is None:
+            length = await self.store.buffer_length(room_id)
+        room = self._room(room_id)
+        room.buffered = length
+        if not length:
+            room.first_at = None
+            self.wheel.cancel(room_id)
+            return
+        reason, next_check = self.policy.evaluate(room, self.wheel.now())
+        if reason is None:
+            # 시간이 지나면 만족할 수 있는 조건이면 그때 다시 확인
+            if next_check is None:
+                self.wheel.cancel(room_id)
+            else:
+                self.wheel.schedule(room_id, next_check, self._on_timer)
+            return
+        self.wheel.cancel(room_id)
+
+        # 다른 워커가 이미 이 방을 판단 중이면 그쪽이 끝난 뒤 이어서 처리함
+        token = await self.store.acquire_room_lock(room_id, self.timeout + 5)
+        if not token:
+            self.coalesced += 1
+            return
+        if room_id in self._tasks:
+            await self.store.release_room_lock(room_id, token)
+            return
+
+        # 버퍼를 통째로 넘기고 비움 (판단 중 도착한 메시지는 다음 윈도우로)
+        buffer = await self.store.take_messages(room_id)
+        if not buffer:
+            await self.store.release_room_lock(room_id, token)
+            return
+        room.triggered(self.wheel.now())
+        self.triggers[reason] = self.triggers.get(reason, 0) + 1
+        self._tasks[room_id] = asyncio.create_task(self._run(room_id, buffer, token))
+
+    def _on_timer(self, room_id):
+        """타이머 휠 콜백 - 시간 조건을 다시 확인"""
+        if self._closing:
+            return
+        task = asyncio.get_running_loop().create_task(self._check(room_id))
+        self._checks.add(task)
+        task.add_done_callback(self._checks.discard)
+
+    async def _check(self, room_id):
+        try:
+            await self._maybe_start(room_id)
+        except Exception as e:
+            logger.error("❌ 자동 개입 조건 확인 실패 (%s): %s", room_id, e)
+
+    async def _run(self, room_id, buffer, token):
+        self.started += 1
+        started = time.perf_counter()
+        cancelled = False
+        try:
+            with root_span("intervention", "auto"):
+                await asyncio.wait_for(self.handler(room_id, buffer), self.timeout)
+            self.completed += 1
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning("⏱️ GPT 자동 개입 시간 초과 (%ss): %s", self.timeout, room_id)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            cancelled = True
+            raise
+        except Exception as e:
+            self.failures += 1
+            logger.error("❌ GPT 자동 개입 처리 오류 (%s): %s", room_id, e)
+        finally:
+            self.last_duration = time.perf_counter() - started
+            if self._tasks.get(room_id) is asyncio.current_task():
+                self._tasks.pop(room_id, None)
+            if cancelled:
+                asyncio.ensure_future(self._release(room_id, token))
+            else:
+                await self._release(room_id, token)
+                # 판단 중 쌓인 메시지로 다음 윈도우 시작
+                try:
+                    await self._maybe_start(room_id)
+                except Exception as e:
+                    logger.error("❌ 다음 자동 개입 예약 실패 (%s): %s", room_id, e)
+
+    async def _release(self, room_id, token):
+        try:
+            await self.store.release_room_lock(room_id, token)
+        except Exception as e:
+            # 해제하지 못한 잠금은 TTL이 지나면 자동으로 풀림
+            logger.error("❌ 방 잠금 해제 실패 (%s): %s", room_id, e)
+
+    async def cancel_room(self, room_id):
+        """방이 비었을 때 진행 중인 판단을 취소하고 버퍼를 비움"""
+        await self.store.clear_messages(room_id)
+        self._rooms.pop(room_id, None)
+        self.wheel.cancel(room_id)
+        task = self._tasks.pop(room_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    async def shutdown(self):
+        self._closing = True
+        await self.wheel.stop()
+        tasks = list(self._tasks.values()) + list(self._checks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def stats(self):
+        return {
+            **await self.store.buffer_stats(),
+            "in_flight": len(self._tasks),
+            "started": self.started,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+            "coalesced_messages": self.coalesced,
+            "last_duration_ms": round(self.last_duration * 1000, 2),
+            "policy": str(self.policy),
+            "triggers": self.triggers,
+            "timers": len(self.wheel),
+        }
@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import random
+import asyncio
+import hashlib
+from dataclasses import dataclass
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from context_builder import count_tokens
+from log_utils import get_logger
+
+load_dotenv()
+logger = get_logger("llm")
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")  # openai / fake
+
+# OpenAI HTTP 커넥션 풀
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # 초
+
+# 가짜 백엔드 (부하 테스트용)
+LLM_FAKE_LATENCY = os.getenv("LLM_FAKE_LATENCY", "lognormal:0.6,0.4")  # 첫 토큰까지 걸리는 시간 분포
+LLM_FAKE_TOKENS_PER_SEC = float(os.getenv("LLM_FAKE_TOKENS_PER_SEC", "60"))  # 출력 속도
+LLM_FAKE_OUTPUT_TOKENS = int(os.getenv("LLM_FAKE_OUTPUT_TOKENS", "150"))  # 응답 길이 (max_tokens가 더 작으면 그 값)
+LLM_FAKE_CHUNK_TOKENS = int(os.getenv("LLM_FAKE_CHUNK_TOKENS", "4"))  # 스트리밍 조각 하나의 토큰 수
+LLM_FAKE_JUDGMENTS = os.getenv("LLM_FAKE_JUDGMENTS", "none:0.6,positive:0.2,guidance:0.15,individual:0.05")
+LLM_FAKE_SEED = os.getenv("LLM_FAKE_SEED", "0")
+
+
+@dataclass
+class Usage:
+    """OpenAI 응답의 usage와 같은 필드 (가짜 백엔드용)"""
+    prompt_tokens: int
+    completion_tokens: int
+
+
+# ✅ OpenAI 백엔드
+class OpenAIBackend:
+    """
+    OpenAI Chat Completions 백엔드
+    - 앱 전체가 하나의 AsyncOpenAI 클라이언트(크기를 정한 HTTP 커넥션 풀)를 공유
+    - 재시도는 게이트웨이가 직접 처리하므로 SDK 재시도는 끔
+    """
+
+    name = "openai"
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,
+                timeout=LLM_TIMEOUT,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                        max_keepalive_connections=LLM_MAX_KEEPALIVE),
+                ),
+            )
+        return self._client
+
+    async def complete(self, model, messages, on_delta=None, purpose=None, **kwargs):
+        """반환값: (텍스트, usage) - on_delta가 있으면 스트리밍으로 받아 조각마다 호출"""
+        if on_delta is None:
+            response = await self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+            return response.choices[0].message.content.strip(), response.usage
+
+        stream = await self.client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        parts = []
+        usage = None
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                await on_delta(delta)
+        return "".join(parts).strip(), usage
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class LatencyDistribution:
+    """
+    지연 시간 분포 (초)
+    - "0.5" 또는 "const:0.5"
+    - "uniform:최소,최대"
+    - "normal:평균,표준편차" (0 미만은 0)
+    - "lognormal:중앙값,sigma" (긴 꼬리)
+    """
+
+    def __init__(self, spec):
+        kind, _, params = spec.partition(":")
+        if not params:
+            kind, params = "const", kind
+        self.kind = kind.strip()
+        self.params = [float(p) for p in params.split(",")]
+        if self.kind not in ("const", "uniform", "normal", "lognormal"):
+            raise ValueError(f"알 수 없는 지연 시간 분포: {spec}")
+
+    def sample(self, rng):
+        if self.kind == "const":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params[:2])
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(*self.params[:2]))
+        median, sigma = self.params[:2]
+        return median * rng.lognormvariate(0, sigma)
+
+
+FAKE_WORDS = [
+    "좋아요", "여러분의", "의견을", "잘", "들었어요.", "근거를", "하나씩", "정리해", "볼까요?",
+    "다른", "친구의", "생각과", "비교해", "보면", "더", "분명해질", "거예요.", "주제로", "돌아와서",
+    "질문에", "답해", "봅시다.",
+]
+
+
+# ✅ 가짜 백엔드 (네트워크 없이 부하 테스트)
+class FakeBackend:
+    """
+    OpenAI 없이 프로세스 안에서 응답을 만드는 백엔드 (LLM_BACKEND=fake)
+    - 첫 토큰까지의 지연은 latency 분포에서 뽑고, 이후 tokens_per_sec 속도로 출력 (스트리밍은 조각 단위)
+    - judge 호출에는 judgments 비율대로 고른 개입 판단 JSON을 돌려줌
+      (individual이면 프롬프트의 참여자 목록에서 대상 학생을 고름)
+      판단은 대화 내용으로만 정해지고, judge_respond 호출에는 같은 판단 + feedback JSON을 돌려줌
+    - 같은 입력이면 같은 응답/지연 (seed + 모델 + 호출 종류 + 메시지 해시로 난수 고정)
+    """
+
+    name = "fake"
+
+    def __init__(self, latency=LLM_FAKE_LATENCY, tokens_per_sec=LLM_FAKE_TOKENS_PER_SEC,
+                 output_tokens=LLM_FAKE_OUTPUT_TOKENS, chunk_tokens=LLM_FAKE_CHUNK_TOKENS,
+                 judgments=LLM_FAKE_JUDGMENTS, seed=LLM_FAKE_SEED):
+        self.latency = LatencyDistribution(latency) if isinstance(latency, str) else latency
+        self.tokens_per_sec = tokens_per_sec
+        self.output_tokens = output_tokens
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.judgments = _parse_weights(judgments)
+        self.seed = seed
+        self.calls = 0
+
+    def _rng(self, model, purpose, messages):
+        payload = json.dumps([self.seed, model, purpose, messages], ensure_ascii=False, sort_keys=True)
+        return random.Random(hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+    def _judgment(self, messages):
+        # 판단은 대화 내용으로만 정함 (판단 방식/모델이 달라도 같은 대화면 같은 결정)
+        rng = self._rng(None, "judge", messages[-1:])
+        kinds, weights = zip(*self.judgments)
+        kind = rng.choices(kinds, weights)[0]
+        target = None
+        if kind == "individual":
+            found = re.search(r"참여 중인 학생 ID 목록:\s*(.*)", messages[0].get("content") or "")
+            candidates = [s.strip() for s in found.group(1).split(",") if s.strip()] if found else []
+            if candidates:
+                target = rng.choice(sorted(candidates))
+            else:
+                kind = "guidance"
+        return {"intervention_type": kind, "target_student": target, "reasoning": f"가짜 백엔드 판단 ({kind})"}
+
+    async def complete(self, model, messages, on_delta=None, purpose=None, **kwargs):
+        self.calls += 1
+        rng = self._rng(model, purpose, messages)
+        if purpose in ("judge", "judge_shadow"):
+            pieces = [json.dumps(self._judgment(messages), ensure_ascii=False)]
+        elif purpose == "judge_respond":
+            # 판단 + 피드백 JSON을 토큰 크기(4자) 조각으로 스트리밍
+            judgment = self._judgment(messages)
+            words = [] if judgment["intervention_type"] == "none" else [
+                rng.choice(FAKE_WORDS) for _ in range(self.output_tokens)]
+            payload = json.dumps({**judgment, "feedback": " ".join(words)}, ensure_ascii=False)
+            pieces = [payload[i:i + 4] for i in range(0, len(payload), 4)]
+        else:
+            limit = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or self.output_tokens
+            pieces = [rng.choice(FAKE_WORDS) + " " for _ in range(min(limit, self.output_tokens))]
+        prompt_tokens = sum(count_tokens(m.get("content") or "", model) for m in messages)
+        usage = Usage(prompt_tokens=prompt_tokens, completion_tokens=len(pieces))
+
+        await asyncio.sleep(self.latency.sample(rng))
+        if on_delta is None:
+            await asyncio.sleep(len(pieces) / self.tokens_per_sec)
+        else:
+            for start in range(0, len(pieces), self.chunk_tokens):
+                chunk = pieces[start:start + self.chunk_tokens]
+                await on_delta("".join(chunk))
+                await asyncio.sleep(len(chunk) / self.tokens_per_sec)
+        return "".join(pieces).strip(), usage
+
+    async def close(self):
+        pass
+
+
+def _parse_weights(spec):
+    """"none:0.6,positive:0.2" → [("none", 0.6), ("positive", 0.2)]"""
+    weights = []
+    for part in spec.split(","):
+        kind, _, weight = part.partition(":")
+        if kind.strip():
+            weights.append((kind.strip(), float(weight or 1)))
+    return weights
+
+
+def create_backend(name=LLM_BACKEND):
+    """LLM_BACKEND=fake면 가짜 백엔드, 아니면 OpenAI"""
+    if name == "fake":
+        logger.info("🧪 LLM 백엔드: fake (지연 %s, %g tokens/s)", LLM_FAKE_LATENCY, LLM_FAKE_TOKENS_PER_SEC)
+        return FakeBackend()
+    return OpenAIBackend()
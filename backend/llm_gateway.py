@@ -0,0 +1,366 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+from openai import APIConnectionError, APIStatusError, RateLimitError
+from context_builder import count_tokens
+from llm_backends import create_backend
+from log_utils import HOT, get_logger
+from metrics import registry, span
+
+logger = get_logger("llm")
+
+# 전체 OpenAI 호출 한도 (0이면 제한 없음)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "64"))  # 동시에 진행할 호출 수
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))  # 분당 요청 수
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))  # 분당 토큰 수 (입력 + 최대 출력 추정)
+LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", "10"))  # 몇 초 분량까지 한 번에 보낼 수 있는지
+
+# 재시도 (429, 5xx, 연결 오류)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "20"))
+
+LLM_OUTPUT_ESTIMATE = 500  # max_tokens가 없는 호출의 출력 토큰 추정치
+
+# 우선순위 (작을수록 먼저)
+PRIORITY_INTERACTIVE = 0  # 학생이 직접 한 질문
+PRIORITY_FEEDBACK = 1  # 개입하기로 한 뒤의 피드백 생성
+PRIORITY_JUDGE = 2  # 자동 개입 판단
+PRIORITY_BATCH = 3  # 평가, 대화 요약
+
+PURPOSE_PRIORITY = {
+    "direct": PRIORITY_INTERACTIVE,
+    "feedback": PRIORITY_FEEDBACK,
+    "feedback_speculative": PRIORITY_JUDGE,
+    "judge": PRIORITY_JUDGE,
+    "judge_respond": PRIORITY_JUDGE,
+    "judge_shadow": PRIORITY_BATCH,
+    "summary": PRIORITY_BATCH,
+    "evaluate": PRIORITY_BATCH,
+    "evaluate_map": PRIORITY_BATCH,
+    "evaluate_reduce": PRIORITY_BATCH,
+}
+
+# 호출 종류(purpose)별 누적 토큰 사용량
+token_usage = {}
+
+QUEUE_WAIT_SECONDS = registry.histogram("chat_llm_queue_wait_seconds", "LLM 호출이 한도 때문에 기다린 시간", ("purpose",))
+RETRIES = registry.counter("chat_llm_retries_total", "LLM 호출 재시도 수", ("purpose",))
+
+
+_current_meter = contextvars.ContextVar("usage_meter", default=None)
+
+
+class UsageMeter:
+    """metered() 블록 안에서 나간 호출의 토큰 사용량 (모델별, 바깥 metered() 블록에도 더함)"""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.by_model = {}
+
+    def add(self, model, usage):
+        prompt, completion = usage.prompt_tokens or 0, usage.completion_tokens or 0
+        self.calls += 1
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        stats = self.by_model.setdefault(model, {"prompt_tokens": 0, "completion_tokens": 0})
+        stats["prompt_tokens"] += prompt
+        stats["completion_tokens"] += completion
+        if self.parent is not None:
+            self.parent.add(model, usage)
+
+
+@contextmanager
+def metered():
+    """
+    블록 안(같은 컨텍스트에서 만든 태스크 포함)의 LLM 호출 토큰을 모으는 UsageMeter
+    - 예: 자동 개입 한 번(판단 + 피드백)에 쓴 토큰을 방식별로 비교할 때
+    """
+    meter = UsageMeter(_current_meter.get())
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+
+def record_usage(purpose, model, usage):
+    if usage is None:
+        return
+    stats = token_usage.setdefault(purpose, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+    stats["calls"] += 1
+    stats["prompt_tokens"] += usage.prompt_tokens or 0
+    stats["completion_tokens"] += usage.completion_tokens or 0
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.add(model, usage)
+
+
+# ✅ 우선순위 + 요청/토큰 속도 제한
+class PriorityLimiter:
+    """
+    동시 호출 수, 분당 요청 수(rpm), 분당 토큰 수(tpm)를 함께 지키는 토큰 버킷
+    - 자리가 없으면 (우선순위, 도착 순서)대로 기다림: 직접 질문이 판단/평가보다 먼저 들어감
+    - 토큰은 호출 전에 추정치만큼 쓰고, 응답의 실제 사용량으로 정산(refund)
+    - 429를 받으면 pause()로 잠시 모든 호출을 멈춰 한꺼번에 재시도가 몰리지 않게 함
+    """
+
+    def __init__(self, concurrency=LLM_CONCURRENCY, rpm=LLM_RPM, tpm=LLM_TPM, burst_seconds=LLM_BURST_SECONDS):
+        self.concurrency = concurrency
+        self.request_rate = rpm / 60.0
+        self.token_rate = tpm / 60.0
+        self.request_capacity = max(1.0, self.request_rate * burst_seconds)
+        self.token_capacity = max(1.0, self.token_rate * burst_seconds)
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.in_flight = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.request_capacity, self._requests + elapsed * self.request_rate)
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_rate)
+
+    def _wait_time(self, tokens, now):
+        wait = self._paused_until - now
+        if self.request_rate and self._requests < 1:
+            wait = max(wait, (1 - self._requests) / self.request_rate)
+        if self.token_rate and self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) / self.token_rate)
+        return wait
+
+    def _dispatch(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():  # 기다리다 취소된 호출
+                heapq.heappop(self._waiters)
+                continue
+            if self.concurrency and self.in_flight >= self.concurrency:
+                return  # release()가 다시 호출
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._wait_time(tokens, now)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._requests -= 1
+            self._tokens -= tokens
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def acquire(self, priority, tokens):
+        # 버킷보다 큰 호출도 언젠가는 들어갈 수 있게 상한을 둠
+        tokens = min(tokens, self.token_capacity)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():  # 자리를 받은 직후 취소됨
+                self.release(tokens)
+            raise
+        return tokens
+
+    def release(self, refund_tokens=0):
+        """호출 종료 - refund_tokens: 추정치와 실제 사용량의 차이 (음수면 더 씀)"""
+        self.in_flight -= 1
+        if refund_tokens:
+            self._tokens = min(self.token_capacity, self._tokens + refund_tokens)
+        self._dispatch()
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def queued(self):
+        counts = {}
+        for priority, _, _, future in self._waiters:
+            if not future.done():
+                counts[priority] = counts.get(priority, 0) + 1
+        return counts
+
+
+class CallStats:
+    """호출 종류별 지연 시간/대기 시간/오류 통계 (최근 window개 기준 백분위수)"""
+
+    def __init__(self, window=500):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=window)
+        self.waits = deque(maxlen=window)
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "p50_ms": round(self._percentile(self.latencies, 0.5) * 1000, 1),
+            "p95_ms": round(self._percentile(self.latencies, 0.95) * 1000, 1),
+            "max_ms": round(max(self.latencies, default=0.0) * 1000, 1),
+            "avg_queue_wait_ms": round(sum(self.waits) / len(self.waits) * 1000, 1) if self.waits else 0.0,
+        }
+
+
+# ✅ OpenAI 호출 게이트웨이
+class LLMGateway:
+    """
+    모든 Chat Completions 호출이 지나가는 단일 창구
+    - 실제 호출은 backend(LLM_BACKEND: OpenAI 또는 가짜 백엔드)에 맡김
+    - PriorityLimiter로 동시 호출 수/rpm/tpm을 제한하고 우선순위대로 순서를 정함
+    - 429/5xx/연결 오류는 지터를 준 지수 백오프로 재시도 (Retry-After가 있으면 따름)
+    - 스트리밍 호출은 첫 조각을 보내기 전에 실패한 경우에만 재시도
+    - 호출 종류별 지연 시간, 대기 시간, 재시도, 오류 수를 기록
+    """
+
+    def __init__(self, backend=None, limiter=None, max_retries=LLM_MAX_RETRIES, retry_base=LLM_RETRY_BASE,
+                 retry_max=LLM_RETRY_MAX):
+        self._backend = backend
+        self.limiter = limiter or PriorityLimiter()
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.stats = {}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = create_backend()
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    async def close(self):
+        if self._backend is not None:
+            await self._backend.close()
+            self._backend = None
+
+    def _retry_delay(self, error, attempt):
+        """재시도할 오류면 기다릴 시간(초), 아니면 None"""
+        if isinstance(error, RateLimitError):
+            if getattr(error, "code", None) == "insufficient_quota":
+                return None
+            retry_after = _retry_after(error)
+            delay = max(retry_after, random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt)))
+            self.limiter.pause(retry_after or delay)
+            return delay
+        if isinstance(error, APIStatusError):
+            if error.status_code < 500 and error.status_code not in (408, 409):
+                return None
+        elif not isinstance(error, APIConnectionError):
+            return None
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+
+    async def chat(self, model, messages, on_delta=None, purpose="chat", priority=None, **kwargs):
+        """
+        Chat Completions 호출
+        - on_delta가 없으면 전체 응답을 기다려 텍스트를 반환
+        - on_delta(async 콜백)가 있으면 스트리밍 API로 받아 조각마다 on_delta(delta)를 호출하고,
+          마지막에 전체 텍스트를 반환
+        - purpose: 토큰/지연 시간을 기록할 호출 종류 (judge, feedback, direct, evaluate, summary ...)
+        - priority: 없으면 purpose로 정함 (PURPOSE_PRIORITY)
+        - 재시도 후에도 실패하면 마지막 예외를 그대로 올림
+        """
+        if priority is None:
+            priority = PURPOSE_PRIORITY.get(purpose, PRIORITY_BATCH)
+        estimate = sum(count_tokens(m.get("content") or "", model) for m in messages) \
+            + (kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or LLM_OUTPUT_ESTIMATE)
+        stats = self.stats.setdefault(purpose, CallStats())
+        streamed = False
+
+        async def forward(delta):
+            nonlocal streamed
+            streamed = True
+            await on_delta(delta)
+
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            charged = await self.limiter.acquire(priority, estimate)
+            started = time.perf_counter()
+            stats.waits.append(started - queued_at)
+            QUEUE_WAIT_SECONDS.observe(started - queued_at, purpose=purpose)
+            try:
+                with span("llm", purpose):
+                    text, usage = await self.backend.complete(model, messages, on_delta=forward if on_delta else None,
+                                                              purpose=purpose, **kwargs)
+            except Exception as e:
+                self.limiter.release(charged)  # 실패한 호출의 토큰은 돌려받음
+                delay = None if streamed or attempt >= self.max_retries else self._retry_delay(e, attempt)
+                if delay is None:
+                    stats.errors += 1
+                    logger.error("❌ OpenAI 호출 실패 [%s] %s: %s: %s", purpose, model, type(e).__name__, e)
+                    raise
+                attempt += 1
+                stats.retries += 1
+                RETRIES.inc(purpose=purpose)
+                logger.warning("🔁 OpenAI 재시도 [%s] %d/%d (%.1f초 후): %s", purpose, attempt, self.max_retries,
+                               delay, type(e).__name__)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # 취소(추측 취소, 판단 타임아웃, 연결 끊김)도 자리와 토큰을 돌려줌 - 안 그러면 동시 호출 자리가 샘
+                self.limiter.release(charged)
+                raise
+
+            latency = time.perf_counter() - started
+            used = (usage.prompt_tokens or 0) + (usage.completion_tokens or 0) if usage else charged
+            self.limiter.release(charged - used)
+            stats.calls += 1
+            stats.latencies.append(latency)
+            record_usage(purpose, model, usage)
+            logger.info("🔢 [%s] %s: in=%s out=%s %.2fs (대기 %.2fs)", purpose, model,
+                        usage.prompt_tokens if usage else "?", usage.completion_tokens if usage else "?",
+                        latency, started - queued_at, extra=HOT)
+            return text
+
+    def snapshot(self):
+        return {
+            "backend": self.backend.name,
+            "in_flight": self.limiter.in_flight,
+            "queued": {str(priority): count for priority, count in sorted(self.limiter.queued().items())},
+            "purposes": {purpose: stats.snapshot() for purpose, stats in self.stats.items()},
+        }
+
+
+def _retry_after(error):
+    """429 응답의 retry-after(-ms) 헤더 (초), 없으면 0"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return 0.0
+
+
+gateway = LLMGateway()
@@ -0,0 +1,45 @@
+import os
+import random
+import logging
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.05"))  # 핫패스 INFO 로그 중 남길 비율
+
+# 메시지마다 찍히는 로그에 붙이는 표시: logger.info("...", extra=HOT)
+# WARNING 이상은 표본 추출하지 않고 모두 남김
+HOT = {"hot_path": True}
+
+
+class SampleFilter(logging.Filter):
+    """hot_path 표시가 있는 WARNING 미만 로그는 rate 비율만 남김"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, "hot_path", False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+def get_logger(name):
+    """앱 로거 (chat.<name>) - 레벨/출력은 configure_logging에서 한 번에 설정"""
+    return logging.getLogger(f"chat.{name}")
+
+
+def configure_logging(level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE):
+    """
+    chat.* 로거 설정 (uvicorn 등 다른 라이브러리 로거는 건드리지 않음)
+    - LOG_LEVEL: DEBUG / INFO / WARNING / ERROR
+    - LOG_SAMPLE_RATE: HOT 표시 로그를 남길 비율 (0이면 모두 버림, 1이면 모두 남김)
+    """
+    logger = logging.getLogger("chat")
+    logger.setLevel(level)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handler.addFilter(SampleFilter(sample_rate))
+        logger.addHandler(handler)
+    return logger
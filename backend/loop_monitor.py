@@ -0,0 +1,63 @@
+import os
+import asyncio
+from collections import deque
+from metrics import registry
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))  # 측정 주기 (초)
+
+LOOP_LAG_SECONDS = registry.histogram("chat_event_loop_lag_seconds", "이벤트 루프 지연 (예정보다 늦게 깨어난 시간)",
+                                      buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+# ✅ 이벤트 루프 지연 측정
+class LoopLagMonitor:
+    """
+    interval마다 잠들었다 깨어나는 데 예정보다 얼마나 늦었는지(= 루프를 막은 시간)를 기록
+    - 동기 호출이나 무거운 계산이 루프를 막으면 지연이 커지고, 그동안 모든 소켓 이벤트가 함께 밀림
+    - 최근 window개 샘플로 백분위수를 계산
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, window=600):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.samples.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def stats(self):
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": len(self.samples),
+            "last_ms": round(self.samples[-1] * 1000, 2) if self.samples else 0.0,
+            "p50_ms": round(self._percentile(0.5) * 1000, 2),
+            "p99_ms": round(self._percentile(0.99) * 1000, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+        }
+
+
+loop_monitor = LoopLagMonitor()
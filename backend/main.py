@@ -1,42 +1,66 @@
-import os
+import json
 import uuid
-import requests
-import openai
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from socketio import AsyncServer, ASGIApp
-from socket_events import register_socket_events
-from openai import AsyncOpenAI
+from socket_events import register_socket_events, intervention_scheduler, state_store
+from state_store import create_client_manager
 from pydantic import BaseModel
 from typing import List, Optional
-from supabase import create_client
-import traceback
-from gpt_handler import evaluate_conversation
+from gpt_handler import EVALUATION_ERROR_TEXT
+from llm_gateway import gateway, token_usage
+from evaluation_cache import evaluate_cached
+from supabase_client import invalidate_student_name, invalidate_topic_prompt
+from supabase_repo import repo, SupabaseError, visible_to, all_of
+from message_queue import message_queue
+from batch_evaluation import load_topic_jobs, evaluate_topic
+from context_builder import room_summaries
+from loop_monitor import loop_monitor
+from log_utils import configure_logging, get_logger
+from metrics import registry, root_span
+from supabase_client import student_name_cache, room_prompt_cache
+from evaluation_cache import evaluation_cache
+from room_tail import room_tails
+from intervention_ab import intervention_ab
+from speculation import speculator
+from prefilter import prefilter
+from answer_cache import answer_cache
 
 # ─────────── 환경 변수 로딩
 load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_API_KEY")
-SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-client = AsyncOpenAI(api_key=openai.api_key)
-
-HEADERS = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Content-Type": "application/json"
-}
+configure_logging()
+logger = get_logger("main")
 
 # ─────────── Socket.IO 구성
-sio = AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+# REDIS_URL이 있으면 Redis 매니저로 여러 워커/노드 간 emit을 중계 (없으면 단일 프로세스)
+sio = AsyncServer(async_mode="asgi", cors_allowed_origins="*", client_manager=create_client_manager())
 register_socket_events(sio)
 
 # ─────────── FastAPI 앱 구성
-fastapi_app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Supabase 커넥션 풀은 앱 수명 동안 하나만 유지
+    await repo.start()
+    await message_queue.start()
+    loop_monitor.start()
+    try:
+        yield
+    finally:
+        # 진행 중인 자동 개입을 취소하고, 남은 메시지를 모두 저장한 뒤 커넥션 풀 종료
+        await loop_monitor.stop()
+        await intervention_scheduler.shutdown()
+        await room_summaries.shutdown()
+        await message_queue.stop()
+        await repo.close()
+        await state_store.close()
+        await gateway.close()
+
+fastapi_app = FastAPI(lifespan=lifespan)
 
 fastapi_app.add_middleware(
     CORSMiddleware,
@@ -45,56 +69,208 @@ fastapi_app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@fastapi_app.middleware("http")
+async def record_request_span(request: Request, call_next):
+    """HTTP 요청 소요 시간을 라우트 경로 템플릿(/students/{student_id}) 단위로 기록"""
+    with root_span("http", request.method) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        span.name = f"{request.method} {getattr(route, 'path', 'unmatched')}"
+    return response
+
 #test
 # ─────────── 로그인 라우터
 @fastapi_app.get("/students/{student_id}")
 async def get_student(student_id: str):
-    url = f"{SUPABASE_URL}/rest/v1/students?student_id=eq.{student_id}&select=student_id,password,class_id,name"
-    res = requests.get(url, headers=HEADERS)
-    if res.status_code == 200 and res.json():
-        return JSONResponse(content=res.json()[0], status_code=200)
+    try:
+        student = await repo.get_student(student_id)
+    except SupabaseError as e:
+        logger.error("❌ 학생 조회 오류: %s", e)
+        student = None
+    if student:
+        return JSONResponse(content=student, status_code=200)
     return JSONResponse(content={"error": "존재하지 않는 학생 ID"}, status_code=404)
 
 @fastapi_app.get("/teachers/{teacher_id}")
 async def get_teacher(teacher_id: str):
-    url = f"{SUPABASE_URL}/rest/v1/teachers?teacher_id=eq.{teacher_id}&select=teacher_id,password,class_id,name"
-    res = requests.get(url, headers=HEADERS)
-    if res.status_code == 200 and res.json():
-        return JSONResponse(content=res.json()[0], status_code=200)
+    try:
+        teacher = await repo.get_teacher(teacher_id)
+    except SupabaseError as e:
+        logger.error("❌ 교사 조회 오류: %s", e)
+        teacher = None
+    if teacher:
+        return JSONResponse(content=teacher, status_code=200)
     return JSONResponse(content={"error": "존재하지 않는 교사 ID"}, status_code=404)
 
 @fastapi_app.get("/admins/{admin_id}")
 async def get_admin(admin_id: str):
-    url = f"{SUPABASE_URL}/rest/v1/admins?admin_id=eq.{admin_id}&select=admin_id,password"
-    res = requests.get(url, headers=HEADERS)
-    if res.status_code == 200 and res.json():
-        return JSONResponse(content=res.json()[0], status_code=200)
+    try:
+        admin = await repo.get_admin(admin_id)
+    except SupabaseError as e:
+        logger.error("❌ 관리자 조회 오류: %s", e)
+        admin = None
+    if admin:
+        return JSONResponse(content=admin, status_code=200)
     return JSONResponse(content={"error": "존재하지 않는 관리자 ID"}, status_code=404)
 
 # ─────────── 데이터 조회 라우터
+def supabase_error_response(e: SupabaseError):
+    return JSONResponse(content={"error": "Supabase 요청 실패", "detail": e.detail}, status_code=e.status)
+
 @fastapi_app.get("/classes")
 async def get_classes():
-    url = f"{SUPABASE_URL}/rest/v1/classes?select=class_id,name"
-    res = requests.get(url, headers=HEADERS)
-    return res.json()
+    try:
+        return await repo.list_classes()
+    except SupabaseError as e:
+        return supabase_error_response(e)
 
 @fastapi_app.get("/topics")
 async def get_topics():
-    url = f"{SUPABASE_URL}/rest/v1/topics?select=topic_id,title,system_prompt,rubric_prompt,class_id,created_at"
-    res = requests.get(url, headers=HEADERS)
-    return res.json()
+    try:
+        return await repo.list_topics()
+    except SupabaseError as e:
+        return supabase_error_response(e)
 
 @fastapi_app.get("/rooms")
 async def get_rooms():
-    url = f"{SUPABASE_URL}/rest/v1/rooms?select=room_id,title,topic_id,created_at"
-    res = requests.get(url, headers=HEADERS)
-    return res.json()
+    try:
+        return await repo.list_rooms()
+    except SupabaseError as e:
+        return supabase_error_response(e)
 
 @fastapi_app.get("/messages")
-async def get_messages(room_id: str):
-    url = f"{SUPABASE_URL}/rest/v1/messages?room_id=eq.{room_id}&select=message,role,sender_id,timestamp&order=timestamp.asc"
-    res = requests.get(url, headers=HEADERS)
-    return res.json()
+async def get_messages(room_id: str, viewer_id: Optional[str] = None):
+    """방 메시지 목록 - 귓속말은 viewer_id 본인에게 온 것만 (없으면 방 전체 메시지만)"""
+    try:
+        return await repo.list_messages(
+            room_id, select="message,role,sender_id,timestamp,whisper_to", **all_of(visible_to(viewer_id))
+        )
+    except SupabaseError as e:
+        return supabase_error_response(e)
+
+# ─────────── 캐시 무효화 라우터
+@fastapi_app.post("/cache/students/invalidate")
+async def invalidate_student_cache(request: Request):
+    """관리자가 학생 정보를 수정/삭제했을 때 이름 캐시를 비웁니다. (student_ids 없으면 전체)"""
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    student_ids = body.get("student_ids") or []
+    if student_ids:
+        for student_id in student_ids:
+            invalidate_student_name(student_id)
+    else:
+        invalidate_student_name()
+    return {"invalidated": student_ids or "all"}
+
+@fastapi_app.post("/cache/topics/{topic_id}/invalidate")
+async def invalidate_topic_cache(topic_id: str):
+    """교사가 주제의 시스템 프롬프트를 수정했을 때 방별 프롬프트 캐시와 주제의 직접 질문 답변 캐시를 비웁니다."""
+    return {"invalidated_rooms": invalidate_topic_prompt(topic_id),
+            "invalidated_answers": answer_cache.invalidate(topic_id)}
+
+@fastapi_app.get("/topics/{topic_id}/answer-cache")
+async def topic_answer_cache(topic_id: str):
+    """교사용: 주제의 직접 질문 답변 캐시 적중률, 아낀 토큰, 캐시된 질문 목록 (많이 재사용된 순)"""
+    return answer_cache.topic_stats(topic_id)
+
+# ─────────── 지표 라우터
+@fastapi_app.get("/metrics/message-queue")
+async def message_queue_metrics():
+    """메시지 write-behind 큐의 대기 건수와 flush 지연 시간"""
+    return message_queue.stats()
+
+@fastapi_app.get("/metrics/interventions")
+async def intervention_metrics():
+    """자동 개입 스케줄러의 버퍼/진행 상태, 방식별(two_step / single) 지연 시간/토큰/결정 일치율, 피드백 추측 생성 적중률, 사전 선별 결과"""
+    return {**await intervention_scheduler.stats(), "ab": intervention_ab.snapshot(),
+            "speculation": speculator.stats(), "prefilter": prefilter.stats()}
+
+@fastapi_app.get("/metrics/tokens")
+async def token_metrics():
+    """GPT 호출 종류별 누적 토큰 사용량과 방별 요약 갱신 횟수"""
+    return {"usage": token_usage, "summary_folds": room_summaries.folds}
+
+@fastapi_app.get("/metrics/answer-cache")
+async def answer_cache_metrics():
+    """직접 질문 답변 캐시 전체 적중률 (주제별 목록은 /topics/{topic_id}/answer-cache)"""
+    return answer_cache.stats()
+
+@fastapi_app.get("/metrics/loop")
+async def loop_metrics():
+    """이벤트 루프 지연 (루프를 막은 시간, 최근 샘플 기준 p50/p99/최대)"""
+    return loop_monitor.stats()
+
+@fastapi_app.get("/metrics/llm")
+async def llm_metrics():
+    """OpenAI 호출 종류별 지연 시간(p50/p95), 대기 시간, 재시도/오류 수와 우선순위별 대기 건수"""
+    return gateway.snapshot()
+
+async def collect_app_metrics():
+    """/metrics 스크레이프 시점의 큐 길이, 버퍼 크기, 캐시 크기, 토큰 사용량"""
+    queue = message_queue.stats()
+    scheduler = await intervention_scheduler.stats()
+    samples = [
+        ("chat_message_queue_depth", "gauge", "저장 대기 중인 메시지 수", {}, queue["queue_depth"]),
+        ("chat_message_queue_in_flight", "gauge", "저장 중인 메시지 수", {}, queue["in_flight"]),
+        ("chat_message_queue_flushed_total", "counter", "저장된 메시지 수", {}, queue["flushed_messages"]),
+        ("chat_message_queue_failed_total", "counter", "저장에 실패한 메시지 수", {}, queue["failed_messages"]),
+        ("chat_message_queue_spilled_total", "counter", "재시도까지 실패해 디스크에 옮긴 메시지 수", {},
+         queue["spilled_messages"]),
+        ("chat_intervention_rooms_buffering", "gauge", "자동 개입 버퍼가 있는 방 수", {}, scheduler["rooms_buffering"]),
+        ("chat_intervention_buffered_messages", "gauge", "자동 개입 버퍼의 메시지 수", {},
+         scheduler["buffered_messages"]),
+        ("chat_intervention_in_flight", "gauge", "진행 중인 자동 개입 판단 수", {}, scheduler["in_flight"]),
+        ("chat_llm_in_flight", "gauge", "진행 중인 LLM 호출 수", {}, gateway.limiter.in_flight),
+        ("chat_summary_folds_total", "counter", "방별 대화 요약 갱신 횟수", {}, room_summaries.folds),
+    ]
+    for outcome in ("completed", "timeouts", "failures"):
+        samples.append(("chat_interventions_total", "counter", "끝난 자동 개입 수", {"outcome": outcome},
+                        scheduler[outcome]))
+    for reason, count in scheduler["triggers"].items():
+        samples.append(("chat_intervention_triggers_total", "counter", "자동 개입 판단을 시작한 이유별 횟수",
+                        {"reason": reason}, count))
+    samples.append(("chat_intervention_timers", "gauge", "시간 조건 확인을 기다리는 방 수", {}, scheduler["timers"]))
+    for priority, count in gateway.limiter.queued().items():
+        samples.append(("chat_llm_queued", "gauge", "한도 때문에 기다리는 LLM 호출 수", {"priority": priority}, count))
+    for purpose, usage in token_usage.items():
+        for kind in ("prompt_tokens", "completion_tokens"):
+            samples.append(("chat_llm_tokens_total", "counter", "LLM 호출 종류별 누적 토큰 수",
+                            {"purpose": purpose, "kind": kind}, usage[kind]))
+    for result, count in repo.read_stats.items():
+        samples.append(("chat_supabase_reads_total", "counter",
+                        "Supabase GET 처리 방식 (fetched: 실제 요청, coalesced: 진행 중인 요청 공유, cached: 최근 응답 재사용)",
+                        {"result": result}, count))
+    tails = room_tails.stats()
+    samples += [
+        ("chat_room_tail_rooms", "gauge", "최근 메시지 꼬리를 들고 있는 방 수", {}, tails["rooms"]),
+        ("chat_room_tail_messages", "gauge", "최근 메시지 꼬리에 있는 메시지 수", {}, tails["messages"]),
+        ("chat_room_tail_lookups_total", "counter", "대화 기록 조회 중 꼬리로 답한(hit)/DB로 넘긴(miss) 수",
+         {"result": "hit"}, tails["hits"]),
+        ("chat_room_tail_lookups_total", "counter", "대화 기록 조회 중 꼬리로 답한(hit)/DB로 넘긴(miss) 수",
+         {"result": "miss"}, tails["misses"]),
+    ]
+    for name, cache in (("student_name", student_name_cache), ("room_prompt", room_prompt_cache),
+                        ("evaluation", evaluation_cache)):
+        stats = cache.stats()
+        samples.append(("chat_cache_entries", "gauge", "캐시 항목 수", {"cache": name}, stats["size"]))
+        samples.append(("chat_cache_hits_total", "counter", "캐시 적중 수", {"cache": name}, stats["hits"]))
+        samples.append(("chat_cache_misses_total", "counter", "캐시 미스 수", {"cache": name}, stats["misses"]))
+    return samples
+
+registry.add_collector(collect_app_metrics)
+
+@fastapi_app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Prometheus 텍스트 형식 지표 (이 워커 프로세스 기준)
+    - chat_span_seconds{kind, name}: supabase / llm / emit / socket / http / intervention 구간별 소요 시간
+    - chat_event_loop_lag_seconds: 이벤트 루프 지연
+    - 연결 수, 방 수, 큐/버퍼 길이, 캐시 크기, 토큰 사용량
+    """
+    return PlainTextResponse(await registry.render(), media_type="text/plain; version=0.0.4")
 
 # ─────────── 주제 + 방 생성 라우터
 @fastapi_app.post("/topics")
@@ -111,10 +287,10 @@ async def create_topic_with_rooms(request: Request):
             "created_at": datetime.utcnow().isoformat(),
         }
 
-        topic_url = f"{SUPABASE_URL}/rest/v1/topics"
-        topic_res = requests.post(topic_url, json=topic_data, headers=HEADERS)
-        if topic_res.status_code != 201:
-            return {"error": "주제 생성 실패", "detail": topic_res.text}
+        try:
+            await repo.insert_topic(topic_data)
+        except SupabaseError as e:
+            return {"error": "주제 생성 실패", "detail": e.detail}
 
         room_count = int(body.get("room_count", 1))
         rooms = [
@@ -127,11 +303,10 @@ async def create_topic_with_rooms(request: Request):
             for i in range(room_count)
         ]
 
-        room_url = f"{SUPABASE_URL}/rest/v1/rooms"
-        room_res = requests.post(room_url, json=rooms, headers=HEADERS)
-
-        if room_res.status_code != 201:
-            return {"error": "방 생성 실패", "detail": room_res.text}
+        try:
+            await repo.insert_rooms(rooms)
+        except SupabaseError as e:
+            return {"error": "방 생성 실패", "detail": e.detail}
 
         return {"message": "✅ 주제 및 방 생성 완료", "topic_id": topic_id}
     except Exception as e:
@@ -150,6 +325,7 @@ class EvaluationRequest(BaseModel):
     class_id: Optional[str] = None
     conversation_id: Optional[str] = None
     messages: List[ChatMessage]
+    force_refresh: bool = False  # 저장된 평가가 있어도 새로 평가
 
 @fastapi_app.post("/evaluate-chat")
 async def evaluate_chat(request: Request):
@@ -157,19 +333,26 @@ async def evaluate_chat(request: Request):
         body = await request.json()
         data = EvaluationRequest(**body)
 
-        print("📩 GPT 평가 요청:", data.topic_id, "/", data.target_student or "전체")
+        logger.info("📩 GPT 평가 요청: %s / %s", data.topic_id, data.target_student or "전체")
 
-        # ✅ GPT 평가 핸들러 호출
-        feedback = await evaluate_conversation(
+        # ✅ GPT 평가 (루브릭과 대화가 그대로면 저장된 평가 재사용)
+        feedback, cache_key, cached = await evaluate_cached(
             rubric_prompt=data.rubric_prompt,
-            messages=[m.dict() for m in data.messages]
+            messages=[m.dict() for m in data.messages],
+            target_student=data.target_student,
+            force_refresh=data.force_refresh
         )
 
-        print("✅ GPT 평가 결과 생성 완료")
-        print("📄 평가 요약:\n", feedback[:200], "...")
+        if cached:
+            logger.info("♻️ 저장된 GPT 평가 재사용")
+            return {"feedback": feedback, "cached": True}
+        if feedback == EVALUATION_ERROR_TEXT:
+            return {"feedback": feedback}
+
+        logger.info("✅ GPT 평가 결과 생성 완료")
+        logger.debug("📄 평가 요약:\n%s ...", feedback[:200])
 
         # ✅ 평가 결과 Supabase 저장
-        supabase = create_client(SUPABASE_URL, SERVICE_KEY)
         insert_data = {
             "topic_id": data.topic_id,
             "room_id": data.room_id,
@@ -177,14 +360,66 @@ async def evaluate_chat(request: Request):
             "student_id": data.target_student,
             "conversation_id": data.conversation_id,
             "summary": feedback,
-            "evaluation_type": "individual" if data.target_student else "group"
+            "evaluation_type": "individual" if data.target_student else "group",
+            "cache_key": cache_key
         }
-        supabase.table("gpt_chat_evaluations").insert(insert_data).execute()
+        await repo.insert_evaluations([insert_data])
 
         return {"feedback": feedback}
     except Exception as e:
-        print("❌ GPT 평가 오류:", e)
-        traceback.print_exc()
+        logger.exception("❌ GPT 평가 오류: %s", e)
         return {"feedback": "GPT 평가 생성 중 오류가 발생했습니다."}
     
+_batch_tasks = set()  # 연결이 끊겨도 끝까지 실행되도록 참조 유지
+
+class TopicEvaluationRequest(BaseModel):
+    topic_id: str
+    rubric_prompt: Optional[str] = None  # 없으면 주제에 저장된 루브릭 사용
+    per_student: bool = True  # 방 전체 평가와 함께 학생별 평가도 실행
+    force_refresh: bool = False  # 저장된 평가가 있어도 모두 새로 평가
+
+@fastapi_app.post("/evaluate-topic")
+async def evaluate_topic_route(data: TopicEvaluationRequest):
+    """
+    주제의 모든 방(+학생)을 한 번에 평가하고 끝나는 순서대로 SSE로 전송합니다.
+    - event: result → {room_id, room_title, student_id, feedback, ok, cached, duration_ms}
+    - event: done → {total, cached, failed, saved, duration_ms} (새 평가 결과는 마지막에 한 번에 저장)
+    - 연결이 끊겨도 평가와 저장은 끝까지 진행됩니다.
+    """
+    try:
+        topic, jobs = await load_topic_jobs(data.topic_id, data.per_student)
+    except SupabaseError as e:
+        return supabase_error_response(e)
+    if not topic:
+        return JSONResponse(status_code=404, content={"error": "주제를 찾을 수 없습니다."})
+
+    logger.info("📩 주제 일괄 평가 요청: %s (%s건)", data.topic_id, len(jobs))
+    events = asyncio.Queue()
+
+    async def run_batch():
+        try:
+            async for event in evaluate_topic(topic, jobs, data.rubric_prompt, force_refresh=data.force_refresh):
+                events.put_nowait(event)
+        except Exception as e:
+            logger.exception("❌ 주제 일괄 평가 오류: %s", e)
+            events.put_nowait({"type": "error", "error": "GPT 평가 생성 중 오류가 발생했습니다."})
+        finally:
+            events.put_nowait(None)
+
+    batch_task = asyncio.create_task(run_batch())
+    _batch_tasks.add(batch_task)
+    batch_task.add_done_callback(_batch_tasks.discard)
+
+    async def stream():
+        yield f"event: start\ndata: {json.dumps({'total': len(jobs)})}\n\n"
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield f"event: {event.pop('type')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        await batch_task
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    
 app = ASGIApp(sio, other_asgi_app=fastapi_app, socketio_path="ws/socket.io")
\ No newline at end of file
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import datetime
+from supabase_repo import repo, SupabaseError
+from log_utils import get_logger
+
+logger = get_logger("message_queue")
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "50"))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.05"))  # 초
+MESSAGE_MAX_RETRIES = int(os.getenv("MESSAGE_MAX_RETRIES", "5"))
+# 재시도까지 실패한 메시지를 옮겨 두는 파일 (주기적으로, 그리고 다음 시작 때 다시 저장)
+MESSAGE_SPILL_PATH = os.getenv("MESSAGE_SPILL_PATH",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "message_spill.jsonl"))
+MESSAGE_SPILL_REPLAY_INTERVAL = float(os.getenv("MESSAGE_SPILL_REPLAY_INTERVAL", "30"))  # 초
+
+# bulk insert 시 PostgREST는 모든 객체가 같은 키를 가져야 함
+# client_id: 큐에서 발급하는 멱등 키 - 응답만 잃은 저장을 재시도해도 중복 행이 생기지 않음
+#   (alter table messages add column client_id uuid unique;)
+MESSAGE_COLUMNS = ("client_id", "room_id", "sender_id", "message", "role", "timestamp", "whisper_to", "reasoning")
+
+
+# ✅ 메시지 write-behind 큐
+class MessageWriteQueue:
+    """
+    메시지를 먼저 브로드캐스트하고 DB 저장은 뒤에서 묶어서(micro-batch) 처리하는 큐
+    - enqueue(): 저장할 메시지를 넣고 Future를 돌려받음 (저장된 행 또는 실패 시 None)
+    - batch_size개가 모이거나 flush_interval이 지나면 messages 테이블에 배열 POST 한 번으로 저장
+    - 실패 시 지수 백오프(+지터)로 재시도, 종료 시 남은 메시지를 모두 저장한 뒤 멈춤
+    - 행마다 client_id를 붙여 멱등하게 저장: 앞선 시도가 응답만 잃고 저장됐다면 재시도는 그 행을 건너뛰고,
+      저장된 행은 client_id로 다시 조회해 Future/listeners에 넘김
+    - 재시도까지 실패하거나 종료 중에 들어온 메시지는 spill_path에 옮겨 두고
+      replay_interval마다(그리고 다음 시작 때) 다시 저장 (Future는 None으로 끝남)
+    - listeners: 저장된 행마다 한 번 호출 (호출한 쪽이 Future를 기다리다 취소돼도 호출됨)
+    """
+
+    def __init__(self, batch_size=MESSAGE_BATCH_SIZE, flush_interval=MESSAGE_FLUSH_INTERVAL,
+                 max_retries=MESSAGE_MAX_RETRIES, backoff_base=0.2, max_backoff=5.0,
+                 spill_path=MESSAGE_SPILL_PATH, replay_interval=MESSAGE_SPILL_REPLAY_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.spill_path = spill_path
+        self.replay_interval = replay_interval
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._replayer: asyncio.Task | None = None
+        self._closing = False
+        self.listeners = []  # 저장된 행마다 호출할 함수 (예: 방별 최근 메시지 꼬리)
+
+        # 지표
+        self.in_flight = 0
+        self.flushed_batches = 0
+        self.flushed_messages = 0
+        self.failed_messages = 0  # 저장이 거부된 행 (잘못된 행)
+        self.spilled_messages = 0  # 재시도까지 실패해 디스크에 옮긴 행
+        self.replayed_messages = 0  # 디스크에서 다시 큐에 넣은 행
+        self.retries = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._total_flush_latency = 0.0
+        self._flush_count = 0
+
+    # ─────────── 수명 관리
+    async def start(self):
+        if self._worker is None or self._worker.done():
+            self._closing = False
+            if self._queue is None:
+                self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        if self._replayer is None or self._replayer.done():
+            self._replayer = asyncio.create_task(self._replay_loop())
+        return self
+
+    async def stop(self, timeout=30.0):
+        """새 메시지를 받지 않고, 큐에 남은 메시지를 모두 저장한 뒤 종료 (저장하지 못한 메시지는 디스크에 옮김)"""
+        if self._replayer is not None:
+            self._replayer.cancel()
+            self._replayer = None
+        if self._worker is None:
+            return
+        self._closing = True
+        self._queue.put_nowait(None)  # 워커 깨우기
+        try:
+            await asyncio.wait_for(self._worker, timeout)
+        except asyncio.TimeoutError:
+            logger.error("❌ 메시지 큐 종료 시간 초과: %d개를 디스크에 옮깁니다", self._queue.qsize())
+            left = []
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    left.append(item)
+            self._give_up(left)
+        self._worker = None
+
+    # ─────────── 적재
+    def enqueue(self, row: dict) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self._closing:
+            logger.error("❌ 종료 중이라 메시지를 디스크에 옮겨 둡니다.")
+            self._give_up([(self._normalize(row), future)])
+            return future
+        if self._worker is None or self._worker.done():
+            # 앱 lifespan 밖(스크립트 등)에서 사용할 때는 지연 시작
+            if self._queue is None:
+                self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        self._queue.put_nowait((self._normalize(row), future))
+        return future
+
+    @staticmethod
+    def _normalize(row):
+        data = {column: row.get(column) for column in MESSAGE_COLUMNS}
+        if not data["client_id"]:
+            data["client_id"] = str(uuid.uuid4())
+        if not data["timestamp"]:
+            data["timestamp"] = datetime.datetime.utcnow().isoformat()
+        return data
+
+    # ─────────── 워커
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                if self._closing and self._queue.empty():
+                    return
+                continue
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    continue
+                batch.append(item)
+
+            await self._flush(batch)
+
+            if self._closing and self._queue.empty():
+                return
+
+    async def _flush(self, batch):
+        rows = [row for row, _ in batch]
+        futures = [future for _, future in batch]
+        self.in_flight = len(batch)
+        started = time.perf_counter()
+
+        try:
+            saved = await self._insert_batch(rows)
+        except asyncio.CancelledError:
+            # 종료 시간 초과로 취소되면 저장 중이던 배치도 디스크에 옮김
+            self.in_flight = 0
+            self._give_up(batch)
+            raise
+
+        latency = time.perf_counter() - started
+        self.in_flight = 0
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self._total_flush_latency += latency
+        self._flush_count += 1
+
+        if saved is None:
+            self._give_up(batch)
+            return
+
+        self.flushed_batches += 1
+        self.flushed_messages += sum(1 for row in saved if row)
+        self.failed_messages += sum(1 for row in saved if not row)
+        for row in saved:
+            if row:
+                for listener in self.listeners:
+                    try:
+                        listener(row)
+                    except Exception as e:
+                        logger.error("❌ 저장 알림 처리 실패: %s", e)
+        for future, row in zip(futures, saved):
+            if not future.done():
+                future.set_result(row)
+
+    async def _insert_batch(self, rows):
+        """
+        배치 저장 (재시도 포함) → 요청 순서대로 저장된 행(거부된 행은 None), 재시도까지 실패하면 None
+        - 멱등 저장이라 앞선 시도가 응답만 잃고 저장됐어도 재시도는 중복 행을 만들지 않음
+        - 응답에 없는 행(앞선 시도에서 이미 저장됨)은 client_id로 조회
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                inserted = await repo.insert_messages_once(rows)
+                return await self._match(rows, inserted)
+            except SupabaseError as e:
+                if 400 <= e.status < 500 and e.status not in (408, 429):
+                    # 잘못된 행 하나가 배치 전체를 막지 않도록 한 건씩 저장
+                    logger.warning("❌ 메시지 일괄 저장 거부 (%s), 개별 저장으로 전환", e.status)
+                    return await self._insert_each(rows)
+                error = e
+            except Exception as e:
+                error = e
+            if attempt == self.max_retries:
+                logger.error("❌ 메시지 일괄 저장 실패 (%d개): %s", len(rows), error)
+                return None
+            self.retries += 1
+            delay = min(self.max_backoff, self.backoff_base * (2 ** attempt))
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+    async def _match(self, rows, inserted, rejected=()):
+        """저장 응답을 client_id로 요청 행에 맞춤 (rejected: 저장이 거부된 client_id)"""
+        by_key = {row.get("client_id"): row for row in inserted if row}
+        missing = [row["client_id"] for row in rows if row["client_id"] not in by_key
+                   and row["client_id"] not in rejected]
+        if missing:
+            by_key.update((row.get("client_id"), row) for row in await repo.get_messages_by_client_ids(missing))
+        return [by_key.get(row["client_id"]) for row in rows]
+
+    async def _insert_each(self, rows):
+        inserted, rejected = [], set()
+        for row in rows:
+            try:
+                inserted.extend(await repo.insert_messages_once([row]))
+            except Exception as e:
+                logger.error("❌ 메시지 저장 실패: %s", e)
+                rejected.add(row["client_id"])
+        try:
+            return await self._match(rows, inserted, rejected)
+        except Exception as e:
+            logger.error("❌ 저장된 메시지 조회 실패: %s", e)
+            return await self._match(rows, inserted, {row["client_id"] for row in rows})
+
+    # ─────────── 디스크 옮김 / 다시 저장
+    def _give_up(self, batch):
+        """저장하지 못한 행을 spill_path에 옮겨 두고 Future는 None으로 끝냄"""
+        rows = [row for row, _ in batch]
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.spilled_messages += len(rows)
+        except OSError as e:
+            self.failed_messages += len(rows)
+            logger.error("❌ 저장하지 못한 메시지 %d개를 디스크에도 옮기지 못했습니다: %s", len(rows), e)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    def replay_spilled(self):
+        """디스크에 옮겨 둔 행을 다시 큐에 넣음 (다시 실패하면 다시 옮겨짐) → 넣은 행 수"""
+        taking = self.spill_path + ".replay"
+        try:
+            if not os.path.exists(taking):
+                os.replace(self.spill_path, taking)
+            with open(taking, encoding="utf-8") as f:
+                lines = f.readlines()
+            os.remove(taking)
+        except FileNotFoundError:
+            return 0
+        loop = asyncio.get_running_loop()
+        count = 0
+        for line in lines:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                logger.error("❌ 옮겨 둔 메시지를 읽지 못했습니다: %r", line[:200])
+                continue
+            self._queue.put_nowait((self._normalize(row), loop.create_future()))
+            count += 1
+        if count:
+            self.replayed_messages += count
+            logger.info("✅ 디스크에 옮겨 둔 메시지 %d개를 다시 저장합니다", count)
+        return count
+
+    async def _replay_loop(self):
+        while True:
+            try:
+                self.replay_spilled()
+            except OSError as e:
+                logger.error("❌ 옮겨 둔 메시지 다시 저장 실패: %s", e)
+            await asyncio.sleep(self.replay_interval)
+
+    # ─────────── 지표
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "in_flight": self.in_flight,
+            "flushed_batches": self.flushed_batches,
+            "flushed_messages": self.flushed_messages,
+            "failed_messages": self.failed_messages,
+            "spilled_messages": self.spilled_messages,
+            "replayed_messages": self.replayed_messages,
+            "retries": self.retries,
+            "last_flush_latency_ms": round(self.last_flush_latency * 1000, 2),
+            "avg_flush_latency_ms": round(self._total_flush_latency / self._flush_count * 1000, 2)
+            if self._flush_count else 0.0,
+            "max_flush_latency_ms": round(self.max_flush_latency * 1000, 2),
+        }
+
+
+message_queue = MessageWriteQueue()
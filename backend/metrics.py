@@ -0,0 +1,263 @@
+import os
+import time
+import random
+import inspect
+import functools
+import contextvars
+from log_utils import get_logger
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # 요청별 trace 로그를 남길 비율 (0이면 끔)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+trace_logger = get_logger("trace")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        for key, value in list(self._values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in list(self._values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+# ✅ 메트릭 레지스트리 (Prometheus 텍스트 형식)
+class Registry:
+    """
+    카운터/게이지/히스토그램과 수집 함수(collector)를 모아 /metrics 응답을 만듦
+    - collector: 스크레이프할 때 호출되는 (async) 함수
+      [(이름, 종류, 설명, {라벨}, 값), ...]을 반환 (큐 길이, 버퍼 크기처럼 다른 객체에 있는 값)
+    - 워커 프로세스마다 따로 집계됨
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    async def render(self):
+        families = {}
+        for metric in self._metrics.values():
+            families[metric.name] = (metric.kind, metric.help, list(metric.samples()))
+        for collector in self._collectors:
+            try:
+                collected = collector()
+                if inspect.isawaitable(collected):
+                    collected = await collected
+            except Exception as e:
+                trace_logger.warning("메트릭 수집 실패 (%s): %s", getattr(collector, "__name__", collector), e)
+                continue
+            for name, kind, help_text, labels, value in collected:
+                if value is None:
+                    continue
+                families.setdefault(name, (kind, help_text, []))[2].append((name, labels, value))
+
+        lines = []
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+SPAN_SECONDS = registry.histogram("chat_span_seconds", "구간별 소요 시간 (supabase, llm, emit, socket, http)",
+                                  ("kind", "name"))
+SPAN_ERRORS = registry.counter("chat_span_errors_total", "예외로 끝난 구간 수", ("kind", "name"))
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """한 요청(소켓 이벤트/HTTP 요청) 안에서 실행된 구간 목록 - 끝나면 한 줄 로그로 남김"""
+
+    def __init__(self, kind, name):
+        self.id = f"{random.getrandbits(32):08x}"
+        self.kind = kind
+        self.name = name
+        self.spans = []
+        self.closed = False
+
+    def add(self, kind, name, seconds, error):
+        # 요청이 끝난 뒤에도 돌고 있는 백그라운드 작업의 구간은 붙이지 않음
+        if not self.closed:
+            self.spans.append((kind, name, seconds, error))
+
+    def log(self, seconds, error):
+        self.closed = True
+        parts = ", ".join(f"{kind} {name} {s * 1000:.1f}ms" + (" !" if failed else "")
+                          for kind, name, s, failed in self.spans)
+        trace_logger.info("trace=%s %s %s %.1fms%s | %s", self.id, self.kind, self.name, seconds * 1000,
+                          " ERROR" if error else "", parts or "-")
+
+
+# ✅ 구간 측정
+class span:
+    """
+    with / async with 블록의 소요 시간을 chat_span_seconds{kind, name}에 기록
+    - 예외로 끝나면 chat_span_errors_total도 올림 (예외는 그대로 전달)
+    - 진행 중인 trace가 있으면 그 요청의 구간 목록에도 추가
+    """
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._started
+        SPAN_SECONDS.observe(seconds, kind=self.kind, name=self.name)
+        if exc_type is not None:
+            SPAN_ERRORS.inc(kind=self.kind, name=self.name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(self.kind, self.name, seconds, exc_type is not None)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class root_span(span):
+    """
+    요청 단위의 최상위 구간 - TRACE_SAMPLE_RATE 비율로 trace를 시작해 끝날 때 구간 목록을 로그로 남김
+    """
+
+    def __enter__(self):
+        trace = Trace(self.kind, self.name) if TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE else None
+        self._trace = trace
+        self._token = _current_trace.set(trace)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._started
+        _current_trace.reset(self._token)
+        super().__exit__(exc_type, exc, tb)
+        if self._trace is not None:
+            self._trace.name = self.name
+            self._trace.log(seconds, exc_type is not None)
+        return False
+
+
+def traced_handler(kind="socket"):
+    """
+    소켓 이벤트 핸들러를 root_span으로 감싸는 데코레이터 (@sio.event 아래에 붙임)
+    - 핸들러가 받지 않는 뒤쪽 인자(예: connect의 auth, disconnect의 reason)는 버리고 호출
+    """
+
+    def decorate(handler):
+        parameters = inspect.signature(handler).parameters.values()
+        accepts_varargs = any(p.kind == p.VAR_POSITIONAL for p in parameters)
+        positional = sum(1 for p in parameters if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD))
+
+        @functools.wraps(handler)
+        async def wrapper(*args):
+            with root_span(kind, handler.__name__):
+                return await handler(*(args if accepts_varargs else args[:positional]))
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,156 @@
+import os
+import re
+from datetime import datetime
+import numpy as np
+from metrics import registry
+
+# LLM 판단 전 로컬 사전 선별 - 주제에 맞고 고르게 참여하는 대화 창은 판단(LLM 호출)을 건너뜀
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "false").lower() in ("1", "true", "yes")
+PREFILTER_MIN_SPEAKERS = int(os.getenv("PREFILTER_MIN_SPEAKERS", "2"))  # 발화한 학생 수 하한
+PREFILTER_MAX_SHARE = float(os.getenv("PREFILTER_MAX_SHARE", "0.5"))  # 한 학생의 발화 비율 상한
+PREFILTER_MIN_TOPIC_OVERLAP = float(os.getenv("PREFILTER_MIN_TOPIC_OVERLAP", "0.3"))  # 메시지별 주제 어휘 겹침 평균 하한
+PREFILTER_MIN_MESSAGE_OVERLAP = float(os.getenv("PREFILTER_MIN_MESSAGE_OVERLAP", "0.1"))  # 모든 메시지의 주제 어휘 겹침 하한
+PREFILTER_MAX_SHORT_RATIO = float(os.getenv("PREFILTER_MAX_SHORT_RATIO", "0.34"))  # 짧은 메시지 비율 상한
+PREFILTER_SHORT_CHARS = int(os.getenv("PREFILTER_SHORT_CHARS", "6"))  # 이보다 짧으면 짧은 메시지 (ㅋㅋ, ㅇㅇ ...)
+PREFILTER_MAX_GAP = float(os.getenv("PREFILTER_MAX_GAP", "60"))  # 메시지 사이 침묵 상한(초)
+
+_NON_WORD = re.compile(r"[^0-9a-z가-힣]+")
+_SEPARATOR = "\x00"
+
+
+def _bigram_codes(texts):
+    """
+    텍스트 목록 → (글자 bigram 코드, 각 bigram의 메시지 번호) - 전체를 한 번에 NumPy로 계산
+    한국어는 형태소 분석 없이도 글자 bigram이 어휘 겹침을 잘 나타냄 ("기후변화" ↔ "기후 변화")
+    """
+    joined = _SEPARATOR + _SEPARATOR.join(_NON_WORD.sub("", text.lower()) for text in texts)
+    points = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    segments = np.cumsum(points == 0) - 1
+    valid = (points[:-1] != 0) & (points[1:] != 0)
+    codes = points[:-1] * 0x110000 + points[1:]
+    return codes[valid], segments[:-1][valid]
+
+
+def _seconds(timestamp):
+    try:
+        return datetime.fromisoformat(str(timestamp)).timestamp()
+    except ValueError:
+        return np.nan
+
+
+def window_features(messages, topic_prompt):
+    """
+    대화 창(학생 메시지 목록)의 특징
+    - speakers / max_share: 발화한 학생 수, 가장 많이 말한 학생의 비율
+    - topic_overlap / min_message_overlap: 메시지별 글자 bigram 중 주제 프롬프트에 있는 비율 (평균 / 최소)
+    - short_ratio / mean_length: 짧은 메시지 비율, 평균 길이
+    - max_gap: 메시지 사이 가장 긴 침묵(초)
+    """
+    messages = [m for m in messages if m.get("sender_id")]
+    if not messages:
+        return None
+    texts = [str(m.get("message") or "") for m in messages]
+
+    _, counts = np.unique(np.array([m["sender_id"] for m in messages]), return_counts=True)
+
+    topic_codes, _ = _bigram_codes([topic_prompt or ""])
+    codes, segments = _bigram_codes(texts)
+    hits = np.isin(codes, topic_codes)
+    totals = np.bincount(segments, minlength=len(texts))
+    overlaps = np.divide(np.bincount(segments, weights=hits, minlength=len(texts)), totals,
+                         out=np.zeros(len(texts)), where=totals > 0)
+
+    lengths = np.fromiter((len(text.strip()) for text in texts), dtype=np.int64, count=len(texts))
+    times = np.sort(np.fromiter((_seconds(m.get("timestamp")) for m in messages), dtype=np.float64,
+                                count=len(messages)))
+    gaps = np.diff(times[~np.isnan(times)])
+
+    return {
+        "messages": len(messages),
+        "speakers": int(len(counts)),
+        "max_share": float(counts.max() / counts.sum()),
+        "topic_overlap": float(overlaps.mean()),
+        "min_message_overlap": float(overlaps.min()),
+        "short_ratio": float((lengths < PREFILTER_SHORT_CHARS).mean()),
+        "mean_length": float(lengths.mean()),
+        "max_gap": float(gaps.max()) if len(gaps) else 0.0,
+    }
+
+
+# ✅ 자동 개입 사전 선별
+class WindowPrefilter:
+    """
+    자동 개입 판단 전에 대화 창을 로컬에서 선별
+    - 모든 조건을 만족하는 창(주제에 맞고, 고르게 참여하고, 충분히 길고, 침묵이 없는 대화)은
+      "개입 불필요"로 보고 LLM 판단을 건너뜀
+    - 하나라도 어긋나면 (reason: 처음 어긋난 조건) LLM 판단으로 넘김
+    - 주제에 맞는 고른 대화는 긍정 피드백(positive) 대상이기도 하므로, 켜기 전에
+      bench/eval_prefilter.py로 기록된 개입과 비교해 임계값을 정할 것
+    """
+
+    def __init__(self, enabled=PREFILTER_ENABLED, min_speakers=PREFILTER_MIN_SPEAKERS, max_share=PREFILTER_MAX_SHARE,
+                 min_topic_overlap=PREFILTER_MIN_TOPIC_OVERLAP, min_message_overlap=PREFILTER_MIN_MESSAGE_OVERLAP,
+                 max_short_ratio=PREFILTER_MAX_SHORT_RATIO, max_gap=PREFILTER_MAX_GAP):
+        self.enabled = enabled
+        self.min_speakers = min_speakers
+        self.max_share = max_share
+        self.min_topic_overlap = min_topic_overlap
+        self.min_message_overlap = min_message_overlap
+        self.max_short_ratio = max_short_ratio
+        self.max_gap = max_gap
+        self.screened = 0
+        self.skipped = 0
+        self.kept = {}  # LLM 판단으로 넘긴 이유별 횟수
+
+    def check(self, features):
+        """features → (건너뛸지, 이유)"""
+        if features is None:
+            return False, "empty"
+        checks = (
+            ("speakers", features["speakers"] >= self.min_speakers),
+            ("balance", features["max_share"] <= self.max_share),
+            ("topic", features["topic_overlap"] >= self.min_topic_overlap),
+            ("off_topic_message", features["min_message_overlap"] >= self.min_message_overlap),
+            ("short", features["short_ratio"] <= self.max_short_ratio),
+            ("silence", features["max_gap"] <= self.max_gap),
+        )
+        for reason, passed in checks:
+            if not passed:
+                return False, reason
+        return True, "on_topic_balanced"
+
+    def screen(self, messages, topic_prompt):
+        """대화 창 선별 → {"skip", "reason", "features"} (꺼져 있으면 항상 skip=False)"""
+        if not self.enabled:
+            return {"skip": False, "reason": "disabled", "features": None}
+        features = window_features([m for m in messages if str(m.get("sender_id", "")).startswith("2s")],
+                                   topic_prompt)
+        skip, reason = self.check(features)
+        self.screened += 1
+        if skip:
+            self.skipped += 1
+        else:
+            self.kept[reason] = self.kept.get(reason, 0) + 1
+        return {"skip": skip, "reason": reason, "features": features}
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "screened": self.screened,
+            "skipped": self.skipped,
+            "skip_rate": round(self.skipped / self.screened, 3) if self.screened else None,
+            "kept": self.kept,
+        }
+
+    def collect(self):
+        """/metrics 수집 함수"""
+        samples = [("chat_prefilter_windows_total", "counter", "사전 선별 결과 (skip: LLM 판단 생략)",
+                    {"result": "skip"}, self.skipped)]
+        for reason, count in self.kept.items():
+            samples.append(("chat_prefilter_windows_total", "counter", "사전 선별 결과 (skip: LLM 판단 생략)",
+                            {"result": reason}, count))
+        return samples
+
+
+prefilter = WindowPrefilter()
+registry.add_collector(prefilter.collect)
@@ -0,0 +1,67 @@
+from supabase_client import get_student_name, prefill_student_names
+
+
+def user_room(student_id, room_id):
+    """
+    학생별 개인 방 이름 (귓속말 전송용, 모든 노드의 해당 학생 연결에 전달됨)
+    - 채팅방마다 따로 두어, 같은 학생이 다른 채팅방에 열어 둔 탭에는 귓속말이 가지 않음
+    """
+    return f"user:{room_id}:{student_id}"
+
+
+# ✅ 접속자 레지스트리
+class PresenceRegistry:
+    """
+    입장/퇴장/귓속말/참여자 조회를 모두 색인으로 처리하는 접속자 레지스트리
+    - sid → (user_id, room_id), room_id → 연결, user_id → 연결(여러 탭) 색인은 state_store에 보관
+    - 같은 학생이 여러 탭으로 접속해도 참여자 목록에는 한 번만 나오고,
+      첫 탭 입장/마지막 탭 퇴장 때만 입장·퇴장으로 봄
+    - 이름은 학생 이름 캐시에서 가져오고, 캐시에 없는 이름만 한 번에 조회
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    async def join(self, sid, user_id, room_id):
+        """연결을 방에 등록, 이 학생의 방 첫 연결이면 True"""
+        return await self.store.set_session(sid, user_id, room_id)
+
+    async def leave(self, sid):
+        """
+        연결 제거
+        - 반환값: {"user_id", "room_id", "last_tab", "room_empty"} 또는 등록되지 않은 연결이면 None
+        """
+        session = await self.store.remove_session(sid)
+        if not session:
+            return None
+        user_id, room_id, remaining = session
+        return {
+            "user_id": user_id,
+            "room_id": room_id,
+            "last_tab": remaining == 0,
+            "room_empty": await self.store.room_size(room_id) == 0,
+        }
+
+    async def session(self, sid):
+        """(user_id, room_id) 또는 None"""
+        return await self.store.get_session(sid)
+
+    async def sids_of(self, user_id, room_id=None):
+        """학생의 연결 sid 목록 (room_id를 주면 그 방의 연결만)"""
+        sessions = await self.store.user_sessions(user_id)
+        return [sid for sid, room in sessions if room_id is None or room == room_id]
+
+    async def is_in_room(self, user_id, room_id):
+        return bool(await self.sids_of(user_id, room_id))
+
+    async def participant_ids(self, room_id):
+        return await self.store.room_participants(room_id)
+
+    async def participants(self, room_id):
+        """[{"student_id", "name"}, ...] - 입장 순서, 학생당 한 번"""
+        user_ids = await self.store.room_participants(room_id)
+        await prefill_student_names(user_ids)
+        return [
+            {"student_id": uid, "name": await get_student_name(uid)}
+            for uid in user_ids
+        ]
@@ -0,0 +1,179 @@
+import os
+import bisect
+import asyncio
+from cache_utils import TTLCache
+from state_store import REDIS_URL
+
+# 방별 최근 메시지 꼬리 (저장이 끝난 메시지 N개를 메모리에 유지)
+# 다른 워커가 저장한 메시지는 보이지 않으므로 REDIS_URL(여러 워커) 설정 시 기본으로 끔
+HOT_TAIL_SIZE = int(os.getenv("HOT_TAIL_SIZE", "0" if REDIS_URL else "200"))  # 방별 메시지 수, 0이면 끔
+HOT_TAIL_MAX_ROOMS = int(os.getenv("HOT_TAIL_MAX_ROOMS", "2000"))
+HOT_TAIL_IDLE_TTL = float(os.getenv("HOT_TAIL_IDLE_TTL", "1800"))  # 새 메시지가 없는 방을 내려놓는 시간(초)
+
+TAIL_COLUMNS = ("message_id", "message", "role", "sender_id", "timestamp", "whisper_to", "reasoning")
+
+
+def _sort_key(row):
+    return row["timestamp"], row["message_id"]
+
+
+def _visible(row, viewer_id, all_rows):
+    """supabase_repo.visible_to와 같은 귓속말 공개 범위"""
+    return all_rows or row.get("whisper_to") is None or (viewer_id and row.get("whisper_to") == viewer_id)
+
+
+class RoomTail:
+    """한 방의 최근 메시지 (timestamp, message_id) 순 정렬, 최대 size개"""
+
+    def __init__(self, size):
+        self.size = size
+        self.rows = []
+        self.complete = False  # 방의 모든 메시지가 들어 있음 (메시지 수 < size)
+        self.floor_id = 0  # 꼬리에 없는 메시지 중 가장 큰 message_id (이보다 큰 ID는 모두 꼬리에 있음)
+        self.seeding = None  # DB에서 채우는 중이면 그 Future
+        self._pending = []  # 채우는 동안 저장이 끝난 메시지
+
+    def add(self, row):
+        if self.seeding is not None:
+            self._pending.append(row)
+            return
+        key = _sort_key(row)
+        if not self.rows or key > _sort_key(self.rows[-1]):
+            self.rows.append(row)  # 대부분은 가장 최근 메시지
+        else:
+            index = bisect.bisect_left([_sort_key(r) for r in self.rows], key)
+            if index < len(self.rows) and _sort_key(self.rows[index]) == key:
+                return  # 이미 있는 메시지
+            self.rows.insert(index, row)
+        self._trim()
+
+    def seed(self, rows):
+        """DB에서 가져온 최근 메시지로 채우고 그사이 저장된 메시지를 합침"""
+        self.seeding = None
+        self.complete = len(rows) < self.size
+        self.rows = sorted(rows, key=_sort_key)
+        self.floor_id = 0 if self.complete else min(r["message_id"] for r in self.rows) - 1
+        pending, self._pending = self._pending, []
+        for row in pending:
+            self.add(row)
+
+    def _trim(self):
+        if len(self.rows) > self.size:
+            dropped, self.rows = self.rows[:-self.size], self.rows[-self.size:]
+            self.complete = False
+            self.floor_id = max(self.floor_id, max(r["message_id"] for r in dropped))
+
+    def latest(self, limit, viewer_id, all_rows):
+        """최근 페이지 (rows, has_more) - 꼬리만으로 답할 수 없으면 None"""
+        visible = [r for r in self.rows if _visible(r, viewer_id, all_rows)]
+        if len(visible) > limit:
+            return visible[-limit:], True
+        if self.complete:
+            return visible, False
+        return None
+
+    def since(self, since_message_id, limit, viewer_id, all_rows):
+        """since_message_id 이후 메시지 (rows, has_more) - 꼬리에 없는 메시지가 있을 수 있으면 None"""
+        if since_message_id < self.floor_id:
+            return None
+        rows = sorted((r for r in self.rows
+                       if r["message_id"] > since_message_id and _visible(r, viewer_id, all_rows)),
+                      key=lambda r: r["message_id"])
+        return sorted(rows[:limit], key=_sort_key), len(rows) > limit
+
+
+# ✅ 방별 최근 메시지 꼬리
+class RoomTailCache:
+    """
+    send_message로 지나간(저장이 끝난) 메시지를 방별로 최근 size개까지 메모리에 두고
+    최근 페이지 / 재접속 동기화 / GPT 직접 질문 맥락을 Supabase 조회 없이 돌려주는 캐시
+    - 방을 처음 조회할 때 DB에서 최근 size개로 채우고(동시 조회는 한 번만), 이후에는 저장 완료 시 추가
+    - 꼬리만으로 답할 수 없는 요청(더 이전 페이지, 꼬리보다 오래된 since)은 None → DB 조회
+    - 메모리는 방 수(max_rooms, LRU) × size로 제한되고, idle_ttl 동안 새 메시지가 없는 방은 내려놓음
+    - 반환하는 행은 복사본 (호출하는 쪽에서 name/whisper 필드를 추가해도 꼬리는 그대로)
+    """
+
+    def __init__(self, size=HOT_TAIL_SIZE, max_rooms=HOT_TAIL_MAX_ROOMS, idle_ttl=HOT_TAIL_IDLE_TTL):
+        self.size = size
+        self._rooms = TTLCache(maxsize=max_rooms, ttl=idle_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.seeds = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def commit(self, row):
+        """메시지 저장이 끝났을 때 호출 (message_queue.listeners, 꼬리를 들고 있는 방만 추가)"""
+        if not self.enabled or row.get("message_id") is None:
+            return
+        room_id = row.get("room_id")
+        tail = self._rooms.get(room_id)
+        if tail is None:
+            return  # 아직 조회한 적 없는 방은 다음 조회 때 DB에서 채움
+        tail.add({column: row.get(column) for column in TAIL_COLUMNS})
+        self._rooms.set(room_id, tail)  # idle 만료 시각 갱신
+
+    async def _tail(self, room_id, load):
+        """방 꼬리 (없으면 load(size)로 DB에서 채움, 실패하면 None)"""
+        tail = self._rooms.get(room_id)
+        if tail is None:
+            tail = RoomTail(self.size)
+            tail.seeding = seeding = asyncio.get_running_loop().create_future()
+            self._rooms.set(room_id, tail)
+            self.seeds += 1
+            try:
+                rows = await load(self.size)
+            except BaseException as e:
+                if self._rooms.get(room_id) is tail:
+                    self._rooms.pop(room_id)
+                seeding.set_result(False)
+                if isinstance(e, Exception):
+                    return None  # 호출한 쪽이 DB에서 직접 조회
+                raise
+            tail.seed([{column: row.get(column) for column in TAIL_COLUMNS} for row in rows])
+            seeding.set_result(True)
+        elif tail.seeding is not None:
+            if not await asyncio.shield(tail.seeding):
+                return None
+        return tail
+
+    async def latest(self, room_id, limit, viewer_id, all_rows, load):
+        if not self.enabled:
+            return None
+        tail = await self._tail(room_id, load)
+        result = tail.latest(limit, viewer_id, all_rows) if tail else None
+        return self._copy(result)
+
+    async def since(self, room_id, since_message_id, limit, viewer_id, all_rows, load):
+        if not self.enabled:
+            return None
+        tail = await self._tail(room_id, load)
+        result = tail.since(since_message_id, limit, viewer_id, all_rows) if tail else None
+        return self._copy(result)
+
+    def _copy(self, result):
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        rows, has_more = result
+        return [dict(row) for row in rows], has_more
+
+    def release(self, room_id):
+        """방에 남은 참여자가 없을 때 꼬리를 내려놓음"""
+        self._rooms.pop(room_id)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "rooms": len(self._rooms),
+            "messages": sum(len(tail.rows) for tail in self._rooms.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "seeds": self.seeds,
+        }
+
+
+room_tails = RoomTailCache()
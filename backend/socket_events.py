@@ -1,59 +1,154 @@
+import os
+import time
+import uuid
+import asyncio
 import datetime
+import contextvars
 from supabase_client import (
-    save_message_to_db,
+    enqueue_message,
+    HISTORY_PAGE_SIZE,
     get_room_history,
     get_student_name,
+    release_room_prompt,
     save_gpt_intervention
 )
 from gpt_handler import GPTInterventionService
+from intervention_ab import intervention_ab
+from llm_gateway import metered
+from speculation import speculator
+from intervention_scheduler import InterventionScheduler
+from context_builder import room_summaries
+from state_store import state_store
+from presence import PresenceRegistry, user_room
+from log_utils import HOT, get_logger
+from metrics import registry, span, traced_handler
 
-sid_to_user = {}
-sid_to_room = {}
-recent_messages = {}  # room_id → [messages]
-MESSAGE_LIMIT = 6  # 최근 메시지 기준 (확대 가능)
+logger = get_logger("socket")
+
+MESSAGE_LIMIT = int(os.getenv("MESSAGE_LIMIT", "6"))  # 최근 메시지 기준 (INTERVENTION_TRIGGER가 없을 때 count 조건)
+GPT_STREAMING = os.getenv("GPT_STREAMING", "true").lower() in ("1", "true", "yes")  # GPT 응답 스트리밍 여부
+
+# 접속 정보와 자동 개입 버퍼는 공유 저장소에 보관 (REDIS_URL 설정 시 여러 워커/노드가 공유)
+presence = PresenceRegistry(state_store)
+intervention_scheduler = InterventionScheduler(store=state_store, window=MESSAGE_LIMIT)
+
+CONNECTED_SIDS = registry.gauge("chat_connected_sids", "이 워커에 연결된 소켓 수")
+
+
+def active_room_count(sio):
+    """이 워커에 연결이 하나라도 있는 채팅방 수 (sid별 방, 학생 개인 방 제외)"""
+    rooms = sio.manager.rooms.get("/", {})
+    sids = rooms.get(None, {})
+    return sum(1 for room in rooms if room is not None and room not in sids and not str(room).startswith("user:"))
 
-def build_participants(sid_to_user, sid_to_room, current_room):
-    return [
-        {
-            "student_id": uid,
-            "name": get_student_name(uid)
-        }
-        for k, uid in sid_to_user.items()
-        if sid_to_room.get(k) == current_room
-    ]
 
 def register_socket_events(sio):
 
+    async def emit(event, payload, room):
+        """sio.emit + 전송 시간 기록 (chat_span_seconds{kind="emit"})"""
+        with span("emit", event):
+            await sio.emit(event, payload, room=room)
+
+    registry.add_collector(lambda: [
+        ("chat_active_rooms", "gauge", "이 워커에 연결이 있는 채팅방 수", {}, active_room_count(sio)),
+    ])
+
     @sio.event
+    @traced_handler()
     async def connect(sid, environ):
-        print(f"✅ 연결됨: {sid}")
+        CONNECTED_SIDS.inc()
+        logger.debug("✅ 연결됨: %s", sid)
 
     @sio.event
+    @traced_handler()
     async def disconnect(sid):
-        sender_id = sid_to_user.get(sid)
-        room_id = sid_to_room.get(sid)
-        if sender_id and room_id:
-            name = get_student_name(sender_id)
-            await sio.emit("user_left", {"sender_id": sender_id, "name": name}, room=room_id)
-        sid_to_user.pop(sid, None)
-        sid_to_room.pop(sid, None)
+        CONNECTED_SIDS.dec()
+        left = await presence.leave(sid)
+        if not left:
+            return
+        sender_id, room_id = left["user_id"], left["room_id"]
+        # 여러 탭으로 접속한 경우 마지막 탭이 닫힐 때만 퇴장 알림
+        if sender_id and room_id and left["last_tab"]:
+            name = await get_student_name(sender_id)
+            await emit("user_left", {"sender_id": sender_id, "name": name}, room_id)
+
+        # 방에 아무도 남지 않으면 방 단위 캐시와 진행 중인 자동 개입 정리
+        if room_id and left["room_empty"]:
+            release_room_prompt(room_id)
+            await intervention_scheduler.cancel_room(room_id)
 
     @sio.event
+    @traced_handler()
     async def join_room(sid, data):
         room_id = data["room_id"]
         sender_id = data.get("sender_id")
-        name = get_student_name(sender_id)
+        name = await get_student_name(sender_id)
 
         await sio.enter_room(sid, room_id)
-        sid_to_user[sid] = sender_id
-        sid_to_room[sid] = room_id
+        if sender_id:
+            await sio.enter_room(sid, user_room(sender_id, room_id))
+        first_tab = await presence.join(sid, sender_id, room_id)
+        participants = await presence.participants(room_id)
+
+        await emit("current_users", {"participants": participants}, sid)
+        # 같은 학생의 추가 탭은 입장 알림 없이 참여자 목록만 받음
+        if first_tab:
+            await emit("user_joined", {"sender_id": sender_id, "name": name}, room_id)
+
+    async def emit_to(event, payload, room_id, whisper_to=None):
+        """
+        이벤트를 방 전체 또는 귓속말 대상 학생에게만 전송하는 함수
+        """
+        if whisper_to:
+            # 귓속말은 이 채팅방의 대상 학생 개인 방으로 전송 (다른 노드에 연결된 경우도 매니저가 전달)
+            await emit(event, payload, user_room(whisper_to, room_id))
+        else:
+            # 일반 메시지는 방 전체에 전송
+            await emit(event, payload, room_id)
+
+    # 조각을 보냈지만 아직 최종 메시지가 나가지 않은 스트림: stream_id → (room_id, whisper_to)
+    open_streams = {}
+
+    def start_stream(room_id, whisper_to=None, feedback_type=None):
+        """
+        GPT 응답 스트리밍 준비
+        - 반환값: (stream_id, on_delta) — on_delta는 조각마다 receive_message_delta 이벤트를 보냄
+        - GPT_STREAMING이 꺼져 있으면 on_delta는 None (전체 응답을 한 번에 전송)
+        - 최종 메시지를 보내지 않게 되면 drop_stream으로 조각 말풍선을 지워야 함
+        """
+        stream_id = str(uuid.uuid4())
+        if not GPT_STREAMING:
+            return stream_id, None
+
+        async def on_delta(delta):
+            open_streams[stream_id] = (room_id, whisper_to)
+            payload = {
+                "stream_id": stream_id,
+                "sender_id": "gpt",
+                "role": "assistant",
+                "delta": delta,
+            }
+            if feedback_type:
+                payload["feedback_type"] = feedback_type
+            if whisper_to:
+                payload["whisper"] = True
+                payload["target"] = whisper_to
+            await emit_to("receive_message_delta", payload, room_id, whisper_to)
 
-        participants = build_participants(sid_to_user, sid_to_room, room_id)
+        return stream_id, on_delta
 
-        await sio.emit("current_users", {"participants": participants}, room=sid)
-        await sio.emit("user_joined", {"sender_id": sender_id, "name": name}, room=room_id)
+    async def drop_stream(stream_id):
+        """
+        최종 메시지 없이 끝난 스트림의 조각 말풍선을 지우도록 receive_message_drop 이벤트 전송
+        - 조각을 보내지 않았거나 이미 최종 메시지를 보낸 스트림이면 아무것도 하지 않음
+        """
+        stream = open_streams.pop(stream_id, None)
+        if stream is None:
+            return
+        room_id, whisper_to = stream
+        await emit_to("receive_message_drop", {"stream_id": stream_id}, room_id, whisper_to)
 
-    async def emit_message(room_id, sender_id, name, msg, role="user", whisper_to=None, is_gpt_question=False, feedback_type=None, reasoning=""):
+    async def emit_message(room_id, sender_id, name, msg, role="user", whisper_to=None, is_gpt_question=False, feedback_type=None, reasoning="", stream_id=None):
         """
         메시지를 클라이언트에 전송하는 유틸리티 함수
         - room_id: 채팅방 ID
@@ -65,6 +160,7 @@ def register_socket_events(sio):
         - is_gpt_question: GPT에게 직접 질문한 경우
         - feedback_type: GPT 피드백 유형 ("positive", "guidance", "direct_response", "individual")
         - reasoning: GPT의 판단 이유나 응답 맥락
+        - stream_id: 스트리밍으로 먼저 보낸 조각들과 최종 메시지를 잇는 ID
         """
         payload = {
             "sender_id": sender_id,
@@ -82,57 +178,57 @@ def register_socket_events(sio):
             
         if reasoning:
             payload["reasoning"] = reasoning
+
+        if stream_id:
+            payload["stream_id"] = stream_id
+            open_streams.pop(stream_id, None)
             
         if whisper_to:
             payload["whisper"] = True
             payload["target"] = whisper_to
-            
-            # 귓속말은 특정 학생에게만 전송
-            for sid, uid in sid_to_user.items():
-                if uid == whisper_to:
-                    await sio.emit("receive_message", payload, to=sid)
-                    return
-        else:
-            # 일반 메시지는 방 전체에 전송
-            await sio.emit("receive_message", payload, room=room_id)
+
+        await emit_to("receive_message", payload, room_id, whisper_to)
 
     @sio.event
+    @traced_handler()
     async def send_message(sid, data):
         room_id = data["room_id"]
         sender_id = data["sender_id"]
         msg = data["message"]
         is_gpt_question = data.get("is_gpt_question", False)
         timestamp = datetime.datetime.utcnow().isoformat()
-        name = get_student_name(sender_id)
-
-        # 메시지 저장
-        await save_message_to_db(room_id, sender_id, msg, "user", timestamp)
+        name = await get_student_name(sender_id)
 
-        # 사용자 메시지 전송
+        # 사용자 메시지 전송 (저장보다 먼저 브로드캐스트)
         await emit_message(room_id, sender_id, name, msg, "user", None, is_gpt_question)
 
+        # 메시지 저장은 write-behind 큐에 맡기고 기다리지 않음
+        enqueue_message(room_id, sender_id, msg, "user", timestamp)
+
         # ✅ GPT 직접 호출 처리 (시나리오 2)
         if is_gpt_question:
-            print(f"📣 GPT 질문 요청 by {sender_id}: '{msg}'")
+            logger.info("📣 GPT 질문 요청 by %s: '%s'", sender_id, msg, extra=HOT)
             
             # 최근 메시지 10개만 가져오기 (성능 최적화)
-            history_data = await get_room_history(room_id, limit=10, offset=0)
+            history_data = await get_room_history(room_id, limit=10)
             messages = history_data.get("messages", [])
             
             # GPT 서비스 초기화
             gpt_service = GPTInterventionService(room_id)
             
-            # 직접 질문에 대한 응답 생성 함수 사용
+            # 직접 질문에 대한 응답 생성 함수 사용 (스트리밍 시 조각을 먼저 전송)
+            stream_id, on_delta = start_stream(room_id, feedback_type="direct_response")
             gpt_text = await gpt_service.generate_direct_response(
                 recent_messages=messages,
                 student_question=msg,
-                student_id=sender_id
+                student_id=sender_id,
+                on_delta=on_delta
             )
             
             gpt_time = datetime.datetime.utcnow().isoformat()
             
             # 응답 저장 (reasoning 필드에 "직접 질문에 대한 응답" 추가)
-            response = await save_message_to_db(
+            response_future = enqueue_message(
                 room_id, 
                 "gpt", 
                 gpt_text, 
@@ -151,10 +247,12 @@ def register_socket_events(sio):
                 None, 
                 False, 
                 "direct_response",
-                "직접 질문에 대한 응답"
+                "직접 질문에 대한 응답",
+                stream_id
             )
             
-            # 교사 대시보드용 개입 로그 저장
+            # 교사 대시보드용 개입 로그 저장 (저장된 message_id가 필요하므로 여기서 대기)
+            response = await response_future
             if response:
                 try:
                     # message_id 추출
@@ -174,149 +272,288 @@ def register_socket_events(sio):
                             reasoning="직접 질문에 대한 응답"
                         )
                 except Exception as e:
-                    print(f"❌ 직접 질문 개입 로그 저장 실패: {e}")
+                    logger.error("❌ 직접 질문 개입 로그 저장 실패: %s", e)
             
             return
 
-        # 최근 메시지 누적 (자동 개입용)
-        if room_id not in recent_messages:
-            recent_messages[room_id] = []
-        recent_messages[room_id].append({
+        # 최근 메시지 누적 (자동 개입용) - 판단은 백그라운드 스케줄러가 실행하므로 바로 반환
+        await intervention_scheduler.add_message(room_id, {
             "sender_id": sender_id,
             "message": msg,
             "timestamp": timestamp,
             "name": name
         })
 
-        # 자동 개입 판단 (시나리오 1) - 메시지가 일정 개수 누적되면 실행
-        if len(recent_messages[room_id]) >= MESSAGE_LIMIT:
-            print(f"🧠 GPT 자동 개입 분석 시작: {room_id}")
-            buffer = recent_messages[room_id]
-            recent_messages[room_id] = []
+    async def run_auto_intervention(room_id, buffer):
+        """
+        자동 개입 판단 (시나리오 1) - 스케줄러가 메시지가 일정 개수 누적된 방에 대해 백그라운드로 실행
+        - 판단마다 방식을 고름 (intervention_ab: two_step 기존 2단계 / single 한 번 호출)
+          방식별 지연 시간, 토큰 사용량을 기록하고 single 일부는 기존 판단과 결정을 비교
+        - 사전 선별(prefilter)에서 개입 불필요로 본 대화 창은 LLM을 부르지 않음
+        """
+        logger.debug("🧠 GPT 자동 개입 분석 시작: %s", room_id)
+        gpt_service = GPTInterventionService(room_id)
+        mode = intervention_ab.choose()
+        started = time.perf_counter()
+        fallback = False
+        try:
+            # PREFILTER_ENABLED: 주제에 맞고 고르게 참여하는 대화는 LLM 판단 없이 넘어감
+            screened = await gpt_service.prescreen(buffer)
+            if screened["skip"]:
+                logger.debug("🧹 사전 선별: 개입 불필요 (%s)", room_id)
+                return
+            with metered() as meter:
+                if mode == "single":
+                    intervention_type, fallback = await respond_in_single_call(room_id, buffer, gpt_service)
+                else:
+                    # SPECULATIVE_FEEDBACK: 판단이 도는 동안 가장 가능성 높은 유형의 피드백을 미리 생성
+                    speculation = await gpt_service.speculate_feedback(buffer)
+                    try:
+                        judgment = await gpt_service.should_respond(buffer)
+                        intervention_type = await respond_to_judgment(room_id, buffer, gpt_service, judgment,
+                                                                      speculation)
+                    finally:
+                        if speculation is not None:
+                            speculator.cancel(speculation)  # 쓰지 않은 추측은 취소
+            intervention_ab.record(mode, time.perf_counter() - started, meter, intervention_type, fallback)
+        finally:
+            # 판단이 끝난 대화는 방별 누적 요약 대상으로 넘김 (다음 판단의 이전 맥락)
+            await room_summaries.add_messages(room_id, buffer)
+
+    async def compare_with_two_step(gpt_service, buffer, single_judgment):
+        """A/B: 같은 대화 창을 기존 판단으로도 돌려 single 결정과 비교 (전송하지 않음, 배치 우선순위)"""
+        try:
+            judgment = await gpt_service.should_respond(buffer, purpose="judge_shadow")
+            intervention_ab.record_agreement(single_judgment, judgment)
+        except Exception as e:
+            logger.warning("⚠️ 결정 비교용 판단 실패: %s", e)
 
-            gpt_service = GPTInterventionService(room_id)
+    async def respond_in_single_call(room_id, buffer, gpt_service):
+        """
+        판단 + 피드백 한 번 호출로 자동 개입 → (최종 개입 유형, 기존 방식으로 다시 처리했는지)
+        - 피드백 필드가 시작되면 대상 확인 후 바로 스트리밍
+        - 대상 확인에서 유형/대상이 바뀌면 그 피드백은 버리고 바뀐 유형으로 다시 생성
+        - 응답을 해석하지 못하면 기존 2단계 방식으로 처리
+        - 조각을 보낸 말풍선을 최종 메시지로 잇지 못하면(개입 안 함, 다시 생성, 실패) 그 말풍선은 지움
+        """
+        stream = {}
+
+        async def open_stream(judgment):
+            intervention_type, target = await resolve_target(room_id, buffer, dict(judgment))
+            if (intervention_type, target) != (judgment["intervention_type"], judgment["target"]):
+                return None
+            whisper_to = target if intervention_type == "individual" else None
+            stream["key"] = (intervention_type, target)
+            stream["id"], on_delta = start_stream(room_id, whisper_to, intervention_type)
+            return on_delta
+
+        try:
+            return await single_call_feedback(room_id, buffer, gpt_service, open_stream, stream)
+        finally:
+            if "id" in stream:
+                await drop_stream(stream["id"])
+
+    async def single_call_feedback(room_id, buffer, gpt_service, open_stream, stream):
+        """respond_in_single_call 본문 (stream: 지금 조각을 보내는 스트림의 {"key", "id"})"""
+        judgment = await gpt_service.judge_and_respond(buffer, open_stream)
+        if judgment is None:
+            if "id" in stream:
+                await drop_stream(stream["id"])  # 해석하지 못한 응답의 조각 말풍선
             judgment = await gpt_service.should_respond(buffer)
+            return await respond_to_judgment(room_id, buffer, gpt_service, judgment), True
+        if intervention_ab.should_compare():
+            # 토큰은 single 쪽에 더하지 않음 (metered() 밖의 컨텍스트에서 실행)
+            asyncio.get_running_loop().create_task(
+                compare_with_two_step(gpt_service, buffer, dict(judgment)), context=contextvars.Context())
+        if not judgment["should_respond"]:
+            logger.debug("🤖 GPT 판단: 개입 불필요")
+            return "none", False
+
+        intervention_type, target = await resolve_target(room_id, buffer, judgment)
+        reasoning = judgment.get("reasoning", "")
+        key = (intervention_type, target)
+        gpt_text = judgment["feedback"] if key == (judgment["intervention_type"], judgment["target"]) else ""
+        logger.info("🤖 GPT 개입 결정 (한 번 호출): %s 유형%s", intervention_type, f" ({target}에게)" if target else "",
+                    extra=HOT)
+        if gpt_text and stream.get("key") == key:
+            stream_id = stream["id"]  # 이미 조각을 보낸 말풍선
+        else:
+            if "id" in stream:
+                await drop_stream(stream["id"])  # 버린 피드백의 조각 말풍선
+            whisper_to = target if intervention_type == "individual" else None
+            stream_id, on_delta = start_stream(room_id, whisper_to, intervention_type)
+            stream["id"] = stream_id
+            if not gpt_text:
+                # 대상 확인으로 판단이 바뀌었거나 피드백이 비어 있으면 바뀐 유형으로 다시 생성
+                gpt_text = await gpt_service.generate_feedback(buffer, intervention_type, target, on_delta=on_delta)
+                if gpt_text is None:
+                    logger.warning("⚠️ 피드백 생성 실패로 이번 개입을 건너뜁니다.")
+                    return "none", False
+        await deliver_feedback(room_id, gpt_text, intervention_type, target, reasoning, stream_id)
+        return intervention_type, False
+
+    async def resolve_target(room_id, buffer, judgment):
+        """
+        판단의 개입 유형/대상 확인 → (개입 유형, 대상 학생 ID)
+        - 이름으로 지정된 대상은 ID로 바꾸고, 개인 피드백 대상이 이 방에 없으면 전체 피드백으로 전환
+        """
+        intervention_type = judgment.get("intervention_type", "guidance")
+        target = judgment.get("target_student") or judgment.get("target")
+
+        # 타겟 스튜던트 ID 확인 및 수정
+        if target and not target.startswith("2s"):
+            # 이름에서 ID를 찾기 위한 로직
+            try:
+                for msg in buffer:
+                    if msg.get("name") == target or msg.get("name") == f"학생{target}":
+                        target = msg.get("sender_id")
+                        break
+            except Exception as e:
+                logger.error("❌ 타겟 스튜던트 ID 변환 중 오류: %s", e)
+
+        # 개인 피드백 대상이 이 방에 없으면 전체 피드백으로 전환
+        if intervention_type == "individual" and target and not await presence.is_in_room(target, room_id):
+            logger.warning("⚠️ 경고: 타겟 학생 ID(%s)가 참여자 목록에 없습니다!", target)
+            intervention_type = "guidance"
+            target = None
+            judgment["reasoning"] = judgment.get("reasoning", "") + " (주의: 개인 피드백이 전체 피드백으로 변경됨 - 대상 학생을 찾을 수 없음)"
+        return intervention_type, target
+
+    async def respond_to_judgment(room_id, buffer, gpt_service, judgment, speculation=None):
+        """
+        판단 결과에 따라 피드백 생성 → 전송 → 저장/개입 로그 기록 (최종 개입 유형 반환, 개입하지 않으면 "none")
+        - speculation: 판단과 동시에 미리 생성 중인 피드백, 최종 유형이 같으면 그 결과를 씀
+        """
+        if judgment.get("should_respond", False):
+            intervention_type, target = await resolve_target(room_id, buffer, judgment)
+            reasoning = judgment.get("reasoning", "")
             
-            if judgment.get("should_respond", False):
-                intervention_type = judgment.get("intervention_type", "guidance")
-                target = judgment.get("target_student") or judgment.get("target")
-                
-                # 타겟 스튜던트 ID 확인 및 수정
-                if target and not target.startswith("2s"):
-                    # 이름에서 ID를 찾기 위한 로직
-                    try:
-                        for msg in buffer:
-                            if msg.get("name") == target or msg.get("name") == f"학생{target}":
-                                target = msg.get("sender_id")
-                                break
-                    except Exception as e:
-                        print(f"❌ 타겟 스튜던트 ID 변환 중 오류: {e}")
-                
-                reasoning = judgment.get("reasoning", "")
-                
-                print(f"🤖 GPT 개입 결정: {intervention_type} 유형" + (f" ({target}에게)" if target else ""))
-                
-                gpt_text = await gpt_service.generate_feedback(buffer, intervention_type, target)
-                gpt_time = datetime.datetime.utcnow().isoformat()
-                
-                # 응답 저장 (귓속말인 경우 whisper_to 설정)
-                message_response = await save_message_to_db(
-                    room_id, "gpt", gpt_text, "assistant", gpt_time, 
-                    whisper_to=target if intervention_type == "individual" else None,
-                    reasoning=reasoning
-                )
+            logger.info("🤖 GPT 개입 결정: %s 유형%s", intervention_type, f" ({target}에게)" if target else "",
+                        extra=HOT)
+            
+            whisper_to = target if intervention_type == "individual" else None
+            stream_id, on_delta = start_stream(room_id, whisper_to, intervention_type)
+            gpt_text = None
+            try:
+                if speculation is not None and speculation.intervention_type == intervention_type:
+                    gpt_text = await speculator.commit(speculation, on_delta)
+                    if gpt_text is None:
+                        # 추측 생성이 실패하면 그 조각 말풍선은 지우고 새 말풍선으로 다시 생성
+                        await drop_stream(stream_id)
+                        stream_id, on_delta = start_stream(room_id, whisper_to, intervention_type)
+                if gpt_text is None:
+                    gpt_text = await gpt_service.generate_feedback(buffer, intervention_type, target,
+                                                                   on_delta=on_delta)
+            finally:
+                if gpt_text is None:
+                    # 생성 도중 실패/취소되면 보낸 조각 말풍선을 지움
+                    await drop_stream(stream_id)
+            if gpt_text is None:
+                # 재시도 후에도 실패하면 실패 안내를 방에 올리지 않고 다음 판단을 기다림
+                logger.warning("⚠️ 피드백 생성 실패로 이번 개입을 건너뜁니다.")
+                return "none"
+            await deliver_feedback(room_id, gpt_text, intervention_type, target, reasoning, stream_id)
+            return intervention_type
+        else:
+            logger.debug("🤖 GPT 판단: 개입 불필요")
+            return "none"
+
+    async def deliver_feedback(room_id, gpt_text, intervention_type, target, reasoning, stream_id):
+        """
+        생성된 피드백 저장(write-behind) → 전송 → 개입 로그 기록
+        """
+        whisper_to = target if intervention_type == "individual" else None
+        gpt_time = datetime.datetime.utcnow().isoformat()
+        
+        # 응답 저장 (귓속말인 경우 whisper_to 설정)
+        message_future = enqueue_message(
+            room_id, "gpt", gpt_text, "assistant", gpt_time, 
+            whisper_to=target if intervention_type == "individual" else None,
+            reasoning=reasoning
+        )
+        
+        # 응답 전송 (저장 완료를 기다리지 않음)
+        await emit_message(
+            room_id, "gpt", None, gpt_text, "assistant", 
+            whisper_to=whisper_to,
+            feedback_type=intervention_type,
+            reasoning=reasoning,
+            stream_id=stream_id
+        )
+        
+        # GPT 개입 로그 저장 (교사 확인용, 저장된 message_id가 필요하므로 대기)
+        message_response = await message_future
+        if message_response:
+            try:
+                # message_id 추출 방식 수정
+                message_id = None
+                logger.debug("✅ 메시지 응답: %s", message_response)
                 
-                # GPT 개입 로그 저장 (교사 확인용)
-                if message_response:
-                    try:
-                        # message_id 추출 방식 수정
-                        message_id = None
-                        print(f"✅ 메시지 응답: {message_response}")
-                        
-                        if isinstance(message_response, dict):
-                            message_id = message_response.get("message_id")
-                        elif isinstance(message_response, list) and len(message_response) > 0:
-                            message_id = message_response[0].get("message_id")
-                        
-                        # 유효한 message_id가 없는 경우 개입 로그 저장 시도하지 않음
-                        if not message_id:
-                            print("❌ 메시지 ID를 찾을 수 없어 개입 로그를 저장하지 않습니다.")
-                            
-                        else:
-                            # 수파베이스 클라이언트 대신 db_utils 임포트
-                            from db_utils import save_gpt_intervention as db_save_intervention
-                            intervention_result = await db_save_intervention(
-                                room_id, 
-                                message_id, 
-                                intervention_type, 
-                                target_student=target, 
-                                reasoning=reasoning
-                            )
-                            
-                            if not intervention_result:
-                                print("❌ 개입 로그 저장 결과가 없습니다.")
-                    except Exception as e:
-                        print(f"❌ GPT 개입 로그 저장 실패: {e}")
-                        import traceback
-                        traceback.print_exc()
+                if isinstance(message_response, dict):
+                    message_id = message_response.get("message_id")
+                elif isinstance(message_response, list) and len(message_response) > 0:
+                    message_id = message_response[0].get("message_id")
                 
-                # 응답 전송
-                await emit_message(
-                    room_id, "gpt", None, gpt_text, "assistant", 
-                    whisper_to=target if intervention_type == "individual" else None,
-                    feedback_type=intervention_type,
-                    reasoning=reasoning
-                )
-            else:
-                print("🤖 GPT 판단: 개입 불필요")
+                # 유효한 message_id가 없는 경우 개입 로그 저장 시도하지 않음
+                if not message_id:
+                    logger.error("❌ 메시지 ID를 찾을 수 없어 개입 로그를 저장하지 않습니다.")
+                    
+                else:
+                    # 수파베이스 클라이언트 대신 db_utils 임포트
+                    from db_utils import save_gpt_intervention as db_save_intervention
+                    intervention_result = await db_save_intervention(
+                        room_id, 
+                        message_id, 
+                        intervention_type, 
+                        target_student=target, 
+                        reasoning=reasoning
+                    )
+                    
+                    if not intervention_result:
+                        logger.error("❌ 개입 로그 저장 결과가 없습니다.")
+            except Exception as e:
+                logger.exception("❌ GPT 개입 로그 저장 실패: %s", e)
+
+    intervention_scheduler.handler = run_auto_intervention
 
     @sio.event
+    @traced_handler()
     async def get_messages(sid, data):
+        """
+        메시지 기록 요청
+        - {room_id}: 최근 페이지
+        - {room_id, before: {timestamp, message_id}}: 이전 페이지 (무한 스크롤)
+        - {room_id, since_message_id}: 재접속 시 놓친 메시지만 (증분 동기화)
+        - limit: 페이지 크기 (기본 HISTORY_PAGE_SIZE)
+        """
         room_id = data.get("room_id")
-        sender_id = sid_to_user.get(sid)
+        session = await presence.session(sid)
+        sender_id = session[0] if session else None
         
         if not room_id:
             return
         
-        # 모든 메시지 한 번에 가져오기 (limit 500으로 증가)
-        history_data = await get_room_history(room_id, limit=500, offset=0)
+        # 귓속말은 쿼리에서 걸러짐: 방 전체 메시지 + 본인에게 온 귓속말만 전송됨
+        history_data = await get_room_history(
+            room_id,
+            limit=data.get("limit") or HISTORY_PAGE_SIZE,
+            before=data.get("before"),
+            since_message_id=data.get("since_message_id"),
+            viewer_id=sender_id
+        )
+        messages = history_data.get("messages", [])
+        pagination = history_data.get("pagination", {})
         
-        # history_data가 리스트가 아닌 딕셔너리인지 확인
-        if isinstance(history_data, list):
-            # 이전 버전 호환성을 위한 처리
-            messages = history_data
-            pagination = {
-                "total": len(messages),
-                "offset": 0,
-                "limit": 500,
-                "has_more": False
-            }
-        else:
-            # 새로운 형식 (딕셔너리)
-            messages = history_data.get("messages", [])
-            pagination = history_data.get("pagination", {})
-        
-        # 귓속말 필터링: 본인에게 온 귓속말만 표시
-        filtered_messages = []
+        # 클라이언트에 whisper 플래그 추가
         for msg in messages:
-            # 귓속말이 아니거나 본인에게 온 귓속말인 경우만 표시
-            if "whisper_to" not in msg or not msg["whisper_to"] or msg["whisper_to"] == sender_id:
-                if msg["sender_id"] != "gpt":
-                    # 이름이 없는 경우에만 조회 (성능 최적화)
-                    if "name" not in msg or not msg["name"]:
-                        msg["name"] = get_student_name(msg["sender_id"])
-                    
-                # 클라이언트에 whisper 플래그 추가
-                if "whisper_to" in msg and msg["whisper_to"]:
-                    msg["whisper"] = True
-                    msg["target"] = msg["whisper_to"]  # 호환성을 위해 target 필드도 추가
-                    
-                filtered_messages.append(msg)
+            if msg.get("whisper_to"):
+                msg["whisper"] = True
+                msg["target"] = msg["whisper_to"]  # 호환성을 위해 target 필드도 추가
         
-        # 전체 메시지와 페이지네이션 정보를 함께 반환
+        # 메시지와 페이지 정보를 함께 반환
         response = {
-            "messages": filtered_messages,
+            "messages": messages,
             "pagination": pagination
         }
                 
-        await sio.emit("message_history", response, room=sid)
\ No newline at end of file
+        await emit("message_history", response, sid)
@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+from collections import Counter, deque
+from context_builder import count_tokens
+from llm_gateway import metered
+from log_utils import get_logger
+from metrics import registry
+
+logger = get_logger("speculation")
+
+# 판단과 동시에 피드백을 미리 생성 (2단계 자동 개입에서 피드백 생성 대기 시간을 줄임)
+SPECULATIVE_FEEDBACK = os.getenv("SPECULATIVE_FEEDBACK", "false").lower() in ("1", "true", "yes")
+SPECULATIVE_MIN_PROBABILITY = float(os.getenv("SPECULATIVE_MIN_PROBABILITY", "0.3"))  # 예측 유형의 최근 비율이 이보다 낮으면 미리 만들지 않음
+SPECULATIVE_WASTE_TOKENS_PER_MIN = int(os.getenv("SPECULATIVE_WASTE_TOKENS_PER_MIN", "20000"))  # 버려진 추측에 쓴 토큰 한도 (최근 1분)
+SPECULATIVE_HISTORY = int(os.getenv("SPECULATIVE_HISTORY", "200"))  # 예측에 쓰는 최근 판단 수
+
+SPECULATIVE_TYPES = ("guidance", "positive")  # 대상 학생이 없는 유형만 미리 생성
+SPECULATIVE_WARMUP = 20  # 판단이 이만큼 쌓이기 전에는 비율과 상관없이 미리 생성
+
+SPECULATION_SAVED_SECONDS = registry.histogram("chat_speculation_saved_seconds",
+                                               "미리 생성한 피드백을 쓴 경우 줄어든 대기 시간")
+
+
+class Speculation:
+    """판단과 동시에 생성 중인 피드백 한 건 (판단이 나올 때까지 조각을 모아 둠)"""
+
+    def __init__(self, intervention_type, prompt_tokens):
+        self.intervention_type = intervention_type
+        self.prompt_tokens = prompt_tokens  # 버려질 때 낭비 토큰 추정용
+        self.started = time.perf_counter()
+        self.finished = None
+        self.generated = []
+        self.task = None
+        self.usage = None
+        self.committed = False
+        self._pending = []
+        self._on_delta = None
+
+    async def collect(self, delta):
+        self.generated.append(delta)
+        if self._on_delta is None:
+            self._pending.append(delta)
+        else:
+            await self._on_delta(delta)
+
+    async def _attach(self, on_delta):
+        """모아 둔 조각을 한 번에 보내고 이후 조각은 바로 전달"""
+        while self._pending:
+            pending, self._pending = "".join(self._pending), []
+            await on_delta(pending)
+        self._on_delta = on_delta
+
+
+# ✅ 피드백 추측 생성
+class FeedbackSpeculator:
+    """
+    2단계 자동 개입에서 판단(judge)이 도는 동안 가장 가능성 높은 유형의 피드백을 미리 생성
+    - predict(): 최근 판단 중 positive/guidance 가운데 더 많은 유형
+      (판단이 SPECULATIVE_WARMUP개 이상 쌓였고 그 비율이 min_probability 미만이면 None)
+    - start(): 생성 시작 (최근 1분간 버린 토큰이 한도를 넘었으면 None)
+    - commit(): 판단이 예측과 같으면 미리 생성한 결과를 사용 (모아 둔 조각을 스트리밍으로 이어서 전송)
+    - cancel(): 판단이 다르면 취소하고 쓴 토큰을 낭비로 기록
+    """
+
+    def __init__(self, enabled=SPECULATIVE_FEEDBACK, min_probability=SPECULATIVE_MIN_PROBABILITY,
+                 waste_tokens_per_min=SPECULATIVE_WASTE_TOKENS_PER_MIN, history=SPECULATIVE_HISTORY):
+        self.enabled = enabled
+        self.min_probability = min_probability
+        self.waste_tokens_per_min = waste_tokens_per_min
+        self.decisions = deque(maxlen=history)
+        self._waste = deque()  # (시각, 토큰)
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped_budget = 0
+        self.skipped_unlikely = 0
+        self.wasted_tokens = 0
+        self.saved_seconds = 0.0
+
+    def record_decision(self, intervention_type):
+        self.decisions.append(intervention_type or "none")
+
+    def predict(self):
+        if not self.enabled:
+            return None
+        counts = Counter(self.decisions)
+        intervention_type = max(SPECULATIVE_TYPES, key=lambda kind: counts[kind])  # 같으면 guidance
+        if len(self.decisions) >= SPECULATIVE_WARMUP and counts[intervention_type] / len(self.decisions) < self.min_probability:
+            self.skipped_unlikely += 1
+            return None
+        return intervention_type
+
+    def _recent_waste(self):
+        horizon = time.monotonic() - 60
+        while self._waste and self._waste[0][0] < horizon:
+            self._waste.popleft()
+        return sum(tokens for _, tokens in self._waste)
+
+    def start(self, intervention_type, prompt_tokens, generate):
+        """generate(on_delta) → 피드백 텍스트 코루틴을 백그라운드로 시작"""
+        if self._recent_waste() + prompt_tokens > self.waste_tokens_per_min:
+            self.skipped_budget += 1
+            return None
+        speculation = Speculation(intervention_type, prompt_tokens)
+
+        async def run():
+            try:
+                with metered() as meter:
+                    return await generate(speculation.collect)
+            finally:
+                speculation.finished = time.perf_counter()
+                speculation.usage = meter
+
+        speculation.task = asyncio.get_running_loop().create_task(run())
+        self.started += 1
+        return speculation
+
+    async def commit(self, speculation, on_delta):
+        """판단이 예측과 같을 때 → 미리 생성한 피드백 (생성에 실패했으면 None, 적중이 아니라 miss로 기록)"""
+        speculation.committed = True
+        saved = (speculation.finished or time.perf_counter()) - speculation.started
+        if on_delta is not None:
+            await speculation._attach(on_delta)
+        try:
+            text = await speculation.task
+        except Exception as e:
+            logger.warning("⚠️ 미리 생성한 피드백 실패: %s", e)
+            text = None
+        if text is None:
+            # 호출한 쪽에서 다시 생성하므로 줄어든 대기 시간이 없음
+            self._record_miss(speculation)
+            return None
+        self.hits += 1
+        self.saved_seconds += saved
+        SPECULATION_SAVED_SECONDS.observe(saved)
+        logger.debug("🔮 미리 생성한 %s 피드백 사용 (%.2f초 절약)", speculation.intervention_type, saved)
+        return text
+
+    def cancel(self, speculation):
+        """판단이 예측과 다를 때 → 취소하고 낭비 토큰 기록 (이미 commit했으면 아무것도 하지 않음)"""
+        if speculation.committed:
+            return
+        speculation.committed = True
+        speculation.task.cancel()  # 게이트웨이가 취소된 호출의 자리와 토큰을 돌려줌
+        self._record_miss(speculation)
+
+    def _record_miss(self, speculation):
+        self.misses += 1
+        usage = speculation.usage
+        if usage is not None and usage.calls:
+            wasted = usage.prompt_tokens + usage.completion_tokens
+        else:
+            # 진행 중에 취소되었거나 실패하면 사용량이 없으므로 프롬프트 + 받은 조각으로 추정
+            wasted = speculation.prompt_tokens + count_tokens("".join(speculation.generated))
+        self.wasted_tokens += wasted
+        self._waste.append((time.monotonic(), wasted))
+
+    def stats(self):
+        decided = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / decided, 3) if decided else None,
+            "skipped_budget": self.skipped_budget,
+            "skipped_unlikely": self.skipped_unlikely,
+            "wasted_tokens": self.wasted_tokens,
+            "wasted_tokens_last_min": self._recent_waste(),
+            "saved_seconds": round(self.saved_seconds, 2),
+            "avg_saved_ms": round(self.saved_seconds / self.hits * 1000, 1) if self.hits else 0.0,
+        }
+
+    def collect(self):
+        """/metrics 수집 함수"""
+        return [
+            ("chat_speculation_total", "counter", "미리 생성한 피드백 결과 (hit: 사용, miss: 취소)",
+             {"result": "hit"}, self.hits),
+            ("chat_speculation_total", "counter", "미리 생성한 피드백 결과 (hit: 사용, miss: 취소)",
+             {"result": "miss"}, self.misses),
+            ("chat_speculation_skipped_total", "counter", "미리 생성하지 않은 판단 수", {"reason": "budget"},
+             self.skipped_budget),
+            ("chat_speculation_skipped_total", "counter", "미리 생성하지 않은 판단 수", {"reason": "unlikely"},
+             self.skipped_unlikely),
+            ("chat_speculation_wasted_tokens_total", "counter", "취소된 추측 생성에 쓴 토큰 수 (추정 포함)", {},
+             self.wasted_tokens),
+        ]
+
+
+speculator = FeedbackSpeculator()
+registry.add_collector(speculator.collect)
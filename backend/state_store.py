@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import uuid
+from log_utils import get_logger
+
+logger = get_logger("state_store")
+
+REDIS_URL = os.getenv("REDIS_URL")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "chat")
+# 워커별 Redis 연결 수 상한 - 다 쓰면 오류 대신 빈 연결을 기다림 (수업 시작/종료 때 수백 명이 한꺼번에 입장·퇴장)
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "10"))  # 빈 연결을 기다리는 시간(초)
+
+
+# ✅ 공유 상태 저장소 (접속 정보 + 자동 개입 버퍼)
+class InMemoryStateStore:
+    """
+    단일 프로세스용 상태 저장소 (기본값, 테스트용 가짜 저장소로도 사용)
+    - 세션: sid → (user_id, room_id)
+    - 방 연결: room_id → {sid: user_id}
+    - 사용자 연결: user_id → {sid: room_id} (여러 탭 접속 지원)
+    - 방 참여자: room_id → {user_id: 접속 수}
+    - 자동 개입 버퍼: room_id → [messages]
+    - 방 잠금: 방별 자동 개입을 한 번에 하나만 실행하기 위한 잠금
+    - 대화 요약: room_id → 오래된 대화의 누적 요약 (GPT 맥락용, TTL)
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._members = {}
+        self._user_sids = {}  # user_id → {sid: room_id} (여러 탭 접속)
+        self._participants = {}  # room_id → {user_id: 접속 수} (참여 순서 유지)
+        self._buffers = {}
+        self._locks = {}  # room_id → (token, expires_at)
+        self._summaries = {}  # room_id → (data, expires_at)
+
+    # ─────────── 접속 정보
+    async def set_session(self, sid, user_id, room_id):
+        """세션 등록, 이 사용자의 방 첫 접속이면 True"""
+        await self.remove_session(sid)
+        self._sessions[sid] = (user_id, room_id)
+        self._members.setdefault(room_id, {})[sid] = user_id
+        if not user_id:
+            return False
+        self._user_sids.setdefault(user_id, {})[sid] = room_id
+        participants = self._participants.setdefault(room_id, {})
+        participants[user_id] = participants.get(user_id, 0) + 1
+        return participants[user_id] == 1
+
+    async def get_session(self, sid):
+        return self._sessions.get(sid)
+
+    async def remove_session(self, sid):
+        """세션 제거, (user_id, room_id, 이 사용자의 방 남은 접속 수) 또는 None"""
+        session = self._sessions.pop(sid, None)
+        if not session:
+            return None
+        user_id, room_id = session
+        members = self._members.get(room_id, {})
+        members.pop(sid, None)
+        if not members:
+            self._members.pop(room_id, None)
+        if not user_id:
+            return user_id, room_id, 0
+
+        sids = self._user_sids.get(user_id, {})
+        sids.pop(sid, None)
+        if not sids:
+            self._user_sids.pop(user_id, None)
+        participants = self._participants.get(room_id, {})
+        remaining = participants.get(user_id, 1) - 1
+        if remaining > 0:
+            participants[user_id] = remaining
+        else:
+            participants.pop(user_id, None)
+            if not participants:
+                self._participants.pop(room_id, None)
+        return user_id, room_id, max(remaining, 0)
+
+    async def room_members(self, room_id):
+        """[(sid, user_id), ...]"""
+        return list(self._members.get(room_id, {}).items())
+
+    async def room_participants(self, room_id):
+        """방에 접속한 사용자 ID 목록 (여러 탭이어도 한 번만)"""
+        return list(self._participants.get(room_id, {}))
+
+    async def room_size(self, room_id):
+        return len(self._members.get(room_id, {}))
+
+    async def user_sessions(self, user_id):
+        """[(sid, room_id), ...]"""
+        return list(self._user_sids.get(user_id, {}).items())
+
+    async def room_count(self):
+        return len(self._members)
+
+    async def session_count(self):
+        return len(self._sessions)
+
+    # ─────────── 자동 개입 버퍼
+    async def append_message(self, room_id, message):
+        buffer = self._buffers.setdefault(room_id, [])
+        buffer.append(message)
+        return len(buffer)
+
+    async def buffer_length(self, room_id):
+        return len(self._buffers.get(room_id, []))
+
+    async def take_messages(self, room_id):
+        return self._buffers.pop(room_id, [])
+
+    async def clear_messages(self, room_id):
+        self._buffers.pop(room_id, None)
+
+    async def buffer_stats(self):
+        return {"rooms_buffering": len(self._buffers),
+                "buffered_messages": sum(len(b) for b in self._buffers.values())}
+
+    # ─────────── 방 잠금
+    async def acquire_room_lock(self, room_id, ttl):
+        token = uuid.uuid4().hex
+        current = self._locks.get(room_id)
+        if current and current[1] > time.monotonic():
+            return None
+        self._locks[room_id] = (token, time.monotonic() + ttl)
+        return token
+
+    async def release_room_lock(self, room_id, token):
+        current = self._locks.get(room_id)
+        if current and current[0] == token:
+            self._locks.pop(room_id, None)
+
+    # ─────────── 방별 대화 요약
+    async def get_room_summary(self, room_id):
+        entry = self._summaries.get(room_id)
+        if not entry:
+            return None
+        if entry[1] <= time.monotonic():
+            self._summaries.pop(room_id, None)
+            return None
+        return entry[0]
+
+    async def set_room_summary(self, room_id, data, ttl):
+        self._summaries[room_id] = (data, time.monotonic() + ttl)
+
+    async def close(self):
+        pass
+
+
+class RedisStateStore:
+    """
+    여러 워커/노드가 공유하는 Redis 기반 상태 저장소
+    - InMemoryStateStore와 같은 메서드를 제공하므로 REDIS_URL 설정만으로 교체됩니다.
+    """
+
+    # 토큰이 일치할 때만 잠금 해제
+    _RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url, prefix=STATE_KEY_PREFIX):
+        import redis.asyncio as redis
+
+        pool = redis.BlockingConnectionPool.from_url(url, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS,
+                                                     timeout=REDIS_POOL_TIMEOUT)
+        self.redis = redis.Redis(connection_pool=pool)
+        self.prefix = prefix
+
+    def _key(self, *parts):
+        return ":".join((self.prefix, *parts))
+
+    # ─────────── 접속 정보
+    async def set_session(self, sid, user_id, room_id):
+        await self.remove_session(sid)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._key("sessions"), sid, json.dumps([user_id, room_id]))
+        pipe.hset(self._key("room", room_id, "members"), sid, user_id or "")
+        pipe.sadd(self._key("rooms"), room_id)
+        if user_id:
+            pipe.hset(self._key("user", user_id, "sids"), sid, room_id)
+            pipe.hincrby(self._key("room", room_id, "participants"), user_id, 1)
+        results = await pipe.execute()
+        return bool(user_id) and results[-1] == 1
+
+    async def get_session(self, sid):
+        raw = await self.redis.hget(self._key("sessions"), sid)
+        return tuple(json.loads(raw)) if raw else None
+
+    async def remove_session(self, sid):
+        session = await self.get_session(sid)
+        if not session:
+            return None
+        user_id, room_id = session
+        members_key = self._key("room", room_id, "members")
+        participants_key = self._key("room", room_id, "participants")
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hdel(self._key("sessions"), sid)
+        pipe.hdel(members_key, sid)
+        pipe.hlen(members_key)
+        if user_id:
+            pipe.hdel(self._key("user", user_id, "sids"), sid)
+            pipe.hincrby(participants_key, user_id, -1)
+        results = await pipe.execute()
+        remaining = max(results[-1], 0) if user_id else 0
+        if user_id and remaining == 0:
+            await self.redis.hdel(participants_key, user_id)
+        if not results[2]:
+            await self.redis.srem(self._key("rooms"), room_id)
+        return user_id, room_id, remaining
+
+    async def room_members(self, room_id):
+        members = await self.redis.hgetall(self._key("room", room_id, "members"))
+        return [(sid, user_id or None) for sid, user_id in members.items()]
+
+    async def room_participants(self, room_id):
+        return list(await self.redis.hkeys(self._key("room", room_id, "participants")))
+
+    async def room_size(self, room_id):
+        return await self.redis.hlen(self._key("room", room_id, "members"))
+
+    async def user_sessions(self, user_id):
+        sids = await self.redis.hgetall(self._key("user", user_id, "sids"))
+        return list(sids.items())
+
+    async def room_count(self):
+        return await self.redis.scard(self._key("rooms"))
+
+    async def session_count(self):
+        return await self.redis.hlen(self._key("sessions"))
+
+    # ─────────── 자동 개입 버퍼
+    async def append_message(self, room_id, message):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(self._key("room", room_id, "buffer"), json.dumps(message, ensure_ascii=False))
+        pipe.sadd(self._key("buffers"), room_id)
+        length, _ = await pipe.execute()
+        return length
+
+    async def buffer_length(self, room_id):
+        return await self.redis.llen(self._key("room", room_id, "buffer"))
+
+    async def take_messages(self, room_id):
+        key = self._key("room", room_id, "buffer")
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        pipe.srem(self._key("buffers"), room_id)
+        raw, _, _ = await pipe.execute()
+        return [json.loads(item) for item in raw]
+
+    async def clear_messages(self, room_id):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self._key("room", room_id, "buffer"))
+        pipe.srem(self._key("buffers"), room_id)
+        await pipe.execute()
+
+    async def buffer_stats(self):
+        rooms = await self.redis.smembers(self._key("buffers"))
+        total = 0
+        for room_id in rooms:
+            total += await self.buffer_length(room_id)
+        return {"rooms_buffering": len(rooms), "buffered_messages": total}
+
+    # ─────────── 방 잠금
+    async def acquire_room_lock(self, room_id, ttl):
+        token = uuid.uuid4().hex
+        ok = await self.redis.set(self._key("room", room_id, "lock"), token, nx=True, px=int(ttl * 1000))
+        return token if ok else None
+
+    async def release_room_lock(self, room_id, token):
+        await self.redis.eval(self._RELEASE_SCRIPT, 1, self._key("room", room_id, "lock"), token)
+
+    # ─────────── 방별 대화 요약
+    async def get_room_summary(self, room_id):
+        raw = await self.redis.get(self._key("room", room_id, "summary"))
+        return json.loads(raw) if raw else None
+
+    async def set_room_summary(self, room_id, data, ttl):
+        await self.redis.set(self._key("room", room_id, "summary"), json.dumps(data, ensure_ascii=False),
+                             px=int(ttl * 1000))
+
+    async def close(self):
+        await self.redis.aclose()
+        await self.redis.connection_pool.disconnect()  # 직접 만든 풀은 aclose가 닫지 않음
+
+
+def create_state_store(url=REDIS_URL):
+    """REDIS_URL이 있으면 Redis 저장소, 없으면 프로세스 내부 저장소"""
+    if url:
+        logger.info("🔗 공유 상태 저장소: Redis (%s)", url.split("@")[-1])
+        return RedisStateStore(url)
+    return InMemoryStateStore()
+
+
+def create_client_manager(url=REDIS_URL):
+    """REDIS_URL이 있으면 노드 간 emit을 중계하는 AsyncRedisManager, 없으면 None(기본 매니저)"""
+    if not url:
+        return None
+    from socketio import AsyncRedisManager
+
+    return AsyncRedisManager(url)
+
+
+# 앱 전체가 공유하는 상태 저장소
+state_store = create_state_store()
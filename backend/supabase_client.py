@@ -1,76 +1,52 @@
 import os
-import requests
-import aiohttp
-import json
+import asyncio
 from dotenv import load_dotenv
-from datetime import datetime
+from cache_utils import TTLCache
+from supabase_repo import repo, SupabaseError, visible_to, all_of
+from message_queue import message_queue
+from room_tail import room_tails
+from log_utils import get_logger
 
 # 환경변수 로드
 load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_API_KEY")
+logger = get_logger("supabase")
 
-HEADERS = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Content-Type": "application/json",
-    "Prefer": "return=minimal"
-}
+DEFAULT_SYSTEM_PROMPT = "이 채팅방에는 특별한 목적이 없습니다. 일반적인 대화를 이어가세요."
 
-# ✅ 비동기 Supabase 요청 헬퍼 함수
-async def make_supabase_request(method, url, data=None):
+# ✅ 학생 이름 캐시 (모든 방이 공유)
+STUDENT_NAME_CACHE_SIZE = int(os.getenv("STUDENT_NAME_CACHE_SIZE", "5000"))
+STUDENT_NAME_CACHE_TTL = float(os.getenv("STUDENT_NAME_CACHE_TTL", "600"))
+STUDENT_NAME_NEGATIVE_TTL = 60  # DB에 없는 ID는 짧게만 캐시 (새로 추가된 학생 반영)
+student_name_cache = TTLCache(maxsize=STUDENT_NAME_CACHE_SIZE, ttl=STUDENT_NAME_CACHE_TTL)
+_pending_names = {}  # 조회 중인 학생 ID → 이름 Future (수업 시작 때 같은 학생을 여러 번 조회하지 않도록)
+
+# ✅ 방 → (topic_id, system_prompt) 캐시 (방이 살아있는 동안 유지, 주제 수정 시 무효화)
+ROOM_PROMPT_CACHE_SIZE = int(os.getenv("ROOM_PROMPT_CACHE_SIZE", "2000"))
+room_prompt_cache = TTLCache(maxsize=ROOM_PROMPT_CACHE_SIZE, ttl=None)
+
+# ✅ 저장이 끝난 메시지는 방별 최근 메시지 꼬리에도 추가
+message_queue.listeners.append(room_tails.commit)
+
+# ✅ 메시지 저장 (write-behind 큐)
+def enqueue_message(room_id, sender_id, message, role="user", timestamp=None, whisper_to=None, reasoning=None):
     """
-    비동기적으로 Supabase API 요청을 수행하는 함수
-    - method: HTTP 메서드 (GET, POST, PUT, DELETE 등)
-    - url: 요청 URL
-    - data: 요청 데이터 (있는 경우)
+    ✅ 메시지를 write-behind 큐에 넣고 바로 반환하는 함수
+    - 반환값: 저장이 끝나면 저장된 행(message_id 포함)을, 실패하면 None을 돌려주는 Future
+    - 브로드캐스트를 먼저 하고 저장은 뒤에서 묶어서 처리할 때 사용합니다.
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            if method == "GET":
-                async with session.get(url, headers=HEADERS) as response:
-                    if response.status in (200, 201, 204):
-                        return await response.json()
-                    else:
-                        error_text = await response.text()
-                        print(f"❌ Supabase API 오류 ({method} {url}): {error_text}")
-                        return None
-            elif method == "POST":
-                async with session.post(url, headers=HEADERS, json=data) as response:
-                    if response.status in (200, 201, 204):
-                        # 응답에 따라 JSON 또는 ID 값 반환
-                        try:
-                            return await response.json()
-                        except:
-                            return {"id": response.headers.get("Location", "").split("/")[-1]}
-                    else:
-                        error_text = await response.text()
-                        print(f"❌ Supabase API 오류 ({method} {url}): {error_text}")
-                        return None
-            elif method == "PUT":
-                async with session.put(url, headers=HEADERS, json=data) as response:
-                    if response.status in (200, 201, 204):
-                        return await response.json()
-                    else:
-                        error_text = await response.text()
-                        print(f"❌ Supabase API 오류 ({method} {url}): {error_text}")
-                        return None
-            elif method == "DELETE":
-                async with session.delete(url, headers=HEADERS) as response:
-                    if response.status in (200, 201, 204):
-                        return await response.json()
-                    else:
-                        error_text = await response.text()
-                        print(f"❌ Supabase API 오류 ({method} {url}): {error_text}")
-                        return None
-    except Exception as e:
-        print(f"❌ Supabase 요청 오류: {e}")
-        return None
+    return message_queue.enqueue({
+        "room_id": room_id,
+        "sender_id": sender_id,
+        "message": message,
+        "role": role,
+        "timestamp": timestamp,
+        "whisper_to": whisper_to or None,
+        "reasoning": reasoning or None,
+    })
 
-# ✅ 메시지 저장
 async def save_message_to_db(room_id, sender_id, message, role="user", timestamp=None, whisper_to=None, reasoning=None):
     """
-    ✅ 메시지를 Supabase의 messages 테이블에 저장하는 함수
+    ✅ 메시지를 Supabase의 messages 테이블에 저장하는 함수 (저장 완료까지 대기)
     - room_id: 방 ID (필수)
     - sender_id: 발신자 ID (필수)
     - message: 메시지 내용 (필수)
@@ -80,134 +56,215 @@ async def save_message_to_db(room_id, sender_id, message, role="user", timestamp
     - reasoning: GPT의 판단 이유 (assistant 역할일 때만 사용)
     """
     try:
-        # 메시지 데이터 구성
-        data = {
-            "room_id": room_id,
-            "sender_id": sender_id,
-            "message": message,
-            "role": role
-        }
-
-        # timestamp 파라미터가 있으면 사용, 없으면 현재 시간
-        if timestamp:
-            data["timestamp"] = timestamp
-            
-        # whisper_to 값이 있는 경우 추가
-        if whisper_to:
-            data["whisper_to"] = whisper_to
-            
-        # reasoning 값이 있는 경우 추가
-        if reasoning:
-            data["reasoning"] = reasoning
-
-        url = f"{SUPABASE_URL}/rest/v1/messages"
-        
-        # Prefer 헤더를 수정하여 삽입된 레코드를 반환하도록 함
-        local_headers = HEADERS.copy()
-        local_headers["Prefer"] = "return=representation"
-        
-        # 직접 aiohttp로 요청 처리
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=local_headers, json=data) as response:
-                if response.status in (200, 201, 204):
-                    response_data = await response.json()
-                    print(f"✅ 메시지 저장 성공: {response_data}")
-                    return response_data[0] if isinstance(response_data, list) else response_data
-                else:
-                    error_text = await response.text()
-                    print(f"❌ Supabase API 오류 (POST {url}): {error_text}")
-                    return None
+        saved = await enqueue_message(room_id, sender_id, message, role, timestamp, whisper_to, reasoning)
+        if saved is None:
+            logger.error("❌ 메시지 저장 실패")
+        return saved
     except Exception as e:
-        print(f"❌ 메시지 저장 오류: {e}")
+        logger.error("❌ 메시지 저장 오류: %s", e)
         return None
 
 # ✅ 대화 기록 불러오기 (화자 포함)
-async def get_room_history(room_id, limit=500, offset=0):
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 500
+_ALL = object()  # get_room_history: 귓속말 필터 없음
+
+def _cursor_of(message):
+    """메시지의 페이지 커서 (timestamp, message_id) - 같은 시각의 메시지도 순서가 정해짐"""
+    return {"timestamp": message["timestamp"], "message_id": message["message_id"]}
+
+async def _load_tail(room_id, size):
+    """방별 최근 메시지 꼬리를 채울 최근 size개 (귓속말 포함, 꼬리에서 보는 사람별로 거름)"""
+    return await repo.list_messages(room_id, order="timestamp.desc,message_id.desc", limit=size)
+
+async def get_room_history(room_id, limit=HISTORY_PAGE_SIZE, before=None, since_message_id=None, viewer_id=_ALL):
     """
-    특정 채팅방의 메시지 기록을 가져옵니다. 
-    시간순으로 정렬되어 반환됩니다.
-    limit: 최대 메시지 수 (기본값 500개로 증가)
-    offset: 미사용 (페이지네이션 제거)
+    특정 채팅방의 메시지 기록을 (timestamp, message_id) 키셋 페이지 단위로 가져옵니다.
+    시간순(오래된→최신)으로 정렬되어 반환됩니다.
+    - limit: 한 페이지 메시지 수 (최대 500)
+    - before: 이 커서({"timestamp", "message_id"})보다 이전 메시지 페이지 (무한 스크롤)
+    - since_message_id: 이 메시지 이후에 저장된 메시지 (재접속 시 증분 동기화)
+    - 둘 다 없으면 가장 최근 페이지
+    - viewer_id: 이 학생이 볼 수 있는 메시지만 (전체 + 본인 귓속말, 쿼리에서 필터링)
+      None이면 방 전체 메시지만, 생략하면 필터 없음 (GPT 맥락 등 서버 내부용)
+    - pagination.next_cursor: 다음(더 이전) 페이지 요청에 쓸 커서, has_more: 남은 메시지 여부
+    - 최근 페이지와 since 동기화는 방별 최근 메시지 꼬리(room_tail)로 답할 수 있으면 DB를 조회하지 않습니다.
     """
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+    mode = "since" if since_message_id is not None else "before" if before else "latest"
+    visibility = visible_to(viewer_id) if viewer_id is not _ALL else None
+    viewer, all_rows = (None, True) if viewer_id is _ALL else (viewer_id, False)
     try:
-        # 페이지네이션 없이 한 번에 모든 메시지 가져오기
-        url = f"{SUPABASE_URL}/rest/v1/messages?room_id=eq.{room_id}&select=message_id,message,role,sender_id,timestamp,whisper_to,reasoning&order=timestamp.desc&limit={limit}"
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=HEADERS) as response:
-                if response.status != 200:
-                    print(f"❌ 채팅 기록 조회 실패: {await response.text()}")
-                    return {"messages": [], "pagination": {"total": 0, "offset": 0, "limit": limit, "has_more": False}}
-                
-                result = await response.json()
-                # 역순으로 가져온 메시지를 다시 시간순(오래된→최신)으로 정렬
-                sorted_messages = sorted(result, key=lambda x: x.get('timestamp', ''))
-                
-                # 이름 필드 추가 - 별도로 가져와서 추가
-                for msg in sorted_messages:
-                    if msg["sender_id"] != "gpt":
-                        msg["name"] = get_student_name(msg["sender_id"])
-                
-                # 간소화된 페이지네이션 정보 반환 (has_more는 항상 False)
-                return {
-                    "messages": sorted_messages,
-                    "pagination": {
-                        "total": len(sorted_messages),
-                        "offset": 0,
-                        "limit": limit,
-                        "has_more": False
-                    }
-                }
-                
+        # 최근 페이지와 재접속 동기화는 방별 최근 메시지 꼬리에서 먼저 찾음 (없으면 None → DB 조회)
+        served = None
+        if mode == "latest":
+            served = await room_tails.latest(room_id, limit, viewer, all_rows, lambda n: _load_tail(room_id, n))
+        elif mode == "since":
+            served = await room_tails.since(room_id, int(since_message_id), limit, viewer, all_rows,
+                                            lambda n: _load_tail(room_id, n))
+
+        # limit + 1개를 가져와 다음 페이지 존재 여부 판단
+        if served is not None:
+            page, has_more = served
+        elif mode == "since":
+            # 재접속 동기화는 놓친 메시지가 없어야 하므로 최근 응답을 재사용하지 않음
+            rows = await repo.list_messages(
+                room_id, order="message_id.asc", limit=limit + 1, fresh=True,
+                message_id=f"gt.{int(since_message_id)}", **all_of(visibility)
+            )
+            has_more = len(rows) > limit
+            page = sorted(rows[:limit], key=lambda m: (m["timestamp"], m["message_id"]))
+        else:
+            keyset = None
+            if mode == "before":
+                ts, message_id = before["timestamp"], int(before["message_id"])
+                keyset = f'or(timestamp.lt."{ts}",and(timestamp.eq."{ts}",message_id.lt.{message_id}))'
+            rows = await repo.list_messages(
+                room_id, order="timestamp.desc,message_id.desc", limit=limit + 1,
+                **all_of(keyset, visibility)
+            )
+            has_more = len(rows) > limit
+            # 역순으로 가져온 메시지를 다시 시간순(오래된→최신)으로 정렬
+            page = list(reversed(rows[:limit]))
+
+        # 이름 필드 추가 - 한 번의 쿼리로 캐시를 채운 뒤 캐시에서 조회
+        await prefill_student_names(m["sender_id"] for m in page)
+        for msg in page:
+            if msg["sender_id"] != "gpt":
+                msg["name"] = await get_student_name(msg["sender_id"])
+
+        return {
+            "messages": page,
+            "pagination": {
+                "mode": mode,
+                "limit": limit,
+                "has_more": has_more,
+                # latest/before: 이전 페이지 커서, since: 이어서 동기화할 마지막 message_id
+                "next_cursor": _cursor_of(page[0]) if page and mode != "since" else None,
+                "last_message_id": max((m["message_id"] for m in page), default=since_message_id),
+            }
+        }
+
     except Exception as e:
-        print(f"❌ 대화 기록 로딩 오류: {e}")
-        return {"messages": [], "pagination": {"total": 0, "offset": 0, "limit": limit, "has_more": False}}
+        logger.error("❌ 대화 기록 로딩 오류: %s", e)
+        return {"messages": [], "pagination": {"mode": mode, "limit": limit, "has_more": False,
+                                                "next_cursor": None, "last_message_id": since_message_id}}
 
 # ✅ system_prompt 가져오기
 async def get_system_prompt(room_id):
     """
     채팅방에 연결된 시스템 프롬프트를 가져옵니다.
+    rooms?select=topic_id,topics(system_prompt) 한 번의 조회로 가져와 방 단위로 캐시합니다.
     """
-    url = f"{SUPABASE_URL}/rest/v1/rooms?room_id=eq.{room_id}&select=topic_id"
-    res = requests.get(url, headers=HEADERS)
-    if res.status_code != 200 or not res.json():
-        print(f"❌ 채팅방 정보 조회 실패: {res.text}")
-        return "이 채팅방에는 특별한 목적이 없습니다. 일반적인 대화를 이어가세요."
+    cached = room_prompt_cache.get(room_id)
+    if cached is not None:
+        return cached["system_prompt"]
+
+    try:
+        room = await repo.get_room_prompt(room_id)
+    except SupabaseError as e:
+        logger.error("❌ 시스템 프롬프트 조회 실패: %s", e)
+        return DEFAULT_SYSTEM_PROMPT
 
-    topic_id = res.json()[0]["topic_id"]
-    url = f"{SUPABASE_URL}/rest/v1/topics?topic_id=eq.{topic_id}&select=system_prompt"
-    res = requests.get(url, headers=HEADERS)
-    if res.status_code != 200 or not res.json():
-        print(f"❌ 토픽 정보 조회 실패: {res.text}")
-        return "이 채팅방에는 특별한 목적이 없습니다. 일반적인 대화를 이어가세요."
+    if not room:
+        logger.error("❌ 채팅방 정보 조회 실패: %s", room_id)
+        return DEFAULT_SYSTEM_PROMPT
 
-    return res.json()[0]["system_prompt"]
+    topic = room.get("topics")
+    if not topic or not topic.get("system_prompt"):
+        logger.error("❌ 토픽 정보 조회 실패: %s", room.get("topic_id"))
+        return DEFAULT_SYSTEM_PROMPT
 
+    room_prompt_cache.set(room_id, {"topic_id": room["topic_id"], "system_prompt": topic["system_prompt"]})
+    return topic["system_prompt"]
 
-def get_student_name(student_id):
+async def get_room_topic_id(room_id):
+    """방의 주제 ID (get_system_prompt와 같은 방별 캐시를 씀, 주제를 찾지 못하면 None)"""
+    await get_system_prompt(room_id)
+    cached = room_prompt_cache.get(room_id)
+    return cached["topic_id"] if cached else None
+
+def invalidate_topic_prompt(topic_id):
+    """
+    교사가 주제(system_prompt)를 수정했을 때 해당 주제를 쓰는 모든 방의 캐시를 비웁니다.
+    """
+    return room_prompt_cache.pop_where(lambda _, entry: entry["topic_id"] == topic_id)
+
+def release_room_prompt(room_id):
+    """
+    방에 남은 참여자가 없을 때 호출하여 방의 프롬프트 캐시와 최근 메시지 꼬리를 내려놓습니다.
+    """
+    room_prompt_cache.pop(room_id)
+    room_tails.release(room_id)
+
+
+async def _load_student_names(ids):
+    """
+    students?student_id=in.(...) 한 번의 요청으로 이름을 조회해 캐시에 채우고 {ID: 이름}을 반환합니다.
+    조회가 끝날 때까지 ID별 Future를 _pending_names에 올려 두어, 그사이 같은 학생을 찾는 호출이 이 결과를 기다리게 합니다.
+    """
+    loop = asyncio.get_running_loop()
+    futures = {sid: loop.create_future() for sid in ids} if repo.coalesce_reads else {}
+    _pending_names.update(futures)
+    names = {}
+    try:
+        rows = await repo.get_students(ids)
+        names = {row["student_id"]: row.get("name") or row["student_id"] for row in rows}
+        for sid in ids:
+            if sid in names:
+                student_name_cache.set(sid, names[sid])
+            else:
+                # DB에 없는 ID는 ID 자체를 이름으로 짧게 캐시 (반복 조회 방지, 새로 추가된 학생 반영)
+                student_name_cache.set(sid, sid, ttl=STUDENT_NAME_NEGATIVE_TTL)
+    except Exception as e:
+        logger.error("❌ 학생 이름 조회 실패: %s", e)
+    finally:
+        for sid, future in futures.items():
+            if _pending_names.get(sid) is future:
+                del _pending_names[sid]
+            future.set_result(names.get(sid, sid))
+    return names
+
+async def get_student_name(student_id):
     """
     학생 ID에 해당하는 이름을 가져옵니다.
+    캐시에 있으면 캐시 값을, 같은 학생을 조회 중이면 그 결과를, 없으면 Supabase에서 조회한 뒤 캐시에 저장합니다.
+    조회에 실패하면 학생 ID를 그대로 돌려줍니다.
     """
     if not student_id or student_id == "gpt":
         return None
 
-    url = f"{SUPABASE_URL}/rest/v1/students?student_id=eq.{student_id}&select=name"
-    res = requests.get(url, headers=HEADERS)
-    if res.status_code != 200 or not res.json():
-        print(f"❌ 학생 정보 조회 실패: {res.text}")
-        return student_id
+    cached = student_name_cache.get(student_id)
+    if cached is not None:
+        return cached
 
-    name = res.json()[0]["name"]
-    return name if name else student_id
+    pending = _pending_names.get(student_id)
+    if pending is not None:
+        return await asyncio.shield(pending)
 
-def save_evaluation_result(topic_id, target_student, feedback):
-    from supabase import create_client
-    import os
+    names = await _load_student_names([student_id])
+    return names.get(student_id, student_id)
 
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    supabase = create_client(url, key)
+async def prefill_student_names(student_ids):
+    """
+    여러 학생의 이름을 students?student_id=in.(...) 한 번의 요청으로 가져와 캐시에 채웁니다.
+    이미 캐시에 있거나 다른 호출이 조회 중인 ID는 다시 조회하지 않습니다.
+    """
+    ids = {sid for sid in student_ids if sid and sid != "gpt"}
+    missing = [sid for sid in student_name_cache.missing(ids) if sid not in _pending_names]
+    if missing:
+        await _load_student_names(missing)
 
+def invalidate_student_name(student_id=None):
+    """
+    학생 이름 캐시를 무효화합니다. student_id가 없으면 전체를 비웁니다.
+    """
+    if student_id:
+        student_name_cache.pop(student_id)
+    else:
+        student_name_cache.clear()
+
+async def save_evaluation_result(topic_id, target_student, feedback):
     data = {
         "topic_id": topic_id,
         "target_student": target_student,
@@ -215,10 +272,10 @@ def save_evaluation_result(topic_id, target_student, feedback):
     }
 
     try:
-        res = supabase.table("evaluations").insert(data).execute()
-        print("✅ 평가 결과 저장 완료")
+        await repo.insert_legacy_evaluation(data)
+        logger.info("✅ 평가 결과 저장 완료")
     except Exception as e:
-        print("❌ 평가 결과 저장 실패:", e)
+        logger.error("❌ 평가 결과 저장 실패: %s", e)
 
 async def save_gpt_intervention(room_id, message_id, intervention_type, target_student=None, reasoning=None):
     """
@@ -235,17 +292,14 @@ async def save_gpt_intervention(room_id, message_id, intervention_type, target_s
             "message_id": message_id,
             "intervention_type": intervention_type,
         }
-        
+
         if target_student:
             data["target_student"] = target_student
-            
+
         if reasoning:
             data["reasoning"] = reasoning
-            
-        url = f"{SUPABASE_URL}/rest/v1/gpt_interventions"
-        response = await make_supabase_request("POST", url, data)
-        
-        return response
+
+        return await repo.insert_gpt_intervention(data)
     except Exception as e:
-        print(f"❌ GPT 개입 로그 저장 오류: {e}")
-        return None
\ No newline at end of file
+        logger.error("❌ GPT 개입 로그 저장 오류: %s", e)
+        return None
@@ -0,0 +1,325 @@
+import os
+import json as jsonlib
+import asyncio
+import aiohttp
+from typing import Any, Iterable, Optional
+from dotenv import load_dotenv
+from cache_utils import TTLCache
+from metrics import span
+
+# 환경변수 로드
+load_dotenv()
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_API_KEY")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "100"))
+SUPABASE_KEEPALIVE = float(os.getenv("SUPABASE_KEEPALIVE", "30"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+# 전체 조회의 한 페이지 행 수 - PostgREST는 응답을 max-rows(Supabase 기본 1000)로 자르므로 이보다 크게 잡아도 소용없음
+SUPABASE_PAGE_SIZE = int(os.getenv("SUPABASE_PAGE_SIZE", "1000"))
+
+# 같은 GET 요청 합치기 + 결과 잠깐 재사용 (수업 시작 때 30명이 동시에 같은 방 기록/프롬프트를 조회하는 경우)
+SUPABASE_COALESCE_READS = os.getenv("SUPABASE_COALESCE_READS", "true").lower() in ("1", "true", "yes")
+SUPABASE_READ_CACHE_TTL = float(os.getenv("SUPABASE_READ_CACHE_TTL", "0.5"))  # 초, 0이면 동시 요청 합치기만
+SUPABASE_READ_CACHE_SIZE = int(os.getenv("SUPABASE_READ_CACHE_SIZE", "256"))
+
+Row = dict[str, Any]
+
+
+class SupabaseError(Exception):
+    """PostgREST가 2xx 이외의 응답을 돌려준 경우"""
+
+    def __init__(self, status: int, detail: str, method: str = "", path: str = ""):
+        super().__init__(f"{method} {path} → {status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+def in_filter(values: Iterable[str]) -> str:
+    """PostgREST in.(...) 필터 문자열 생성"""
+    return "in.(" + ",".join(f'"{v}"' for v in values) + ")"
+
+
+def visible_to(viewer_id: Optional[str]) -> str:
+    """
+    귓속말 공개 범위 조건 (whisper_to is null or whisper_to = viewer)
+    - or=(...) 또는 and=(...) 안에 넣을 수 있는 논리 조건 문자열
+    - viewer_id가 없으면 방 전체 메시지만
+    """
+    if not viewer_id:
+        return "whisper_to.is.null"
+    return f'or(whisper_to.is.null,whisper_to.eq."{viewer_id}")'
+
+
+def all_of(*conditions: str) -> dict:
+    """여러 논리 조건을 하나의 and=(...) 쿼리 파라미터로 묶음 (PostgREST는 같은 or 키를 두 번 받지 않음)"""
+    conditions = [c for c in conditions if c]
+    return {"and": f"({','.join(conditions)})"} if conditions else {}
+
+
+# ✅ Supabase(PostgREST) 비동기 데이터 접근 계층
+class SupabaseRepository:
+    """
+    하나의 커넥션 풀(aiohttp.ClientSession)을 앱 전체가 공유하는 Supabase 저장소
+    - 앱 시작 시 start(), 종료 시 close()를 호출합니다.
+    - start() 전에 호출되면 세션을 지연 생성합니다. (스크립트/벤치마크용)
+    - 모든 테이블 접근은 이 클래스의 메서드를 통해서만 이루어집니다.
+    - 동시에 들어온 같은 GET 요청은 하나의 HTTP 요청으로 합치고(single-flight),
+      응답 본문을 read_cache_ttl초 동안 재사용합니다. (호출마다 JSON을 새로 파싱하므로 결과 공유 없음)
+      같은 테이블에 쓰기가 끝나면 그 테이블의 재사용 본문은 버립니다.
+    """
+
+    def __init__(self, base_url=SUPABASE_URL, api_key=SUPABASE_KEY, service_key=SUPABASE_SERVICE_KEY,
+                 pool_size=SUPABASE_POOL_SIZE, keepalive_timeout=SUPABASE_KEEPALIVE, timeout=SUPABASE_TIMEOUT,
+                 coalesce_reads=SUPABASE_COALESCE_READS, read_cache_ttl=SUPABASE_READ_CACHE_TTL,
+                 read_cache_size=SUPABASE_READ_CACHE_SIZE):
+        self.base_url = (base_url or "").rstrip("/")
+        self.api_key = api_key
+        self.service_key = service_key or api_key
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+        self.coalesce_reads = coalesce_reads
+        self.read_cache_ttl = read_cache_ttl
+        self._recent = TTLCache(maxsize=read_cache_size, ttl=read_cache_ttl)  # 요청 키 → 응답 본문
+        self._in_flight: dict[tuple, asyncio.Task] = {}  # 요청 키 → 진행 중인 GET
+        self._generations: dict[str, int] = {}  # 테이블 → 쓰기 횟수 (쓰기 이후의 읽기는 새로 요청)
+        self.read_stats = {"fetched": 0, "coalesced": 0, "cached": 0}
+
+    # ─────────── 세션 수명 관리
+    async def start(self):
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                # keep-alive 커넥션을 재사용해 요청마다 TCP+TLS 핸드셰이크를 하지 않도록 함
+                connector = aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=300,
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=self.timeout),
+                )
+        return self
+
+    async def close(self):
+        async with self._lock:
+            if self._session is not None and not self._session.closed:
+                await self._session.close()
+            self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def _headers(self, service=False, prefer=None):
+        key = (self.service_key if service else self.api_key) or ""
+        headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+        if prefer:
+            headers["Prefer"] = prefer
+        return headers
+
+    async def request(self, method: str, table: str, params=None, json=None, prefer=None, service=False,
+                      fresh=False):
+        """
+        PostgREST 요청 공통 처리
+        - 2xx 응답이면 JSON(없으면 None)을 반환하고, 그 외에는 SupabaseError를 발생시킵니다.
+        - 소요 시간은 chat_span_seconds{kind="supabase", name="<method> <table>"}에 기록됩니다.
+        - GET은 진행 중인 같은 요청이 있으면 그 응답을 함께 기다리고,
+          fresh가 아니면 최근 응답 본문(read_cache_ttl초 이내)을 재사용합니다.
+        """
+        if method == "GET":
+            body = await self._read(table, params, service, fresh)
+        else:
+            try:
+                body = await self._fetch(method, table, params, json, prefer, service)
+            finally:
+                self._invalidate(table)
+        return jsonlib.loads(body) if body else None
+
+    async def _fetch(self, method, table, params=None, json=None, prefer=None, service=False) -> bytes:
+        session = await self._get_session()
+        url = f"{self.base_url}/rest/v1/{table}"
+        with span("supabase", f"{method} {table}"):
+            async with session.request(method, url, params=params, json=json,
+                                       headers=self._headers(service, prefer)) as response:
+                if response.status not in (200, 201, 204):
+                    raise SupabaseError(response.status, await response.text(), method, table)
+                if response.status == 204:
+                    return b""
+                return await response.read()
+
+    async def _read(self, table, params, service, fresh) -> bytes:
+        if not self.coalesce_reads:
+            self.read_stats["fetched"] += 1
+            return await self._fetch("GET", table, params, service=service)
+        key = (table, self._generations.get(table, 0), service,
+               tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+        if not fresh and self.read_cache_ttl:
+            body = self._recent.get(key)
+            if body is not None:
+                self.read_stats["cached"] += 1
+                return body
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.read_stats["fetched"] += 1
+            # 별도 태스크로 실행해 먼저 요청한 쪽이 취소돼도 함께 기다리던 요청은 응답을 받음
+            task = asyncio.ensure_future(self._fetch("GET", table, params, service=service))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish_read(key, done))
+        else:
+            self.read_stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _finish_read(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if task.cancelled():
+            return
+        if task.exception() is None and self.read_cache_ttl and key[1] == self._generations.get(key[0], 0):
+            self._recent.set(key, task.result(), ttl=self.read_cache_ttl)
+
+    def _invalidate(self, table):
+        self._generations[table] = self._generations.get(table, 0) + 1
+        if self.read_cache_ttl:
+            self._recent.pop_where(lambda key, _: key[0] == table)
+
+    async def select(self, table: str, fresh=False, **params) -> list[Row]:
+        return await self.request("GET", table, params=params, fresh=fresh) or []
+
+    async def select_one(self, table: str, **params) -> Optional[Row]:
+        rows = await self.select(table, limit=1, **params)
+        return rows[0] if rows else None
+
+    async def insert(self, table: str, rows, returning=True, service=False):
+        prefer = "return=representation" if returning else "return=minimal"
+        return await self.request("POST", table, json=rows, prefer=prefer, service=service)
+
+    # ─────────── 사용자 (students / teachers / admins)
+    async def get_student(self, student_id: str) -> Optional[Row]:
+        return await self.select_one("students", student_id=f"eq.{student_id}",
+                                     select="student_id,password,class_id,name")
+
+    async def get_students(self, student_ids: Iterable[str]) -> list[Row]:
+        ids = list(student_ids)
+        if not ids:
+            return []
+        return await self.select("students", student_id=in_filter(ids), select="student_id,name")
+
+    async def get_teacher(self, teacher_id: str) -> Optional[Row]:
+        return await self.select_one("teachers", teacher_id=f"eq.{teacher_id}",
+                                     select="teacher_id,password,class_id,name")
+
+    async def get_admin(self, admin_id: str) -> Optional[Row]:
+        return await self.select_one("admins", admin_id=f"eq.{admin_id}", select="admin_id,password")
+
+    # ─────────── 반 / 주제 / 방
+    async def list_classes(self) -> list[Row]:
+        return await self.select("classes", select="class_id,name")
+
+    async def list_topics(self) -> list[Row]:
+        return await self.select("topics", select="topic_id,title,system_prompt,rubric_prompt,class_id,created_at")
+
+    async def get_topic(self, topic_id: str, select="topic_id,title,system_prompt,rubric_prompt,class_id") -> Optional[Row]:
+        return await self.select_one("topics", topic_id=f"eq.{topic_id}", select=select)
+
+    async def insert_topic(self, topic: Row) -> Optional[Row]:
+        rows = await self.insert("topics", topic)
+        return rows[0] if rows else None
+
+    async def list_rooms(self, topic_id: Optional[str] = None) -> list[Row]:
+        params = {"select": "room_id,title,topic_id,created_at"}
+        if topic_id:
+            params["topic_id"] = f"eq.{topic_id}"
+        return await self.select("rooms", **params)
+
+    async def get_room(self, room_id: str, select="room_id,title,topic_id") -> Optional[Row]:
+        return await self.select_one("rooms", room_id=f"eq.{room_id}", select=select)
+
+    async def get_room_prompt(self, room_id: str) -> Optional[Row]:
+        """rooms → topics 임베드 조회로 topic_id와 system_prompt를 한 번에 가져옴"""
+        return await self.get_room(room_id, select="topic_id,topics(system_prompt)")
+
+    async def insert_rooms(self, rooms: list[Row]) -> list[Row]:
+        return await self.insert("rooms", rooms) or []
+
+    # ─────────── 메시지
+    async def list_messages(self, room_id: str, select="message_id,message,role,sender_id,timestamp,whisper_to,reasoning",
+                            order="timestamp.asc", limit: Optional[int] = None, fresh=False, **filters) -> list[Row]:
+        params = {"room_id": f"eq.{room_id}", "select": select, "order": order, **filters}
+        if limit is not None:
+            params["limit"] = limit
+        return await self.select("messages", fresh=fresh, **params)
+
+    async def list_all_messages(self, room_id: str, select="sender_id,message", page_size=SUPABASE_PAGE_SIZE,
+                                fresh=False) -> list[Row]:
+        """
+        방의 전체 메시지를 (timestamp, message_id) 키셋 페이지로 나눠 시간순으로 가져옴
+        - 서버가 max-rows로 응답을 잘라 페이지가 page_size보다 짧을 수 있으므로 빈 페이지가 올 때까지 읽음
+        - 반환 행에는 select 열만 남김
+        """
+        columns = select.split(",")
+        keyset_columns = [c for c in ("timestamp", "message_id") if c not in columns]
+        messages, keyset = [], None
+        while True:
+            rows = await self.list_messages(room_id, select=",".join(columns + keyset_columns),
+                                            order="timestamp.asc,message_id.asc", limit=page_size, fresh=fresh,
+                                            **all_of(keyset))
+            if not rows:
+                return messages
+            last = rows[-1]
+            ts, message_id = last["timestamp"], int(last["message_id"])
+            keyset = f'or(timestamp.gt."{ts}",and(timestamp.eq."{ts}",message_id.gt.{message_id}))'
+            for row in rows:
+                for column in keyset_columns:
+                    del row[column]
+            messages.extend(rows)
+
+    async def insert_message(self, message: Row) -> Optional[Row]:
+        rows = await self.insert("messages", message)
+        return rows[0] if isinstance(rows, list) and rows else rows
+
+    async def insert_messages_once(self, messages: list[Row]) -> list[Row]:
+        """
+        client_id 기준 멱등 저장 (messages.client_id에 unique 제약 필요)
+        - 이미 저장된 client_id의 행은 건너뛰고, 이번에 새로 저장된 행만 돌려줌
+        """
+        return await self.request("POST", "messages", params={"on_conflict": "client_id"}, json=messages,
+                                  prefer="return=representation,resolution=ignore-duplicates") or []
+
+    async def get_messages_by_client_ids(self, client_ids: Iterable[str]) -> list[Row]:
+        return await self.select("messages", fresh=True, client_id=in_filter(client_ids))
+
+    async def message_exists(self, message_id) -> bool:
+        return await self.select_one("messages", message_id=f"eq.{message_id}", select="message_id") is not None
+
+    async def latest_message_id(self):
+        row = await self.select_one("messages", select="message_id", order="timestamp.desc")
+        return row["message_id"] if row else None
+
+    # ─────────── GPT 개입 / 평가
+    async def insert_gpt_intervention(self, intervention: Row) -> Optional[Row]:
+        rows = await self.insert("gpt_interventions", intervention)
+        return rows[0] if isinstance(rows, list) and rows else rows
+
+    async def insert_evaluations(self, evaluations: list[Row]) -> list[Row]:
+        return await self.insert("gpt_chat_evaluations", evaluations, service=True) or []
+
+    async def get_evaluations_by_keys(self, cache_keys: Iterable[str]) -> list[Row]:
+        return await self.select("gpt_chat_evaluations", cache_key=in_filter(cache_keys),
+                                 select="cache_key,summary,created_at", order="created_at.desc")
+
+    async def insert_legacy_evaluation(self, evaluation: Row):
+        return await self.insert("evaluations", evaluation, returning=False, service=True)
+
+
+repo = SupabaseRepository()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# backend 모듈을 패키지 없이 그대로 import (bench 스크립트와 같은 방식)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from answer_cache import AnswerCache, token_difference, question_tokens
+
+ANTONYM_PAIRS = [
+    ("탄소 배출권 거래제가 우리나라 제조업 중심 경제 구조와 고용에 미치는 긍정적 영향 설명해줘",
+     "탄소 배출권 거래제가 우리나라 제조업 중심 경제 구조와 고용에 미치는 부정적 영향 설명해줘"),
+    ("기후 변화 대응에서 선진국이 져야 하는 책임은 뭐야", "기후 변화 대응에서 개도국이 져야 하는 책임은 뭐야"),
+    ("재생 에너지의 장점이 뭐야?", "재생 에너지의 단점이 뭐야?"),
+    ("원자력 발전을 늘려야 하는 이유 알려줘", "원자력 발전을 줄여야 하는 이유 알려줘"),
+]
+PARAPHRASES = [
+    ("재생 에너지의 단점이 뭐야?", "재생에너지 단점은 뭐예요"),
+    ("탄소중립이 뭐야?", "탄소 중립이란 무엇인가요?"),
+]
+
+
+def ask(cache, questions):
+    """질문을 차례로 묻고 (답변 목록, 생성 호출 수)"""
+    calls = []
+
+    async def scenario():
+        answers = []
+        for question in questions:
+            async def generate(on_delta, shared, question=question):
+                assert shared  # 캐시할 답변은 방 대화 없이 생성
+                calls.append(question)
+                return f"답변: {question}"
+            answers.append(await cache.answer("topic", question, generate))
+        return answers
+
+    return asyncio.run(scenario()), len(calls)
+
+
+@pytest.mark.parametrize("first, second", ANTONYM_PAIRS)
+def test_antonym_questions_are_not_served_from_cache(first, second):
+    assert token_difference(question_tokens(first), question_tokens(second))
+    answers, calls = ask(AnswerCache(enabled=True), [first, second])
+    assert calls == 2
+    assert answers == [f"답변: {first}", f"답변: {second}"]
+
+
+@pytest.mark.parametrize("first, second", PARAPHRASES)
+def test_paraphrased_questions_share_an_answer(first, second):
+    assert token_difference(question_tokens(first), question_tokens(second)) == []
+    answers, calls = ask(AnswerCache(enabled=True), [first, second])
+    assert calls == 1
+    assert answers == [f"답변: {first}"] * 2
+
+
+def test_concurrent_antonym_question_does_not_wait_for_pending_answer():
+    cache = AnswerCache(enabled=True)
+    first, second = ANTONYM_PAIRS[0]
+    started = []
+
+    async def scenario():
+        async def slow(on_delta, shared):
+            started.append(first)
+            await asyncio.sleep(0.05)
+            return "긍정"
+
+        async def other(on_delta, shared):
+            started.append(second)
+            return "부정"
+
+        task = asyncio.create_task(cache.answer("topic", first, slow))
+        await asyncio.sleep(0)
+        return await cache.answer("topic", second, other), await task
+
+    assert asyncio.run(scenario()) == ("부정", "긍정")
+    assert started == [first, second]
+
+
+def test_contextual_questions_use_room_context_and_are_not_cached():
+    cache = AnswerCache(enabled=True)
+    modes = []
+
+    async def generate(on_delta, shared):
+        modes.append(shared)
+        return "답변"
+
+    async def scenario():
+        for _ in range(2):
+            await cache.answer("topic", "아까 말한 그거 뭐야?", generate)
+
+    asyncio.run(scenario())
+    assert modes == [False, False]
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,36 @@
+import asyncio
+
+from batch_evaluation import load_topic_jobs
+from bench.stub_postgrest import start_stub
+from supabase_repo import repo
+
+
+def seed(messages_per_room):
+    messages = []
+    for index in range(messages_per_room):
+        # 세 개씩 같은 시각 - 페이지 경계에서 같은 timestamp를 message_id로 이어 읽는지 확인
+        messages.append({"message_id": index + 1, "room_id": "room-1", "sender_id": f"2s{index % 3:04d}",
+                         "message": f"메시지 {index}", "role": "user",
+                         "timestamp": f"2025-03-01T09:{index // 3 // 60:02d}:{index // 3 % 60:02d}"})
+    return {"topics": [{"topic_id": "topic-1", "title": "기후", "rubric_prompt": "루브릭"}],
+            "rooms": [{"room_id": "room-1", "title": "1조", "topic_id": "topic-1"}],
+            "messages": messages}
+
+
+def test_long_rooms_are_loaded_past_the_max_rows_cap(monkeypatch):
+    async def scenario():
+        _, runner, base_url = await start_stub(seed=seed(2500), max_rows=1000)
+        monkeypatch.setattr(repo, "base_url", base_url)
+        monkeypatch.setattr(repo, "api_key", "test")
+        try:
+            return await load_topic_jobs("topic-1")
+        finally:
+            await repo.close()
+            await runner.cleanup()
+
+    topic, jobs = asyncio.run(scenario())
+    group = jobs[0]
+    assert topic["topic_id"] == "topic-1"
+    assert [m["message"] for m in group["messages"]] == [f"메시지 {i}" for i in range(2500)]
+    assert set(group["messages"][0]) == {"sender_id", "message"}
+    assert sorted(len(job["messages"]) for job in jobs[1:]) == [833, 833, 834]
@@ -0,0 +1,33 @@
+import time
+
+from cache_utils import TTLCache
+
+
+def test_missing_does_not_touch_stats_or_lru_order():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.missing(["a", "b", "c"]) == ["c"]
+    assert (cache.hits, cache.misses) == (0, 0)
+
+    cache.set("c", 3)  # a가 가장 오래 쓰이지 않았으므로 제거됨 (missing이 순서를 바꾸지 않음)
+    assert cache.missing(["a", "b", "c"]) == ["a"]
+
+
+def test_missing_honors_expiry():
+    cache = TTLCache(maxsize=4, ttl=0.01)
+    cache.set("old", 1)
+    cache.set("forever", 2, ttl=None)
+    time.sleep(0.02)
+    assert cache.missing(["old", "forever"]) == ["old"]
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_get_updates_stats_and_lru_order():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
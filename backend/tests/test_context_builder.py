@@ -0,0 +1,27 @@
+import context_builder
+
+
+class OfflineTiktoken:
+    """인코딩 파일을 내려받지 못하는 tiktoken (네트워크 없는 환경)"""
+
+    def __init__(self):
+        self.loads = 0
+
+    def encoding_for_model(self, model):
+        self.loads += 1
+        raise ConnectionError("no network")
+
+    def get_encoding(self, name):
+        self.loads += 1
+        raise ConnectionError("no network")
+
+
+def test_count_tokens_falls_back_when_encoding_cannot_load(monkeypatch):
+    offline = OfflineTiktoken()
+    monkeypatch.setattr(context_builder, "tiktoken", offline)
+    monkeypatch.setattr(context_builder, "_encoders", {})
+
+    assert context_builder.count_tokens("hello world 안녕") == 12 // 4 + 2 + 1
+    assert context_builder.count_tokens("다시") == 3
+    assert offline.loads == 1  # 실패도 기억해 호출마다 내려받기를 다시 시도하지 않음
+    assert context_builder.count_tokens(context_builder.truncate_to_tokens("가" * 50, 10)) <= 10
@@ -0,0 +1,19 @@
+from evaluation_cache import evaluation_key
+
+RUBRIC = "참여도와 논리성"
+MESSAGES = [
+    {"sender_id": "2s01", "message": "재생 에너지가 필요해요"},
+    {"sender_id": "2s02", "message": "비용이 문제예요"},
+]
+
+
+def test_per_student_key_ignores_other_students():
+    more = MESSAGES + [{"sender_id": "2s02", "message": "그래도 장기적으로는 싸요"}]
+    assert evaluation_key(RUBRIC, MESSAGES, "2s01") == evaluation_key(RUBRIC, more, "2s01")
+    assert evaluation_key(RUBRIC, MESSAGES, "2s02") != evaluation_key(RUBRIC, more, "2s02")
+
+
+def test_whole_room_key_covers_every_message():
+    more = MESSAGES + [{"sender_id": "2s02", "message": "그래도 장기적으로는 싸요"}]
+    assert evaluation_key(RUBRIC, MESSAGES) != evaluation_key(RUBRIC, more)
+    assert evaluation_key(RUBRIC, MESSAGES) != evaluation_key(RUBRIC, MESSAGES, "2s01")
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from gpt_handler import _StreamedField, _to_judgment, extract_json_object
+
+JUDGMENT = {"intervention_type": "guidance", "target_student": None, "reasoning": "주제를 벗어남"}
+
+
+def feed_all(parser, pieces):
+    heads, text = [], ""
+    for piece in pieces:
+        head, decoded = parser.feed(piece)
+        if head is not None:
+            heads.append(head)
+        text += decoded
+    return heads, text
+
+
+def chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("raw", [
+    json.dumps(JUDGMENT, ensure_ascii=False),
+    "```json\n" + json.dumps(JUDGMENT, ensure_ascii=False) + "\n```",
+    "판단 결과입니다:\n" + json.dumps(JUDGMENT, ensure_ascii=False) + "\n이상입니다.",
+    "설명 {중괄호} 뒤에 " + json.dumps(JUDGMENT, ensure_ascii=False),
+])
+def test_extract_json_object_accepts_wrapped_responses(raw):
+    assert extract_json_object(raw) == JUDGMENT
+
+
+@pytest.mark.parametrize("raw", [
+    "", None, "개입하지 않습니다", '{"intervention_type": "none"', "[1, 2, 3]", '```json\n{"a": \n```',
+])
+def test_extract_json_object_rejects_malformed(raw):
+    with pytest.raises(ValueError):
+        extract_json_object(raw)
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_streamed_field_decodes_across_chunk_boundaries(size):
+    feedback = '좋아요 "따옴표"\\역슬래시\n줄바꿈 \U0001F600 이모지'
+    raw = json.dumps({**JUDGMENT, "feedback": feedback})  # ensure_ascii=True → \\u 이스케이프와 서로게이트 쌍
+    parser = _StreamedField("feedback")
+    heads, text = feed_all(parser, chunks(raw, size))
+    assert text == feedback
+    assert heads == [{**JUDGMENT, "feedback": ""}]
+    assert parser.done
+
+
+def test_streamed_field_partial_stream_stops_cleanly():
+    # 스트림이 \u 이스케이프 중간에서 끊김 (잘린 이스케이프는 풀지 않음)
+    cut = json.dumps(JUDGMENT, ensure_ascii=False)[:-1] + ', "feedback": "끝나지 않은 피드백 \\u00'
+    parser = _StreamedField("feedback")
+    heads, text = feed_all(parser, chunks(cut, 4))
+    assert heads == [{**JUDGMENT, "feedback": ""}]
+    assert text == "끝나지 않은 피드백 "
+    assert not parser.done
+
+
+def test_streamed_field_without_marker_yields_nothing():
+    parser = _StreamedField("feedback")
+    assert feed_all(parser, chunks(json.dumps(JUDGMENT), 5)) == ([], "")
+
+
+def test_streamed_field_before_judgment_has_no_intervention_type():
+    # 피드백이 판단보다 먼저 오면 판단을 미리 알 수 없음 → 호출한 쪽은 스트리밍하지 않음
+    raw = json.dumps({"feedback": "먼저 온 피드백", **JUDGMENT}, ensure_ascii=False)
+    heads, text = feed_all(_StreamedField("feedback"), chunks(raw, 6))
+    assert heads == [{"feedback": ""}]
+    assert text == "먼저 온 피드백"
+
+
+def test_to_judgment_falls_back_when_target_is_not_a_participant():
+    result = {"intervention_type": "individual", "target_student": "2s99", "reasoning": "참여 부족"}
+    judgment = _to_judgment(result, ["2s01", "2s02"], warn=False)
+    assert judgment["intervention_type"] == "guidance"
+    assert judgment["target"] is None
+    assert judgment["should_respond"]
+
+    valid = _to_judgment({"intervention_type": "individual", "target_student": "2s01"}, ["2s01", "2s02"], warn=False)
+    assert (valid["intervention_type"], valid["target"]) == ("individual", "2s01")
+    assert _to_judgment({**JUDGMENT, "intervention_type": "none"}, [], warn=False)["should_respond"] is False
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from llm_gateway import LLMGateway, PriorityLimiter, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+
+class SlowBackend:
+    """호출마다 release 이벤트가 설정될 때까지 멈춰 있는 백엔드"""
+
+    name = "slow"
+
+    def __init__(self):
+        self.started = 0
+        self.release = asyncio.Event()
+
+    async def complete(self, model, messages, on_delta=None, purpose="chat", **kwargs):
+        self.started += 1
+        await self.release.wait()
+        return "ok", None
+
+    async def close(self):
+        pass
+
+
+def unlimited(concurrency):
+    return PriorityLimiter(concurrency=concurrency, rpm=0, tpm=0)
+
+
+def test_acquire_release_in_priority_order():
+    async def scenario():
+        limiter = unlimited(1)
+        await limiter.acquire(PRIORITY_BATCH, 10)
+        order = []
+
+        async def waiter(priority, name):
+            await limiter.acquire(priority, 10)
+            order.append(name)
+            limiter.release()
+
+        tasks = [asyncio.create_task(waiter(PRIORITY_BATCH, "batch")),
+                 asyncio.create_task(waiter(PRIORITY_INTERACTIVE, "direct"))]
+        await asyncio.sleep(0)
+        assert limiter.queued() == {PRIORITY_BATCH: 1, PRIORITY_INTERACTIVE: 1}
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == ["direct", "batch"]
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_while_waiting_does_not_take_a_slot():
+    async def scenario():
+        limiter = unlimited(1)
+        await limiter.acquire(PRIORITY_BATCH, 10)
+        waiting = asyncio.create_task(limiter.acquire(PRIORITY_BATCH, 10))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        limiter.release()
+        assert limiter.in_flight == 0
+        assert limiter.queued() == {}
+        await asyncio.wait_for(limiter.acquire(PRIORITY_INTERACTIVE, 10), 1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancel_right_after_grant_releases_slot_and_tokens():
+    async def scenario():
+        limiter = PriorityLimiter(concurrency=1, rpm=0, tpm=600, burst_seconds=10)  # 버킷 100 토큰
+        await limiter.acquire(PRIORITY_BATCH, 40)
+        waiting = asyncio.create_task(limiter.acquire(PRIORITY_BATCH, 40))
+        await asyncio.sleep(0)
+        limiter.release()  # 자리를 넘겨받은 직후
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert limiter.in_flight == 0
+        assert limiter._tokens == pytest.approx(60, abs=1)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_calls_release_limiter():
+    async def scenario():
+        backend = SlowBackend()
+        gateway = LLMGateway(backend=backend, limiter=unlimited(2), max_retries=0)
+        messages = [{"role": "user", "content": "hi"}]
+        calls = [asyncio.create_task(gateway.chat("m", messages, purpose="feedback_speculative")) for _ in range(2)]
+        while backend.started < 2:
+            await asyncio.sleep(0)
+        assert gateway.limiter.in_flight == 2
+        for call in calls:
+            call.cancel()
+        await asyncio.gather(*calls, return_exceptions=True)
+        assert gateway.limiter.in_flight == 0
+
+        backend.release.set()
+        assert await asyncio.wait_for(gateway.chat("m", messages, purpose="direct"), 1) == "ok"
+        assert gateway.limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_wait_for_timeout_releases_limiter():
+    async def scenario():
+        gateway = LLMGateway(backend=SlowBackend(), limiter=unlimited(1), max_retries=0)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(gateway.chat("m", [{"role": "user", "content": "hi"}], purpose="judge"), 0.05)
+        assert gateway.limiter.in_flight == 0
+
+    asyncio.run(scenario())
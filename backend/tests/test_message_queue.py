@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+import message_queue as mq
+from supabase_repo import SupabaseError
+
+
+class FakeMessages:
+    """client_id 멱등 저장을 흉내 내는 messages 테이블 (failures: 호출마다 낼 오류, "lost"는 저장 후 응답 유실)"""
+
+    def __init__(self, failures=()):
+        self.rows = {}
+        self.failures = list(failures)
+        self.calls = 0
+
+    async def insert_messages_once(self, rows):
+        self.calls += 1
+        failure = self.failures.pop(0) if self.failures else None
+        if failure not in (None, "lost"):
+            raise failure
+        inserted = []
+        for row in rows:
+            if row["client_id"] not in self.rows:
+                self.rows[row["client_id"]] = {**row, "message_id": len(self.rows) + 1}
+                inserted.append(self.rows[row["client_id"]])
+        if failure == "lost":
+            raise asyncio.TimeoutError()
+        return inserted
+
+    async def get_messages_by_client_ids(self, client_ids):
+        return [self.rows[key] for key in client_ids if key in self.rows]
+
+
+def make_queue(monkeypatch, tmp_path, table, **kwargs):
+    monkeypatch.setattr(mq, "repo", table)
+    queue = mq.MessageWriteQueue(flush_interval=0.01, backoff_base=0.001, spill_path=str(tmp_path / "spill.jsonl"),
+                                 **kwargs)
+    seen = []
+    queue.listeners.append(seen.append)
+    return queue, seen
+
+
+def test_retry_after_lost_response_does_not_duplicate(monkeypatch, tmp_path):
+    table = FakeMessages(failures=["lost", SupabaseError(502, "bad gateway")])
+    queue, seen = make_queue(monkeypatch, tmp_path, table)
+
+    async def scenario():
+        futures = [queue.enqueue({"room_id": "r", "sender_id": "s", "message": str(i)}) for i in range(3)]
+        saved = await asyncio.gather(*futures)
+        await queue.stop()
+        return saved
+
+    saved = asyncio.run(scenario())
+    assert table.calls == 3
+    assert len(table.rows) == 3
+    assert [row["message"] for row in saved] == ["0", "1", "2"]
+    assert sorted(row["message_id"] for row in seen) == [1, 2, 3]  # 저장 알림도 행마다 한 번
+    assert queue.stats()["spilled_messages"] == 0
+
+
+def test_exhausted_retries_spill_and_replay(monkeypatch, tmp_path):
+    table = FakeMessages(failures=[asyncio.TimeoutError()] * 2)
+    queue, seen = make_queue(monkeypatch, tmp_path, table, max_retries=1)
+
+    async def scenario():
+        await queue.start()
+        first = await queue.enqueue({"room_id": "r", "sender_id": "s", "message": "hi"})
+        spilled = (tmp_path / "spill.jsonl").read_text(encoding="utf-8").splitlines()
+        assert queue.replay_spilled() == 1
+        for _ in range(100):
+            if table.rows:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return first, spilled
+
+    first, spilled = asyncio.run(scenario())
+    assert first is None
+    assert json.loads(spilled[0])["message"] == "hi"
+    assert [row["message"] for row in table.rows.values()] == ["hi"]
+    assert [row["client_id"] for row in seen] == [json.loads(spilled[0])["client_id"]]
+    stats = queue.stats()
+    assert (stats["spilled_messages"], stats["replayed_messages"]) == (1, 1)
+    assert not (tmp_path / "spill.jsonl").exists()
+
+
+def test_enqueue_while_closing_is_spilled(monkeypatch, tmp_path):
+    queue, _ = make_queue(monkeypatch, tmp_path, FakeMessages())
+
+    async def scenario():
+        await queue.start()
+        await queue.stop()
+        return await queue.enqueue({"room_id": "r", "sender_id": "s", "message": "late"})
+
+    assert asyncio.run(scenario()) is None
+    assert json.loads((tmp_path / "spill.jsonl").read_text(encoding="utf-8"))["message"] == "late"
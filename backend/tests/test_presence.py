@@ -0,0 +1,45 @@
+import asyncio
+
+import socket_events
+from presence import PresenceRegistry, user_room
+from state_store import InMemoryStateStore
+from supabase_client import student_name_cache
+
+
+class FakeServer:
+    """이벤트 핸들러를 모으고 방 입장/전송을 기록하는 sio 대역"""
+
+    def __init__(self):
+        self.handlers = {}
+        self.rooms = {}
+        self.emitted = []
+
+    def event(self, handler):
+        self.handlers[handler.__name__] = handler
+        return handler
+
+    async def enter_room(self, sid, room):
+        self.rooms.setdefault(room, set()).add(sid)
+
+    async def emit(self, event, payload, room=None):
+        self.emitted.append((event, room))
+
+
+def test_whisper_room_is_scoped_to_chat_room(monkeypatch):
+    monkeypatch.setattr(socket_events, "presence", PresenceRegistry(InMemoryStateStore()))
+    student_name_cache.set("2s0101", "학생1")
+    sio = FakeServer()
+    socket_events.register_socket_events(sio)
+
+    async def scenario():
+        # 같은 학생이 두 채팅방에 탭을 하나씩 열어 둠
+        await sio.handlers["join_room"]("sid-a", {"room_id": "room-1", "sender_id": "2s0101"})
+        await sio.handlers["join_room"]("sid-b", {"room_id": "room-2", "sender_id": "2s0101"})
+        return (await socket_events.presence.sids_of("2s0101", "room-1"),
+                await socket_events.presence.sids_of("2s0101"))
+
+    in_room, everywhere = asyncio.run(scenario())
+    assert sio.rooms[user_room("2s0101", "room-1")] == {"sid-a"}
+    assert sio.rooms[user_room("2s0101", "room-2")] == {"sid-b"}
+    assert in_room == ["sid-a"]
+    assert sorted(everywhere) == ["sid-a", "sid-b"]
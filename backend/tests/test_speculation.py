@@ -0,0 +1,87 @@
+import asyncio
+
+from llm_gateway import LLMGateway, PriorityLimiter
+from speculation import FeedbackSpeculator
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_hit_replays_collected_deltas_and_records_saving():
+    async def scenario():
+        speculator = FeedbackSpeculator(enabled=True)
+
+        async def generate(on_delta):
+            for piece in ("좋은 ", "토론", "이에요"):
+                await on_delta(piece)
+                await asyncio.sleep(0.02)
+            return "좋은 토론이에요"
+
+        speculation = speculator.start("positive", 100, generate)
+        await asyncio.sleep(0.1)
+        sent = []
+
+        async def on_delta(delta):
+            sent.append(delta)
+
+        assert await speculator.commit(speculation, on_delta) == "좋은 토론이에요"
+        assert "".join(sent) == "좋은 토론이에요"
+        stats = speculator.stats()
+        assert (stats["hits"], stats["misses"], stats["wasted_tokens"]) == (1, 0, 0)
+        assert stats["saved_seconds"] > 0
+
+    run(scenario)
+
+
+def test_failed_generation_is_a_miss():
+    async def scenario():
+        speculator = FeedbackSpeculator(enabled=True)
+
+        async def returns_none(on_delta):
+            return None
+
+        async def raises(on_delta):
+            raise RuntimeError("boom")
+
+        for generate in (returns_none, raises):
+            speculation = speculator.start("guidance", 100, generate)
+            assert await speculator.commit(speculation, None) is None
+            speculator.cancel(speculation)  # commit 뒤의 cancel은 아무것도 하지 않음
+        stats = speculator.stats()
+        assert (stats["hits"], stats["misses"], stats["saved_seconds"]) == (0, 2, 0)
+        assert stats["wasted_tokens"] == 200
+
+    run(scenario)
+
+
+def test_miss_cancels_gateway_call_and_frees_its_slot():
+    class HangingBackend:
+        name = "hanging"
+
+        async def complete(self, model, messages, on_delta=None, purpose="chat", **kwargs):
+            await on_delta("미리 ")
+            await asyncio.Event().wait()
+
+        async def close(self):
+            pass
+
+    async def scenario():
+        gateway = LLMGateway(backend=HangingBackend(), limiter=PriorityLimiter(concurrency=1, rpm=0, tpm=0),
+                             max_retries=0)
+        speculator = FeedbackSpeculator(enabled=True)
+        speculation = speculator.start("guidance", 50, lambda on_delta: gateway.chat(
+            "m", [{"role": "user", "content": "대화"}], on_delta=on_delta, purpose="feedback_speculative"))
+        while not speculation.generated:
+            await asyncio.sleep(0)
+        assert gateway.limiter.in_flight == 1
+
+        speculator.cancel(speculation)
+        await asyncio.gather(speculation.task, return_exceptions=True)
+        assert speculation.task.cancelled()
+        assert gateway.limiter.in_flight == 0
+        stats = speculator.stats()
+        assert (stats["hits"], stats["misses"]) == (0, 1)
+        assert stats["wasted_tokens"] > 50
+
+    run(scenario)
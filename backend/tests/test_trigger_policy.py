@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from timer_wheel import TimerWheel
+from trigger_policy import (AllOf, AnyOf, Cooldown, MessageCount, RoomActivity, Silence, TimeWindow,
+                            parse_policy)
+
+SIM_POLICY = "cooldown:60 & (count:8 | window:180 | silence:60)"
+
+
+def room_with(times, triggered_at=None):
+    room = RoomActivity()
+    if triggered_at is not None:
+        room.triggered(triggered_at)
+    for index, at in enumerate(times, 1):
+        room.add_message(at, index)
+    return room
+
+
+def test_parse_precedence_and_parentheses():
+    policy = parse_policy(SIM_POLICY)
+    assert isinstance(policy, AllOf)
+    cooldown, any_of = policy.policies
+    assert isinstance(cooldown, Cooldown) and isinstance(any_of, AnyOf)
+    assert [type(p) for p in any_of.policies] == [MessageCount, TimeWindow, Silence]
+    assert str(policy) == "(cooldown:60 & (count:8 | window:180:1 | silence:60:1))"
+
+    # & 가 | 보다 먼저 묶임
+    mixed = parse_policy("count:6 | cooldown:30 & silence:45:2")
+    assert isinstance(mixed, AnyOf)
+    assert isinstance(mixed.policies[1], AllOf)
+    assert mixed.policies[1].policies[1].min_messages == 2
+
+
+@pytest.mark.parametrize("spec", [
+    "", "count", "count:x", "bogus:3", "count:6 &", "(count:6", "count:6)", "count:6 silence:30",
+    "cooldown:30", "cooldown:30 & cooldown:60", "count:6 # silence:30",
+])
+def test_parse_rejects_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        parse_policy(spec)
+
+
+def test_simulation_policy_evaluation():
+    policy = parse_policy(SIM_POLICY)
+
+    # 활발한 방: 8개가 쌓였지만 마지막 판단 후 60초가 안 지남 → cooldown이 끝나는 시각에 다시 확인
+    busy = room_with([101 + i for i in range(8)], triggered_at=100)
+    assert policy.evaluate(busy, 109) == (None, 160)
+    assert policy.evaluate(busy, 160) == ("count", None)
+
+    # 조용한 방: 메시지 2개 후 60초 침묵
+    quiet = room_with([0, 10])
+    assert policy.evaluate(quiet, 20) == (None, 70)
+    assert policy.evaluate(quiet, 70) == ("silence", None)
+
+    # 꾸준히 말하는 방: 침묵은 없지만 첫 메시지 후 180초
+    steady = room_with(range(0, 180, 30))
+    assert policy.evaluate(steady, 175) == (None, 180)
+    assert policy.evaluate(steady, 180)[0] == "window"
+
+    # 판단하지 않은 메시지가 없으면 시간 조건도 기다리지 않음
+    empty = RoomActivity()
+    assert policy.evaluate(empty, 1000) == (None, None)
+
+
+def test_count_only_waits_for_messages():
+    policy = parse_policy("count:3")
+    assert policy.evaluate(room_with([0, 1]), 100) == (None, None)
+    assert policy.evaluate(room_with([0, 1, 2]), 2) == ("count", None)
+
+
+def test_all_of_reports_every_satisfied_reason():
+    policy = parse_policy("count:2 & silence:10")
+    room = room_with([0, 5])
+    assert policy.evaluate(room, 6) == (None, 15)
+    assert policy.evaluate(room, 15) == ("count+silence", None)
+
+
+def test_room_activity_resets_on_trigger():
+    room = room_with([0, 1, 2])
+    room.triggered(3)
+    assert (room.buffered, room.first_at, room.last_trigger_at) == (0, None, 3)
+    room.add_message(4, 1)
+    assert (room.first_at, room.last_at) == (4, 4)
+
+
+def test_timer_wheel_fires_reschedules_and_cancels():
+    async def scenario():
+        wheel = TimerWheel(tick=0.01, slots=8)
+        fired = []
+        now = wheel.now()
+        wheel.schedule("a", now + 0.03, fired.append)
+        wheel.schedule("b", now + 0.03, fired.append)
+        wheel.schedule("c", now + 0.2, fired.append)  # 휠을 한 바퀴 넘게 도는 항목
+        wheel.schedule("a", now + 0.05, fired.append)  # 덮어쓰기
+        wheel.cancel("b")
+        assert len(wheel) == 2
+        await asyncio.sleep(0.1)
+        assert fired == ["a"]
+        await asyncio.sleep(0.15)
+        assert fired == ["a", "c"]
+        assert len(wheel) == 0 and wheel.fired == 2
+        await wheel.stop()
+
+    asyncio.run(scenario())
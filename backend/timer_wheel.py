@@ -0,0 +1,79 @@
+import asyncio
+from log_utils import get_logger
+
+logger = get_logger("timer")
+
+
+# ✅ 공유 타이머 휠
+class TimerWheel:
+    """
+    방마다 태스크/타이머를 두지 않고 태스크 하나로 많은 지연 실행을 처리하는 해시 타이밍 휠
+    - schedule(key, when, callback): loop.time() 기준 when 이후 callback(key) 호출 (같은 key는 덮어씀)
+    - tick초마다 깨어나 지난 칸의 항목만 확인 → 방이 수천 개여도 깨어나는 횟수는 일정
+    - 실행 시각은 최대 tick만큼 늦을 수 있음 (자동 개입 판단처럼 초 단위 정밀도면 충분한 용도)
+    - callback은 동기 함수 (오래 걸리는 일은 callback 안에서 태스크로 넘김)
+    """
+
+    def __init__(self, tick=0.5, slots=1024):
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._timers = {}  # key → (when, tick 번호, callback)
+        self._cursor = None  # 다음에 처리할 tick 번호
+        self._task = None
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._timers)
+
+    @staticmethod
+    def now():
+        return asyncio.get_running_loop().time()
+
+    def schedule(self, key, when, callback):
+        if self._cursor is None:
+            self._cursor = int(self.now() / self.tick)
+        tick = max(int(when / self.tick), self._cursor)  # 이미 지난 시각은 다음 tick에 실행
+        self._timers[key] = (when, tick, callback)
+        self._slots[tick % len(self._slots)].add(key)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def cancel(self, key):
+        # 칸에 남은 key는 그 칸을 지날 때 정리
+        self._timers.pop(key, None)
+
+    def when(self, key):
+        entry = self._timers.get(key)
+        return entry[0] if entry else None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(max(0.0, (self._cursor + 1) * self.tick - self.now()))
+            # 루프가 밀렸으면 지나간 칸을 모두 처리
+            while (self._cursor + 1) * self.tick <= self.now():
+                self._expire(self._cursor)
+                self._cursor += 1
+
+    def _expire(self, tick):
+        slot = self._slots[tick % len(self._slots)]
+        for key in list(slot):
+            entry = self._timers.get(key)
+            if entry is None or entry[1] % len(self._slots) != tick % len(self._slots):
+                slot.discard(key)  # 취소되었거나 다른 칸으로 옮겨진 항목
+                continue
+            if entry[1] > tick:
+                continue  # 휠을 한 바퀴 이상 더 돌아야 하는 항목
+            slot.discard(key)
+            del self._timers[key]
+            self.fired += 1
+            try:
+                entry[2](key)
+            except Exception as e:
+                logger.error("❌ 타이머 콜백 오류 (%s): %s", key, e)
+
+    async def stop(self):
+        self._timers.clear()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,207 @@
+import re
+
+# 자동 개입 판단을 시작하는 조건 (정책)
+# - count:N          판단하지 않은 메시지가 N개 이상 쌓이면
+# - window:S[:M]     판단하지 않은 첫 메시지 후 S초가 지나면 (메시지 M개 이상, 기본 1)
+# - silence:S[:M]    마지막 메시지 후 S초 동안 조용하면 (판단하지 않은 메시지 M개 이상, 기본 1)
+# - cooldown:S       마지막 판단 시작 후 S초 동안은 판단하지 않음 (& 로 묶어서 사용)
+# & (모두), | (하나라도), 괄호로 조합: "cooldown:30 & (count:6 | silence:45 | window:180)"
+
+
+class RoomActivity:
+    """방의 판단 대기 상태 (시각은 loop.time() 기준 초)"""
+
+    __slots__ = ("buffered", "first_at", "last_at", "last_trigger_at")
+
+    def __init__(self):
+        self.buffered = 0  # 판단하지 않은 메시지 수
+        self.first_at = None  # 판단하지 않은 첫 메시지 시각
+        self.last_at = None  # 마지막 메시지 시각
+        self.last_trigger_at = None  # 마지막 판단 시작 시각
+
+    def add_message(self, now, buffered):
+        self.buffered = buffered
+        self.last_at = now
+        if self.first_at is None:
+            self.first_at = now
+
+    def triggered(self, now):
+        self.buffered = 0
+        self.first_at = None
+        self.last_trigger_at = now
+
+
+class TriggerPolicy:
+    """
+    evaluate(room, now) → (reason, next_check)
+    - reason: 지금 판단을 시작할 이유 (예: "count"), 아니면 None
+    - next_check: 새 메시지가 없어도 결과가 바뀔 수 있는 가장 이른 시각 (없으면 None → 메시지가 올 때만 다시 확인)
+    """
+
+    gate = False  # 혼자서는 판단 이유가 되지 않는 조건 (cooldown)
+
+    def evaluate(self, room, now):
+        raise NotImplementedError
+
+
+class MessageCount(TriggerPolicy):
+    def __init__(self, messages):
+        self.messages = int(messages)
+
+    def evaluate(self, room, now):
+        return ("count" if room.buffered >= self.messages else None), None
+
+    def __str__(self):
+        return f"count:{self.messages}"
+
+
+class TimeWindow(TriggerPolicy):
+    def __init__(self, seconds, min_messages=1):
+        self.seconds = float(seconds)
+        self.min_messages = int(min_messages)
+
+    def evaluate(self, room, now):
+        if room.buffered < self.min_messages or room.first_at is None:
+            return None, None
+        due = room.first_at + self.seconds
+        return ("window", None) if now >= due else (None, due)
+
+    def __str__(self):
+        return f"window:{self.seconds:g}:{self.min_messages}"
+
+
+class Silence(TriggerPolicy):
+    def __init__(self, seconds, min_messages=1):
+        self.seconds = float(seconds)
+        self.min_messages = int(min_messages)
+
+    def evaluate(self, room, now):
+        if room.buffered < self.min_messages or room.last_at is None:
+            return None, None
+        due = room.last_at + self.seconds
+        return ("silence", None) if now >= due else (None, due)
+
+    def __str__(self):
+        return f"silence:{self.seconds:g}:{self.min_messages}"
+
+
+class Cooldown(TriggerPolicy):
+    gate = True
+
+    def __init__(self, seconds):
+        self.seconds = float(seconds)
+
+    def evaluate(self, room, now):
+        if room.last_trigger_at is None:
+            return "cooldown", None
+        due = room.last_trigger_at + self.seconds
+        return ("cooldown", None) if now >= due else (None, due)
+
+    def __str__(self):
+        return f"cooldown:{self.seconds:g}"
+
+
+class AllOf(TriggerPolicy):
+    """모든 조건을 만족하면 판단 (이유는 gate가 아닌 조건들)"""
+
+    def __init__(self, *policies):
+        self.policies = policies
+        self.gate = all(policy.gate for policy in policies)
+
+    def evaluate(self, room, now):
+        reasons, dues = [], []
+        for policy in self.policies:
+            reason, due = policy.evaluate(room, now)
+            if reason is None:
+                if due is None:
+                    return None, None  # 새 메시지가 와야 만족할 수 있는 조건
+                dues.append(due)
+            elif not policy.gate:
+                reasons.append(reason)
+        if dues:
+            return None, max(dues)
+        return "+".join(reasons) or "cooldown", None
+
+    def __str__(self):
+        return "(" + " & ".join(map(str, self.policies)) + ")"
+
+
+class AnyOf(TriggerPolicy):
+    """조건 하나라도 만족하면 판단 (처음 만족한 조건이 이유)"""
+
+    def __init__(self, *policies):
+        self.policies = policies
+        self.gate = any(policy.gate for policy in policies)
+
+    def evaluate(self, room, now):
+        dues = []
+        for policy in self.policies:
+            reason, due = policy.evaluate(room, now)
+            if reason is not None:
+                return reason, None
+            if due is not None:
+                dues.append(due)
+        return None, min(dues, default=None)
+
+    def __str__(self):
+        return "(" + " | ".join(map(str, self.policies)) + ")"
+
+
+POLICIES = {"count": MessageCount, "window": TimeWindow, "silence": Silence, "cooldown": Cooldown}
+
+_TOKEN = re.compile(r"\s*(?:([&|()])|([a-z_]+(?::[0-9.]+)*))")
+
+
+def parse_policy(spec):
+    """
+    "cooldown:30 & (count:6 | silence:45)" → 정책 객체
+    - & 가 | 보다 먼저 묶임, 잘못된 형식이면 ValueError
+    """
+    tokens, pos = [], 0
+    spec = spec.strip()
+    while pos < len(spec):
+        found = _TOKEN.match(spec, pos)
+        if not found or found.end() == pos:
+            raise ValueError(f"개입 조건을 해석할 수 없습니다: {spec[pos:]!r}")
+        tokens.append(found.group(1) or found.group(2))
+        pos = found.end()
+
+    def expect_any(index):
+        policy, index = expect_all(index)
+        policies = [policy]
+        while index < len(tokens) and tokens[index] == "|":
+            policy, index = expect_all(index + 1)
+            policies.append(policy)
+        return (policies[0] if len(policies) == 1 else AnyOf(*policies)), index
+
+    def expect_all(index):
+        policy, index = expect_atom(index)
+        policies = [policy]
+        while index < len(tokens) and tokens[index] == "&":
+            policy, index = expect_atom(index + 1)
+            policies.append(policy)
+        return (policies[0] if len(policies) == 1 else AllOf(*policies)), index
+
+    def expect_atom(index):
+        if index >= len(tokens):
+            raise ValueError(f"개입 조건이 끝나지 않았습니다: {spec!r}")
+        token = tokens[index]
+        if token == "(":
+            policy, index = expect_any(index + 1)
+            if index >= len(tokens) or tokens[index] != ")":
+                raise ValueError(f"괄호가 닫히지 않았습니다: {spec!r}")
+            return policy, index + 1
+        name, *args = token.split(":")
+        if name not in POLICIES:
+            raise ValueError(f"알 수 없는 개입 조건: {name} (사용 가능: {', '.join(POLICIES)})")
+        try:
+            return POLICIES[name](*args), index + 1
+        except (TypeError, ValueError):
+            raise ValueError(f"개입 조건 인자가 잘못되었습니다: {token!r}") from None
+
+    policy, index = expect_any(0)
+    if index != len(tokens):
+        raise ValueError(f"개입 조건을 해석할 수 없습니다: {' '.join(tokens[index:])!r}")
+    if policy.gate:
+        raise ValueError(f"cooldown만으로는 판단을 시작할 수 없습니다: {spec!r}")
+    return policy
@@ -12,6 +12,15 @@ function StudentTab({ backend, headers, classes, selectedClassId, setSelectedCla
     if (selectedClassId) fetchStudents();
   }, [selectedClassId]);
 
+  // 백엔드의 학생 이름 캐시 무효화 (실패해도 TTL 후 자동 갱신되므로 무시)
+  const invalidateNameCache = (studentIds) => {
+    fetch(`${import.meta.env.VITE_EVALUATE_API}/cache/students/invalidate`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ student_ids: studentIds }),
+    }).catch((error) => console.error("이름 캐시 무효화 실패:", error));
+  };
+
   const fetchStudents = async () => {
     const res = await fetch(`${backend}/students?class_id=eq.${selectedClassId}`, { headers });
     const data = await res.json();
@@ -81,6 +90,7 @@ function StudentTab({ backend, headers, classes, selectedClassId, setSelectedCla
 
       if (res.ok) {
         const updatedStudent = await res.json();
+        invalidateNameCache([id]);
         // 즉시 UI 업데이트
         setStudents(prev => 
           prev.map(s => s.student_id === id ? {...s, name} : s)
@@ -108,6 +118,7 @@ function StudentTab({ backend, headers, classes, selectedClassId, setSelectedCla
       });
 
       if (res.ok) {
+        invalidateNameCache([id]);
         setStudents(prev => prev.filter(s => s.student_id !== id));
         setSelectedStudents(prev => prev.filter(studentId => studentId !== id));
         alert("학생이 삭제되었습니다.");
@@ -134,6 +145,7 @@ function StudentTab({ backend, headers, classes, selectedClassId, setSelectedCla
       });
 
       if (res.ok) {
+        invalidateNameCache(selectedStudents);
         setStudents(prev => prev.filter(s => !selectedStudents.includes(s.student_id)));
         setSelectedStudents([]);
         alert("선택한 학생들이 삭제되었습니다.");
@@ -1,4 +1,4 @@
-import React, { useState, useRef, useEffect } from "react";
+import React, { useState, useRef, useEffect, useLayoutEffect, useCallback } from "react";
 import { useNavigate } from "react-router-dom";
 import { socket } from "../../socket";
 import MessageList from "./MessageList";
@@ -51,6 +51,7 @@ function ChatRoom() {
   const [isMobile, setIsMobile] = useState(window.innerWidth <= 768);
   const [isLoading, setIsLoading] = useState(true);
   const [loadingMore, setLoadingMore] = useState(false);
+  const [hasMore, setHasMore] = useState(false);
   const [isCloseHovered, setIsCloseHovered] = useState(false);
   const [isMenuHovered, setIsMenuHovered] = useState(false);
   const [isLeaveHovered, setIsLeaveHovered] = useState(false);
@@ -65,6 +66,11 @@ function ChatRoom() {
 
   const messagesEndRef = useRef(null);
   const messageAreaRef = useRef(null);
+  // 페이지 커서: 이전 페이지 요청용 (timestamp, message_id) / 재접속 동기화용 마지막 message_id
+  const nextCursorRef = useRef(null);
+  const lastMessageIdRef = useRef(null);
+  // 이전 페이지를 앞에 붙일 때 유지할 "바닥에서의 거리" (null이면 맨 아래로 스크롤)
+  const prependAnchorRef = useRef(null);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -82,7 +88,14 @@ function ChatRoom() {
     return () => window.removeEventListener('resize', handleResize);
   }, []);
 
-  useEffect(() => {
+  useLayoutEffect(() => {
+    const area = messageAreaRef.current;
+    if (prependAnchorRef.current !== null && area) {
+      // 이전 메시지를 앞에 붙인 경우 보던 위치 유지
+      area.scrollTop = area.scrollHeight - prependAnchorRef.current;
+      prependAnchorRef.current = null;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
@@ -95,9 +108,17 @@ function ChatRoom() {
 
     setIsLoading(true);
 
+    // 최초 접속과 재접속 모두 방에 다시 참여하고, 재접속이면 놓친 메시지만 동기화
+    const handleConnect = () => {
+      socket.emit("join_room", { room_id: roomId, sender_id: studentId });
+      if (lastMessageIdRef.current) {
+        socket.emit("get_messages", { room_id: roomId, since_message_id: lastMessageIdRef.current });
+      } else {
+        socket.emit("get_messages", { room_id: roomId });
+      }
+    };
+    socket.on("connect", handleConnect);
     socket.connect();
-    socket.emit("join_room", { room_id: roomId, sender_id: studentId });
-    socket.emit("get_messages", { room_id: roomId });
 
     // 메시지 정규화 전 후 상태 전체 로깅
     const logMessageStructure = (prefix, msg) => {
@@ -144,8 +165,18 @@ function ChatRoom() {
           return;
         }
         
-        // 메시지 추가
-        setMessages((prev) => [...prev, normalizedMsg]);
+        // 메시지 추가 (스트리밍으로 먼저 받은 조각이 있으면 최종 메시지로 교체)
+        setMessages((prev) => {
+          if (normalizedMsg.stream_id) {
+            const index = prev.findIndex((m) => m.stream_id === normalizedMsg.stream_id);
+            if (index !== -1) {
+              const next = [...prev];
+              next[index] = { ...normalizedMsg, timestamp: prev[index].timestamp };
+              return next;
+            }
+          }
+          return [...prev, normalizedMsg];
+        });
         
         // 메시지에서 이름 정보 저장
         if (normalizedMsg.sender_id && normalizedMsg.name) {
@@ -156,12 +187,39 @@ function ChatRoom() {
       }
     });
 
+    // GPT 응답 스트리밍 조각: 같은 stream_id의 메시지에 이어 붙임
+    socket.on("receive_message_delta", (chunk) => {
+      setMessages((prev) => {
+        const index = prev.findIndex((m) => m.stream_id === chunk.stream_id);
+        if (index === -1) {
+          const streamingMsg = normalizeMessage(
+            { ...chunk, message: chunk.delta, streaming: true },
+            studentId
+          );
+          streamingMsg.timestamp = new Date().toISOString();
+          return [...prev, streamingMsg];
+        }
+        const next = [...prev];
+        next[index] = { ...next[index], message: next[index].message + chunk.delta };
+        return next;
+      });
+    });
+
+    // 최종 메시지 없이 끝난 스트리밍(개입 취소, 다른 유형으로 다시 생성, 생성 실패): 조각 말풍선 제거
+    socket.on("receive_message_drop", ({ stream_id }) => {
+      setMessages((prev) => prev.filter((m) => !(m.streaming && m.stream_id === stream_id)));
+    });
+
     socket.on("message_history", (data) => {
-      // 새로운 API 응답 형식 처리 (메시지 배열 + 페이지네이션 정보)
+      // 메시지 배열 + 페이지 정보 (mode: latest | before | since)
       const messages = data.messages || [];
+      const pagination = data.pagination || {};
+      const mode = pagination.mode || "latest";
       
       console.log("📚 메시지 히스토리 수신:", {
-        count: messages.length
+        mode,
+        count: messages.length,
+        hasMore: pagination.has_more
       });
       
       // 메시지 히스토리 정규화
@@ -177,9 +235,37 @@ function ChatRoom() {
         
         return normalizedMsg;
       });
-      
-      setMessages(normalizedMessages);
-      setIsLoading(false);
+
+      if (pagination.last_message_id && pagination.last_message_id > (lastMessageIdRef.current || 0)) {
+        lastMessageIdRef.current = pagination.last_message_id;
+      }
+
+      if (mode === "before") {
+        // 이전 페이지: 앞에 붙이고 스크롤 위치 유지
+        const area = messageAreaRef.current;
+        prependAnchorRef.current = area ? area.scrollHeight - area.scrollTop : null;
+        setMessages(prev => [...normalizedMessages, ...prev]);
+        nextCursorRef.current = pagination.next_cursor;
+        setHasMore(Boolean(pagination.has_more));
+        setLoadingMore(false);
+      } else if (mode === "since") {
+        // 재접속 동기화: 저장된 메시지는 그대로 두고, 끊긴 동안 소켓으로만 받은(아직 ID 없는) 메시지를 DB 기준으로 교체
+        setMessages(prev => {
+          const known = new Set(prev.filter(m => m.message_id).map(m => m.message_id));
+          const kept = prev.filter(m => m.message_id || m.type === "system" || m.streaming);
+          return [...kept, ...normalizedMessages.filter(m => !known.has(m.message_id))];
+        });
+        if (pagination.has_more) {
+          socket.emit("get_messages", { room_id: roomId, since_message_id: lastMessageIdRef.current });
+        }
+      } else {
+        // 최근 페이지: 바로 맨 아래로 이동 (부드러운 스크롤 중 맨 위 감시 요소가 보여 이전 페이지를 연달아 불러오지 않도록)
+        prependAnchorRef.current = 0;
+        setMessages(normalizedMessages);
+        nextCursorRef.current = pagination.next_cursor;
+        setHasMore(Boolean(pagination.has_more));
+        setIsLoading(false);
+      }
       
       // 메시지 히스토리에서 학생 이름 정보 추출
       const names = {};
@@ -189,9 +275,6 @@ function ChatRoom() {
         }
       });
       setUserNames(prev => ({ ...prev, ...names }));
-      
-      // 자동 스크롤 다운 실행
-      setTimeout(scrollToBottom, 100);
     });
 
     socket.on("current_users", ({ participants }) => {
@@ -260,8 +343,11 @@ function ChatRoom() {
 
     return () => {
       socket.disconnect();
+      socket.off("connect", handleConnect);
       socket.off("message_history");
       socket.off("receive_message");
+      socket.off("receive_message_delta");
+      socket.off("receive_message_drop");
       socket.off("user_joined");
       socket.off("user_left");
       socket.off("current_users");
@@ -364,10 +450,11 @@ function ChatRoom() {
     };
   };
 
-  const loadMoreMessages = () => {
+  const loadMoreMessages = useCallback(() => {
+    if (loadingMore || !hasMore || !nextCursorRef.current) return;
     setLoadingMore(true);
-    socket.emit("get_messages", { room_id: roomId, page: Math.ceil(messages.length / 20) + 1 });
-  };
+    socket.emit("get_messages", { room_id: roomId, before: nextCursorRef.current });
+  }, [loadingMore, hasMore, roomId]);
 
   return (
     <div style={{
@@ -527,7 +614,7 @@ function ChatRoom() {
             </div>
           ) : (
             <div style={styles.messageListContainer}>
-              {messages.length > 20 && (
+              {hasMore && (
                 <button 
                   style={getLoadMoreButtonStyle()}
                   onClick={loadMoreMessages}
@@ -541,6 +628,9 @@ function ChatRoom() {
               <MessageList 
                 messages={messages} 
                 studentId={studentId} 
+                hasMore={hasMore}
+                loadingMore={loadingMore}
+                onLoadMore={loadMoreMessages}
               />
               <div ref={messagesEndRef} />
             </div>
@@ -1,12 +1,15 @@
-import React, { useEffect, useState } from "react";
+import React, { useEffect, useRef, useState } from "react";
 import { motion } from "framer-motion";
 import styles from "./chatStyles";
 import { getUserColor } from "./chatUtils";
 import theme from "../../styles/theme";
 import { formatTimestamp } from "./chatUtils";
 
-function MessageList({ messages, studentId, isAdmin = false }) {
+// 무한 스크롤: hasMore일 때 목록 맨 위 감시 요소가 보이면 onLoadMore()로 이전 페이지 요청
+// (부모가 loadingMore 동안 중복 요청을 막고, 이전 메시지를 앞에 붙인 뒤 스크롤 위치를 보정)
+function MessageList({ messages, studentId, isAdmin = false, hasMore = false, loadingMore = false, onLoadMore }) {
   const [isMobile, setIsMobile] = useState(window.innerWidth <= 768);
+  const topSentinelRef = useRef(null);
 
   useEffect(() => {
     const handleResize = () => {
@@ -17,13 +20,30 @@ function MessageList({ messages, studentId, isAdmin = false }) {
     return () => window.removeEventListener('resize', handleResize);
   }, []);
 
+  useEffect(() => {
+    const sentinel = topSentinelRef.current;
+    if (!sentinel || !hasMore || loadingMore || !onLoadMore) return;
+
+    const observer = new IntersectionObserver((entries) => {
+      if (entries.some((entry) => entry.isIntersecting)) {
+        onLoadMore();
+      }
+    });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [hasMore, loadingMore, onLoadMore]);
+
   return (
     <div style={styles.messageList}>
+      {hasMore && <div ref={topSentinelRef} style={{ height: "1px" }} />}
       {messages.map((msg, index) => {
+        // 앞에 이전 페이지가 붙어도 기존 메시지가 다시 그려지지 않도록 안정적인 key 사용
+        const key = msg.message_id ?? msg.stream_id ?? `local-${index}`;
+
         if (msg.type === "system") {
           return (
             <motion.div
-              key={index}
+              key={key}
               initial={{ opacity: 0, y: 10 }}
               animate={{ opacity: 1, y: 0 }}
               transition={{ duration: 0.2 }}
@@ -142,7 +162,7 @@ function MessageList({ messages, studentId, isAdmin = false }) {
 
         return (
           <motion.div
-            key={index}
+            key={key}
             initial={{ opacity: 0, y: 10 }}
             animate={{ opacity: 1, y: 0 }}
             transition={{ duration: 0.2 }}
@@ -1,6 +1,14 @@
 import { useEffect } from "react";
 import { socket } from "../../socket";
 
+// 재접속 동기화: 이미 가진 저장 메시지(message_id)는 건너뛰고,
+// 끊긴 동안 소켓으로만 받은(아직 ID 없는) 메시지는 DB에서 받은 메시지로 교체
+function mergeSince(prev, messages) {
+  const known = new Set(prev.filter((m) => m.message_id).map((m) => m.message_id));
+  const kept = prev.filter((m) => m.message_id || m.type === "system" || m.streaming);
+  return [...kept, ...messages.filter((m) => !known.has(m.message_id))];
+}
+
 export function useChatSocket({ studentId, roomId, setMessages, setParticipants, addSystemMessage }) {
   useEffect(() => {
     if (!studentId || !roomId) return;
@@ -9,8 +17,37 @@ export function useChatSocket({ studentId, roomId, setMessages, setParticipants,
     socket.emit("join_room", { room_id: roomId, sender_id: studentId });
     socket.emit("get_messages", { room_id: roomId });
 
-    socket.on("message_history", (history) => setMessages(history));
-    socket.on("receive_message", (data) => setMessages((prev) => [...prev, data]));
+    socket.on("message_history", ({ messages = [], pagination = {} }) => {
+      // before: 이전 페이지를 앞에, since: 재접속 중 놓친 메시지를 뒤에, latest: 교체
+      if (pagination.mode === "before") setMessages((prev) => [...messages, ...prev]);
+      else if (pagination.mode === "since") setMessages((prev) => mergeSince(prev, messages));
+      else setMessages(messages);
+    });
+    socket.on("receive_message", (data) =>
+      setMessages((prev) => {
+        // 스트리밍으로 조립 중이던 메시지는 최종 메시지로 교체
+        const index = data.stream_id ? prev.findIndex((m) => m.stream_id === data.stream_id) : -1;
+        if (index === -1) return [...prev, data];
+        const next = [...prev];
+        next[index] = data;
+        return next;
+      })
+    );
+    socket.on("receive_message_delta", (chunk) =>
+      setMessages((prev) => {
+        const index = prev.findIndex((m) => m.stream_id === chunk.stream_id);
+        if (index === -1) {
+          return [...prev, { ...chunk, message: chunk.delta, streaming: true }];
+        }
+        const next = [...prev];
+        next[index] = { ...next[index], message: next[index].message + chunk.delta };
+        return next;
+      })
+    );
+    // 최종 메시지 없이 끝난 스트리밍은 조각 말풍선 제거
+    socket.on("receive_message_drop", ({ stream_id }) =>
+      setMessages((prev) => prev.filter((m) => !(m.streaming && m.stream_id === stream_id)))
+    );
     socket.on("current_users", ({ participants }) => setParticipants(participants));
     socket.on("user_joined", ({ sender_id }) => {
       console.log("✅ user_joined 이벤트 감지:", sender_id); // 추가
@@ -31,6 +68,8 @@ export function useChatSocket({ studentId, roomId, setMessages, setParticipants,
       socket.disconnect();
       socket.off("message_history");
       socket.off("receive_message");
+      socket.off("receive_message_delta");
+      socket.off("receive_message_drop");
       socket.off("current_users");
       socket.off("user_joined");
       socket.off("user_left");
@@ -13,6 +13,9 @@ function EvaluateTab({ backend, headers, classId }) {
   const [isEvaluatingMap, setIsEvaluatingMap] = useState({});
   const [expandedTopics, setExpandedTopics] = useState({});
   const [studentsMap, setStudentsMap] = useState({});
+  const [batchProgressMap, setBatchProgressMap] = useState({});
+  // 주제별 "새로 평가" 여부 - 끄면 루브릭과 대화가 그대로인 평가는 저장된 결과를 재사용
+  const [forceRefreshMap, setForceRefreshMap] = useState({});
 
   const supabaseUrl = import.meta.env.VITE_SUPABASE_URL;
   const supabaseKey = import.meta.env.VITE_SUPABASE_ANON_KEY;
@@ -293,6 +296,7 @@ function EvaluateTab({ backend, headers, classId }) {
           room_id: roomId,
           class_id: topic.class_id,
           target_student: targetStudent || null,
+          force_refresh: Boolean(forceRefreshMap[topicId]),
           messages: filteredMessages.map((m) => ({
             sender_id: m.sender_id,
             message: m.message,
@@ -323,6 +327,86 @@ function EvaluateTab({ backend, headers, classId }) {
     });
   };
 
+  // 주제 전체(모든 방 + 학생별) 일괄 평가 - 서버가 끝나는 순서대로 SSE로 결과를 보냄
+  const evaluateTopicWithGPT = async (topicId) => {
+    const topic = topics.find((t) => t.topic_id === topicId);
+    if (!topic?.rubric_prompt) {
+      alert("⚠️ 해당 토픽에 루브릭 프롬프트가 없습니다.");
+      return;
+    }
+
+    const updateProgress = (patch) =>
+      setBatchProgressMap((prev) => ({ ...prev, [topicId]: { ...prev[topicId], ...patch } }));
+    updateProgress({ running: true, done: 0, total: 0, failed: 0 });
+
+    const handleEvent = (event, data) => {
+      if (event === "start") {
+        updateProgress({ total: data.total });
+      } else if (event === "result") {
+        setEvaluationMap((prev) => ({
+          ...prev,
+          [data.room_id + (data.student_id || "")]: data.feedback || "📭 GPT 평가 결과 없음",
+        }));
+        setBatchProgressMap((prev) => {
+          const current = prev[topicId] || {};
+          return {
+            ...prev,
+            [topicId]: {
+              ...current,
+              done: (current.done || 0) + 1,
+              failed: (current.failed || 0) + (data.ok ? 0 : 1),
+            },
+          };
+        });
+      } else if (event === "done") {
+        updateProgress({ running: false, saved: data.saved, cached: data.cached });
+      } else if (event === "error") {
+        updateProgress({ running: false });
+        alert("❌ 일괄 평가 중 오류가 발생했습니다.");
+      }
+    };
+
+    try {
+      const res = await fetch(`${evaluateApi}/evaluate-topic`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          topic_id: topicId,
+          rubric_prompt: topic.rubric_prompt,
+          force_refresh: Boolean(forceRefreshMap[topicId]),
+        }),
+      });
+      if (!res.ok || !res.body) {
+        throw new Error(await res.text());
+      }
+
+      // SSE 파싱: 빈 줄로 구분된 "event: ...\ndata: ..." 블록
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const blocks = buffer.split("\n\n");
+        buffer = blocks.pop();
+        blocks.forEach((block) => {
+          let event = "message";
+          let data = "";
+          block.split("\n").forEach((line) => {
+            if (line.startsWith("event:")) event = line.slice(6).trim();
+            else if (line.startsWith("data:")) data += line.slice(5).trim();
+          });
+          if (data) handleEvent(event, JSON.parse(data));
+        });
+      }
+    } catch (error) {
+      console.error("주제 일괄 평가 오류:", error);
+      alert("❌ 일괄 평가 요청 중 오류가 발생했습니다.");
+    }
+    updateProgress({ running: false });
+  };
+
   // 특정 방의 메시지들에서 보낸 사람 목록 가져오기
   const getSenders = (roomId) => {
     const messages = messagesMap[roomId] || [];
@@ -387,6 +471,31 @@ function EvaluateTab({ backend, headers, classId }) {
                       >
                         루브릭 업데이트
                       </button>
+                      <button
+                        onClick={() => evaluateTopicWithGPT(topic.topic_id)}
+                        disabled={batchProgressMap[topic.topic_id]?.running}
+                        style={{ ...styles.updateButton, marginLeft: "8px" }}
+                      >
+                        {batchProgressMap[topic.topic_id]?.running
+                          ? `전체 평가 중... (${batchProgressMap[topic.topic_id].done}/${batchProgressMap[topic.topic_id].total || "?"})`
+                          : "모든 채팅방 일괄 평가"}
+                      </button>
+                      <label style={{ marginLeft: "8px", fontSize: "13px", color: theme.NEUTRAL_TEXT }}>
+                        <input
+                          type="checkbox"
+                          checked={Boolean(forceRefreshMap[topic.topic_id])}
+                          onChange={(e) => setForceRefreshMap((prev) => ({ ...prev, [topic.topic_id]: e.target.checked }))}
+                          style={{ marginRight: "4px" }}
+                        />
+                        저장된 평가 무시하고 새로 평가
+                      </label>
+                      {batchProgressMap[topic.topic_id] && !batchProgressMap[topic.topic_id].running && (
+                        <span style={{ marginLeft: "8px", fontSize: "13px", color: theme.NEUTRAL_TEXT }}>
+                          ✅ {batchProgressMap[topic.topic_id].done}건 평가 완료
+                          {batchProgressMap[topic.topic_id].cached ? ` (저장된 평가 ${batchProgressMap[topic.topic_id].cached}건 재사용)` : ""}
+                          {batchProgressMap[topic.topic_id].failed ? ` (실패 ${batchProgressMap[topic.topic_id].failed}건)` : ""}
+                        </span>
+                      )}
                     </div>
                     
                     <div style={styles.roomsSection}>
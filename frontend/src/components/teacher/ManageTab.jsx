@@ -69,6 +69,11 @@ function ManageTab({ backend, headers, classId }) {
         headers: { ...headers, Prefer: "return=representation" },
         body: JSON.stringify({ system_prompt: newPrompt }),
       });
+
+      // 진행 중인 채팅방이 새 프롬프트를 쓰도록 백엔드 캐시 무효화
+      await fetch(`${import.meta.env.VITE_EVALUATE_API}/cache/topics/${topicId}/invalidate`, {
+        method: "POST",
+      }).catch((error) => console.error("프롬프트 캐시 무효화 실패:", error));
       alert("✅ 시스템 프롬프트가 수정되었습니다.");
       
       // 상태 업데이트
@@ -31,9 +31,16 @@ create table if not exists messages (
   message text,
   role text check (role in ('user', 'assistant')),
   reasoning text,
+  whisper_to text, -- 귓속말 대상 학생 (null이면 방 전체)
   timestamp timestamptz default now()
 );
 
+alter table messages add column if not exists whisper_to text;
+
+-- 방별 대화 기록 키셋 페이지네이션 ((timestamp, message_id) 커서) 용 인덱스
+create index if not exists messages_room_timestamp_id_idx
+  on messages (room_id, timestamp, message_id);
+
 -- ✅ 학생 목록 (로그인 용도)
 create table if not exists students (
   student_id text primary key,
@@ -51,4 +58,22 @@ create table if not exists gpt_interventions (
   target_student text,
   reasoning text,
   timestamp timestamptz default now()
-);
\ No newline at end of file
+);
+-- ✅ GPT 루브릭 평가 결과
+create table if not exists gpt_chat_evaluations (
+  evaluation_id uuid primary key default gen_random_uuid(),
+  topic_id uuid references topics(topic_id),
+  room_id uuid references rooms(room_id),
+  class_id uuid references classes(class_id),
+  student_id text, -- null이면 방 전체(group) 평가
+  conversation_id text,
+  summary text,
+  evaluation_type text, -- "group" | "individual"
+  cache_key text, -- sha256(모델, 루브릭, 정규화된 대화, 평가 대상): 같은 입력이면 저장된 평가 재사용
+  created_at timestamptz default now()
+);
+
+alter table gpt_chat_evaluations add column if not exists cache_key text;
+
+create index if not exists gpt_chat_evaluations_cache_key_idx
+  on gpt_chat_evaluations (cache_key, created_at desc);